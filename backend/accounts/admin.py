@@ -34,9 +34,9 @@ class CompanyAdminMixin:
 
 @admin.register(Company)
 class CompanyAdmin(admin.ModelAdmin):
-    list_display = ("id", "name", "is_deleted", "created_at")
+    list_display = ("id", "name", "plan", "is_deleted", "created_at")
     search_fields = ("name",)
-    list_filter = ("is_deleted",)
+    list_filter = ("plan", "is_deleted")
     
     def get_queryset(self, request):
         qs = super().get_queryset(request)
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:43
+
+from django.db import migrations, models
+
+
+def start_existing_rows_at_one(apps, schema_editor):
+    # So a first sync from cursor 0 returns rows that predate the sequence
+    apps.get_model('accounts', 'Company').objects.update(change_seq=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_alter_user_company'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, help_text='Last change sequence number handed out for /api/sync/'),
+        ),
+        migrations.RunPython(start_existing_rows_at_one, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_company_change_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='analysis_weight',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Share of AI analysis capacity relative to other companies'),
+        ),
+    ]
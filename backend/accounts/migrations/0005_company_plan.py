@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_company_analysis_weight'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='plan',
+            field=models.CharField(choices=[('free', 'Free'), ('standard', 'Standard'), ('enterprise', 'Enterprise')], default='standard', help_text='Sets the rate limits on AI analysis endpoints', max_length=20),
+        ),
+    ]
@@ -3,9 +3,21 @@ from django.db import models
 
 
 class Company(models.Model):
+    PLAN_FREE = "free"
+    PLAN_STANDARD = "standard"
+    PLAN_ENTERPRISE = "enterprise"
+    PLAN_CHOICES = [
+        (PLAN_FREE, "Free"),
+        (PLAN_STANDARD, "Standard"),
+        (PLAN_ENTERPRISE, "Enterprise"),
+    ]
+
     name = models.CharField(max_length=255, unique=True)
     is_deleted = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    change_seq = models.BigIntegerField(default=0, help_text="Last change sequence number handed out for /api/sync/")
+    plan = models.CharField(max_length=20, choices=PLAN_CHOICES, default=PLAN_STANDARD, help_text="Sets the rate limits on AI analysis endpoints")
+    analysis_weight = models.PositiveSmallIntegerField(default=1, help_text="Share of AI analysis capacity relative to other companies")
 
     def __str__(self) -> str:
         return self.name
@@ -1,7 +1,85 @@
+import json
+
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from accounts.models import Company
 from .models import Control, Evidence
 
 
+class EstimatedCountPaginator(Paginator):
+    """Paginator that takes large counts from the PostgreSQL planner.
+
+    An exact COUNT(*) over millions of rows runs on every changelist page.
+    The planner's row estimate for the same query (from table statistics,
+    kept fresh by autovacuum) costs next to nothing; it is used once it
+    reaches ``exact_below`` and otherwise the exact count is taken, so
+    small tables and narrow filters still show true numbers. Other
+    databases always count exactly.
+    """
+    exact_below = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if getattr(queryset, 'db', None) and connections[queryset.db].vendor == 'postgresql':
+            estimate = self._estimate(queryset)
+            if estimate >= self.exact_below:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def _estimate(queryset) -> int:
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        if isinstance(plan, list):
+            plan = plan[0]
+        return int(plan['Plan']['Plan Rows'])
+
+
+class CompanyInputFilter(admin.SimpleListFilter):
+    """Company filter typed as an id or name prefix instead of listed.
+
+    The stock related-field filter renders every company in the sidebar;
+    this one renders a text box and resolves matches with a subquery.
+    """
+    title = "company"
+    parameter_name = "company"
+    company_field = "company"
+    template = "admin/input_filter.html"
+
+    def lookups(self, request, model_admin):
+        # Never shown, but the filter is hidden when there are no lookups
+        return (("", ""),)
+
+    def choices(self, changelist):
+        # Only the "All" choice, carrying the other active filters for the form
+        all_choice = next(super().choices(changelist))
+        all_choice["query_parts"] = [
+            (key, value)
+            for key, values in changelist.get_filters_params().items()
+            if key != self.parameter_name
+            for value in values
+        ]
+        yield all_choice
+
+    def queryset(self, request, queryset):
+        value = (self.value() or "").strip()
+        if not value:
+            return queryset
+        if value.isdigit():
+            return queryset.filter(**{f"{self.company_field}_id": int(value)})
+        companies = Company.objects.filter(name__istartswith=value).values("id")
+        return queryset.filter(**{f"{self.company_field}_id__in": companies})
+
+
+class LargeTableAdminMixin:
+    """Changelist settings for tables with millions of rows"""
+    paginator = EstimatedCountPaginator
+    # Skips the second, unfiltered COUNT(*) behind "N total"
+    show_full_result_count = False
+
+
 class APIAdminMixin:
     """Mixin to restrict API admin access based on user role and company"""
     
@@ -31,10 +109,12 @@ class APIAdminMixin:
 
 
 @admin.register(Control)
-class ControlAdmin(APIAdminMixin, admin.ModelAdmin):
+class ControlAdmin(LargeTableAdminMixin, APIAdminMixin, admin.ModelAdmin):
     list_display = ("id", "name", "company", "status", "created_by", "created_at", "is_deleted")
-    list_filter = ("status", "company", "is_deleted")
+    list_select_related = ("company", "created_by")
+    list_filter = ("status", CompanyInputFilter, "is_deleted")
     search_fields = ("name",)
+    autocomplete_fields = ("company", "created_by")
 
     actions = [
         "mark_implemented",
@@ -45,16 +125,19 @@ class ControlAdmin(APIAdminMixin, admin.ModelAdmin):
         if request.user.role != "admin":
             self.message_user(request, "Only admins can perform bulk actions.", level='ERROR')
             return
-        queryset.update(status=Control.STATUS_IMPLEMENTED)
-        self.message_user(request, f"Marked {queryset.count()} controls as implemented.")
+        updated = queryset.exclude(status=Control.STATUS_IMPLEMENTED).update_tracked(status=Control.STATUS_IMPLEMENTED)
+        self.message_user(request, f"Marked {updated} controls as implemented.")
     mark_implemented.short_description = "Mark selected controls implemented"
 
 
 @admin.register(Evidence)
-class EvidenceAdmin(APIAdminMixin, admin.ModelAdmin):
+class EvidenceAdmin(LargeTableAdminMixin, APIAdminMixin, admin.ModelAdmin):
     list_display = ("id", "name", "control", "company", "status", "created_by", "created_at", "is_deleted")
-    list_filter = ("status", "company", "is_deleted")
+    # The control column shows Control.__str__, which includes the company
+    list_select_related = ("control__company", "company", "created_by")
+    list_filter = ("status", CompanyInputFilter, "is_deleted")
     search_fields = ("name",)
+    autocomplete_fields = ("control", "company", "created_by")
 
     actions = [
         "soft_delete",
@@ -65,9 +148,8 @@ class EvidenceAdmin(APIAdminMixin, admin.ModelAdmin):
         if request.user.role != "admin":
             self.message_user(request, "Only admins can perform bulk actions.", level='ERROR')
             return
-        count = queryset.count()
-        queryset.delete()
-        self.message_user(request, f"Soft deleted {count} evidence records.")
+        deleted = queryset.alive().delete()
+        self.message_user(request, f"Soft deleted {deleted} evidence records.")
     soft_delete.short_description = "Soft delete selected evidence"
 
 
@@ -0,0 +1,152 @@
+"""
+Read-only fast path for ModelSerializers used by list endpoints.
+
+``compile_serializer(EvidenceSerializer)`` inspects the serializer's fields
+once, turns them into a ``values_list()`` projection and generates a single
+row -> dict function for it. ``.data(queryset)`` then returns exactly what
+``Serializer(queryset, many=True).data`` would, without building model
+instances or calling ``to_representation`` field by field.
+"""
+import functools
+import operator
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.core.files.storage import FileSystemStorage
+from django.utils import timezone
+from django.utils.encoding import filepath_to_uri
+from rest_framework import serializers
+from rest_framework.settings import ISO_8601, api_settings
+
+
+def _datetime_converter(field):
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    if output_format is None or output_format.lower() != ISO_8601:
+        return lambda value, tz: field.to_representation(value)
+
+    def convert(value, tz):
+        # Aware values from the database; anything else takes DRF's path
+        if tz is None or value.tzinfo is None:
+            return field.to_representation(value)
+        value = value.astimezone(tz).isoformat()
+        if value.endswith('+00:00'):
+            return value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def _file_converter(field, model_field):
+    if not getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+        return lambda name, tz: name or None
+    storage = model_field.storage
+    url = storage.url
+    base_url = getattr(storage, 'base_url', None)
+    if not isinstance(storage, FileSystemStorage) or not base_url or not base_url.endswith('/'):
+        return lambda name, tz: url(name) if name else None
+
+    def convert(name, tz):
+        # FileSystemStorage.url() is urljoin(base_url, uri); for plain relative
+        # paths that is a concatenation, and urljoin is the bulk of the cost
+        if not name:
+            return None
+        uri = filepath_to_uri(name).lstrip('/')
+        if '//' in uri or '.' in uri and any(segment in ('.', '..') for segment in uri.split('/')):
+            return url(name)
+        return base_url + uri
+    return convert
+
+
+def _choice_converter(field):
+    mapping = field.choice_strings_to_values
+    if all(key == value for key, value in mapping.items()):
+        return None
+    return lambda value, tz: mapping.get(str(value), value)
+
+
+class CompiledSerializer:
+    """Precompiled read path for one ModelSerializer class"""
+
+    def __init__(self, serializer_class):
+        serializer = serializer_class()
+        model = serializer.Meta.model
+        self.serializer_class = serializer_class
+        self.columns = []
+        converters = {}
+        entries = []
+
+        for index, field in enumerate(serializer._readable_fields):
+            if field.source == '*' or '.' in field.source:
+                raise ImproperlyConfigured(
+                    f"{serializer_class.__name__}.{field.field_name} cannot be compiled: source {field.source!r}"
+                )
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                raise ImproperlyConfigured(
+                    f"{serializer_class.__name__}.{field.field_name} is not a model field"
+                )
+            self.columns.append(model_field.attname)
+
+            if isinstance(field, serializers.PrimaryKeyRelatedField) and field.pk_field is None:
+                converter = None
+            elif isinstance(field, serializers.DateTimeField):
+                converter = _datetime_converter(field)
+            elif isinstance(field, serializers.FileField):
+                converter = _file_converter(field, model_field)
+            elif isinstance(field, serializers.ChoiceField):
+                converter = _choice_converter(field)
+            elif isinstance(field, (serializers.CharField, serializers.IntegerField, serializers.BooleanField)):
+                converter = None
+            elif isinstance(field, serializers.RelatedField) or not isinstance(field, serializers.Field):
+                raise ImproperlyConfigured(
+                    f"{serializer_class.__name__}.{field.field_name} cannot be compiled: {type(field).__name__}"
+                )
+            else:
+                converter = lambda value, tz, field=field: field.to_representation(value)
+
+            if converter is None:
+                entries.append(f"{field.field_name!r}: row[{index}]")
+            else:
+                name = f"_c{index}"
+                converters[name] = converter
+                entries.append(
+                    f"{field.field_name!r}: None if row[{index}] is None else {name}(row[{index}], tz)"
+                )
+
+        source = "def to_dict(row, tz):\n    return {" + ", ".join(entries) + "}\n"
+        namespace = dict(converters)
+        exec(compile(source, f"<compiled {serializer_class.__name__}>", "exec"), namespace)
+        self.to_dict = namespace["to_dict"]
+        self.source = source
+        self._row_from_instance = operator.attrgetter(*self.columns) if len(self.columns) > 1 else (
+            lambda obj, getter=operator.attrgetter(self.columns[0]): (getter(obj),)
+        )
+
+    def data(self, queryset, chunk_size=None):
+        """List of dicts equal to ``serializer_class(queryset, many=True).data``"""
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        rows = queryset.values_list(*self.columns)
+        if chunk_size:
+            rows = rows.iterator(chunk_size=chunk_size)
+        to_dict = self.to_dict
+        return [to_dict(row, tz) for row in rows]
+
+    def represent(self, instances):
+        """Same output for model instances already loaded, e.g. by a Prefetch"""
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        to_dict = self.to_dict
+        row_from_instance = self._row_from_instance
+        return [to_dict(row_from_instance(obj), tz) for obj in instances]
+
+    def iterate(self, queryset, chunk_size=2000):
+        """Yield dicts one by one, for streaming responses"""
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        to_dict = self.to_dict
+        for row in queryset.values_list(*self.columns).iterator(chunk_size=chunk_size):
+            yield to_dict(row, tz)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_serializer(serializer_class) -> CompiledSerializer:
+    """Compile ``serializer_class`` once per process"""
+    return CompiledSerializer(serializer_class)
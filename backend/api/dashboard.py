@@ -0,0 +1,106 @@
+"""
+Everything the dashboard needs on first load, in one response.
+
+Runs a fixed number of queries whatever the company size: the company, the
+controls with their evidence counts annotated, and the alive evidence with
+compliance checks joined, prefetched onto the controls newest first. Each
+evidence row carries its check's ``compliance_check_status``.
+
+``compliance_checks`` holds the first keyset page of the check list only;
+``next_cursor`` continues it through ``/api/compliance/checks/?cursor=``,
+which lists the same alive checks (``ComplianceCheck.objects.alive()``).
+"""
+from typing import Any, Dict
+
+from django.db.models import Count, Prefetch, Q
+
+from compliance.views import CHECKS_PAGE_SIZE, encode_cursor
+from .compiled import compile_serializer
+from .models import Control, Evidence
+from .serializers import ControlSerializer, EvidenceSerializer
+
+
+def _check_summary(evidence: Evidence, control: Control) -> Dict[str, Any]:
+    check = evidence.compliance_check
+    return {
+        "id": check.id,
+        "evidence_id": evidence.id,
+        "evidence_name": evidence.name,
+        "control_id": control.id,
+        "control_name": control.name,
+        "status": check.status,
+        "is_compliant": check.is_compliant,
+        "confidence": check.confidence,
+        "control_type": check.control_type,
+        "created_at": check.created_at.isoformat(),
+        "updated_at": check.updated_at.isoformat(),
+    }
+
+
+def dashboard_payload(user) -> Dict[str, Any]:
+    company = user.company
+    alive_evidence = Evidence.objects.alive().select_related("compliance_check").order_by("-created_at", "-id")
+    controls = list(
+        Control.objects.alive()
+        .filter(company=company)
+        .annotate(
+            evidence_count=Count("evidence", filter=Q(evidence__is_deleted=False)),
+            approved_evidence_count=Count(
+                "evidence", filter=Q(evidence__is_deleted=False, evidence__status=Evidence.STATUS_APPROVED)
+            ),
+        )
+        .prefetch_related(Prefetch("evidence", queryset=alive_evidence, to_attr="alive_evidence"))
+        .order_by("id")
+    )
+
+    control_rows = compile_serializer(ControlSerializer).represent(controls)
+    evidence_serializer = compile_serializer(EvidenceSerializer)
+    evidence, checks = [], []
+    check_counts: Dict[str, int] = {}
+    for control, row in zip(controls, control_rows):
+        evidence_rows = evidence_serializer.represent(control.alive_evidence)
+        evidence.extend(evidence_rows)
+        latest_check = None
+        for item, evidence_row in zip(control.alive_evidence, evidence_rows):
+            # Set on every row, so badges do not depend on which check pages are loaded
+            has_check = hasattr(item, "compliance_check")
+            evidence_row["compliance_check_status"] = item.compliance_check.status if has_check else None
+            if not has_check:
+                continue
+            checks.append((item.compliance_check, item, control))
+            check_counts[item.compliance_check.status] = check_counts.get(item.compliance_check.status, 0) + 1
+            latest_check = latest_check or item.compliance_check
+        row.update({
+            "evidence_count": control.evidence_count,
+            "approved_evidence_count": control.approved_evidence_count,
+            "latest_evidence": evidence_rows[0] if evidence_rows else None,
+            "latest_check_status": latest_check.status if latest_check else None,
+        })
+
+    evidence.sort(key=lambda row: row["id"])
+    checks.sort(key=lambda entry: (entry[0].created_at, entry[0].id), reverse=True)
+    next_cursor = None
+    if len(checks) > CHECKS_PAGE_SIZE:
+        last = checks[CHECKS_PAGE_SIZE - 1][0]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    check_page = [_check_summary(item, control) for _, item, control in checks[:CHECKS_PAGE_SIZE]]
+    return {
+        "user": {
+            "id": user.id,
+            "email": user.email,
+            "role": user.role,
+            "company": company.name,
+        },
+        "company": {"id": company.id, "name": company.name},
+        "summary": {
+            "controls": len(controls),
+            "controls_implemented": sum(1 for control in controls if control.status == Control.STATUS_IMPLEMENTED),
+            "evidence": len(evidence),
+            "evidence_approved": sum(control.approved_evidence_count for control in controls),
+            "checks": check_counts,
+        },
+        "controls": control_rows,
+        "evidence": evidence,
+        "compliance_checks": check_page,
+        "next_cursor": next_cursor,
+    }
@@ -0,0 +1,167 @@
+"""
+Streaming audit package for /api/export/.
+
+The ZIP is produced while it is sent: ``zipfile`` writes into a sink that the
+response generator drains, database rows come from ``.iterator()`` and files
+are copied in fixed-size chunks, so memory stays flat however much evidence
+a company has. Layout::
+
+    controls.ndjson     one JSON object per control
+    evidence.ndjson     one JSON object per evidence, with its AI verdict
+    manifest.csv        the evidence rows flattened for spreadsheets
+    evidence/<id>_<filename>
+    missing.ndjson      evidence whose file could not be read, if any
+"""
+import csv
+import io
+import os
+import zipfile
+from typing import Any, Dict, Iterator
+
+from django.utils import timezone
+
+from .fastjson import dumps
+from .models import Control, Evidence
+
+
+QUERY_CHUNK_SIZE = 2000
+FILE_CHUNK_SIZE = 1024 * 1024
+FLUSH_SIZE = 64 * 1024
+
+CONTROL_FIELDS = ("id", "name", "status", "created_by_id", "created_at", "updated_at")
+EVIDENCE_FIELDS = (
+    "id", "name", "file", "status", "control_id", "control__name", "created_by_id", "created_at", "updated_at",
+    "perceptual_hash", "compliance_check__status", "compliance_check__is_compliant",
+    "compliance_check__confidence", "compliance_check__control_type", "compliance_check__model",
+    "compliance_check__prompt_version", "compliance_check__detected_elements",
+    "compliance_check__rejection_reason", "compliance_check__updated_at",
+)
+CSV_COLUMNS = (
+    "evidence_id", "evidence_name", "archive_path", "evidence_status", "control_id", "control_name",
+    "created_at", "check_status", "is_compliant", "confidence", "control_type", "model",
+    "prompt_version", "detected_elements", "rejection_reason", "checked_at",
+)
+
+
+class _Sink:
+    """Write-only file object that collects what zipfile writes until drained"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data) -> int:
+        self._buffer += data
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self, minimum: int = FLUSH_SIZE) -> Iterator[bytes]:
+        if self._buffer and len(self._buffer) >= minimum:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            yield data
+
+
+def archive_path(evidence_id: int, file_name: str) -> str:
+    return f"evidence/{evidence_id}_{os.path.basename(file_name)}"
+
+
+def _evidence_record(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "file": row["file"],
+        "archive_path": archive_path(row["id"], row["file"]) if row["file"] else None,
+        "status": row["status"],
+        "control_id": row["control_id"],
+        "control_name": row["control__name"],
+        "created_by": row["created_by_id"],
+        "created_at": row["created_at"],
+        "updated_at": row["updated_at"],
+        "perceptual_hash": row["perceptual_hash"],
+        "compliance_check": None if row["compliance_check__status"] is None else {
+            "status": row["compliance_check__status"],
+            "is_compliant": row["compliance_check__is_compliant"],
+            "confidence": row["compliance_check__confidence"],
+            "control_type": row["compliance_check__control_type"],
+            "model": row["compliance_check__model"],
+            "prompt_version": row["compliance_check__prompt_version"],
+            "detected_elements": row["compliance_check__detected_elements"],
+            "rejection_reason": row["compliance_check__rejection_reason"],
+            "checked_at": row["compliance_check__updated_at"],
+        },
+    }
+
+
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_cell(value: Any) -> Any:
+    """Quote text a spreadsheet would run as a formula, such as user-entered names"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return f"'{value}"
+    return value
+
+
+def _csv_row(record: Dict[str, Any]) -> list:
+    check = record["compliance_check"] or {}
+    checked_at = check.get("checked_at")
+    return [_csv_cell(value) for value in [
+        record["id"], record["name"], record["archive_path"] or "", record["status"], record["control_id"],
+        record["control_name"], record["created_at"].isoformat(), check.get("status", ""),
+        "" if check.get("is_compliant") is None else check["is_compliant"],
+        "" if check.get("confidence") is None else check["confidence"], check.get("control_type", ""),
+        check.get("model", ""), check.get("prompt_version", ""), "; ".join(check.get("detected_elements") or []),
+        check.get("rejection_reason", ""), checked_at.isoformat() if checked_at else "",
+    ]]
+
+
+def stream_audit_package(company) -> Iterator[bytes]:
+    """Yield the audit ZIP for ``company`` chunk by chunk"""
+    sink = _Sink()
+    controls = Control.objects.alive().filter(company=company).order_by("id").values(*CONTROL_FIELDS)
+    evidence = Evidence.objects.alive().filter(company=company).order_by("id").values(*EVIDENCE_FIELDS)
+    storage = Evidence._meta.get_field("file").storage
+
+    with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as archive:
+        with archive.open("controls.ndjson", "w", force_zip64=True) as out:
+            for row in controls.iterator(chunk_size=QUERY_CHUNK_SIZE):
+                row["created_by"] = row.pop("created_by_id")
+                out.write(dumps(row) + b"\n")
+                yield from sink.drain()
+
+        with archive.open("evidence.ndjson", "w", force_zip64=True) as out:
+            for row in evidence.iterator(chunk_size=QUERY_CHUNK_SIZE):
+                out.write(dumps(_evidence_record(row)) + b"\n")
+                yield from sink.drain()
+
+        with archive.open("manifest.csv", "w", force_zip64=True) as out:
+            text = io.TextIOWrapper(out, encoding="utf-8", newline="", write_through=True)
+            writer = csv.writer(text)
+            writer.writerow(CSV_COLUMNS)
+            for row in evidence.iterator(chunk_size=QUERY_CHUNK_SIZE):
+                writer.writerow(_csv_row(_evidence_record(row)))
+                yield from sink.drain()
+            text.detach()
+
+        missing = []
+        files = evidence.exclude(file="").values_list("id", "file", "created_at")
+        for evidence_id, file_name, created_at in files.iterator(chunk_size=QUERY_CHUNK_SIZE):
+            info = zipfile.ZipInfo(archive_path(evidence_id, file_name), timezone.localtime(created_at).timetuple()[:6])
+            # Screenshots are already compressed
+            info.compress_type = zipfile.ZIP_STORED
+            try:
+                source = storage.open(file_name, "rb")
+            except OSError as e:
+                missing.append({"id": evidence_id, "file": file_name, "error": str(e)})
+                continue
+            with source, archive.open(info, "w", force_zip64=True) as out:
+                for chunk in iter(lambda: source.read(FILE_CHUNK_SIZE), b""):
+                    out.write(chunk)
+                    yield from sink.drain()
+
+        if missing:
+            archive.writestr("missing.ndjson", b"".join(dumps(item) + b"\n" for item in missing))
+
+    yield from sink.drain(minimum=1)
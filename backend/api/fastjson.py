@@ -0,0 +1,111 @@
+"""
+orjson-backed JSON encoding for the whole project.
+
+``JsonResponse`` is a drop-in replacement for ``django.http.JsonResponse``
+and ``StreamingJsonResponse`` streams large arrays without building the full
+document in memory. The DRF renderer and parser in ``api.renderers`` and
+``api.parsers`` use the same ``dumps``/``loads``.
+"""
+import datetime
+import decimal
+
+import orjson
+from django.db.models.query import QuerySet
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+
+
+JSONDecodeError = orjson.JSONDecodeError
+
+# datetimes, dates, times and UUIDs are encoded natively; UTC as "Z" like
+# DjangoJSONEncoder, dict keys may be ints (e.g. counters keyed by id)
+DUMPS_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_UUID
+
+# U+2028/U+2029 are valid JSON but not valid JavaScript string literals
+_LINE_SEPARATORS = (b'\xe2\x80\xa8', b'\xe2\x80\xa9')
+
+
+def _default(obj):
+    """Types orjson does not handle natively, encoded the way DRF does"""
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    if isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, QuerySet):
+        return list(obj)
+    if isinstance(obj, bytes):
+        return obj.decode()
+    if isinstance(obj, (tuple, set, frozenset)) or hasattr(obj, '__iter__'):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(data, indent: bool = False) -> bytes:
+    """Encode ``data`` to compact UTF-8 JSON bytes"""
+    options = DUMPS_OPTIONS | orjson.OPT_INDENT_2 if indent else DUMPS_OPTIONS
+    content = orjson.dumps(data, default=_default, option=options)
+    if _LINE_SEPARATORS[0] in content or _LINE_SEPARATORS[1] in content:
+        content = content.replace(_LINE_SEPARATORS[0], b'\\u2028').replace(_LINE_SEPARATORS[1], b'\\u2029')
+    return content
+
+
+def loads(data):
+    """Decode JSON from bytes or str; raises JSONDecodeError (a ValueError)"""
+    return orjson.loads(data)
+
+
+class JsonResponse(HttpResponse):
+    """Same contract as django.http.JsonResponse, encoded with orjson.
+
+    ``encoder`` and ``json_dumps_params`` are accepted for compatibility and
+    ignored.
+    """
+
+    def __init__(self, data, encoder=None, safe=True, json_dumps_params=None, **kwargs):
+        if safe and not isinstance(data, dict):
+            raise TypeError(
+                "In order to allow non-dict objects to be serialized set the "
+                "safe parameter to False."
+            )
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(content=dumps(data), **kwargs)
+
+
+class StreamingJsonResponse(StreamingHttpResponse):
+    """Stream ``{"<key>": [item, ...], **extra}`` or a bare array.
+
+    ``items`` may be any iterable (e.g. ``queryset.values().iterator()``);
+    items are encoded one at a time and flushed in ``chunk_size`` byte
+    chunks, so memory stays flat however long the array is.
+    """
+
+    def __init__(self, items, key=None, extra=None, chunk_size=64 * 1024, **kwargs):
+        kwargs.setdefault("content_type", "application/json")
+        super().__init__(self._stream(items, key, extra or {}, chunk_size), **kwargs)
+
+    @staticmethod
+    def _stream(items, key, extra, chunk_size):
+        if key is None:
+            opening, closing = b'[', b']'
+        else:
+            opening = b'{' + dumps(key) + b':['
+            closing = b']'
+            for name, value in extra.items():
+                closing += b',' + dumps(name) + b':' + dumps(value)
+            closing += b'}'
+
+        buffer = bytearray(opening)
+        first = True
+        for item in items:
+            if not first:
+                buffer += b','
+            buffer += dumps(item)
+            first = False
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+        buffer += closing
+        yield bytes(buffer)
@@ -0,0 +1,140 @@
+"""
+Idempotency-Key support for POST endpoints.
+
+The first request with a key claims a row in ``IdempotencyKey`` and runs the
+view; its response (unless a 5xx or 429, which stay retryable) is stored
+compressed for ``IDEMPOTENCY_KEY_TTL`` seconds and replayed to every retry.
+A duplicate that arrives while the first request is still running gets 409
+with ``Retry-After`` at once rather than holding a worker while it waits, so
+the work is only done once and the client retries with the same key. If the
+first request's worker dies, its claim expires after
+``IDEMPOTENCY_LOCK_SECONDS`` and the next duplicate takes over.
+"""
+import functools
+import hashlib
+import logging
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse
+from django.utils import timezone
+
+from compliance.tracing import parse_multipart
+from .fastjson import JsonResponse
+from .models import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+
+def _setting(name: str, default: int) -> int:
+    return getattr(settings, name, default)
+
+
+def _file_digest(uploaded) -> str:
+    """SHA-256 of an uploaded file, read in chunks and rewound for the view"""
+    digest = hashlib.sha256()
+    for chunk in uploaded.chunks():
+        digest.update(chunk)
+    uploaded.seek(0)
+    return digest.hexdigest()
+
+
+def _request_hash(request) -> str:
+    """Fingerprint of the request payload, without reading uploads into memory"""
+    digest = hashlib.sha256(f'{request.method} {request.path}'.encode())
+    if request.content_type == 'multipart/form-data':
+        parse_multipart(request)
+        for name, values in sorted(request.POST.lists()):
+            digest.update(repr((name, values)).encode())
+        for name, files in sorted(request.FILES.lists()):
+            digest.update(repr((name, [(f.name, f.size, _file_digest(f)) for f in files])).encode())
+    else:
+        digest.update(request.body)
+    return digest.hexdigest()
+
+
+def _replay(row: IdempotencyKey) -> HttpResponse:
+    response = HttpResponse(zlib.decompress(bytes(row.body)), status=row.status_code, content_type=row.content_type)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _claim(key: str, request_hash: str) -> bool:
+    now = timezone.now()
+    lock_until = now + timedelta(seconds=_setting('IDEMPOTENCY_LOCK_SECONDS', 120))
+    expires_at = now + timedelta(seconds=_setting('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+    # Drop an expired response for the same key, or a claim whose worker died
+    IdempotencyKey.objects.filter(key=key).filter(expires_at__lt=now).delete()
+    if IdempotencyKey.objects.filter(key=key, status_code__isnull=True, locked_until__lt=now).update(
+        request_hash=request_hash, locked_until=lock_until, expires_at=expires_at
+    ):
+        return True
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(
+                key=key, request_hash=request_hash, locked_until=lock_until, expires_at=expires_at
+            )
+        return True
+    except IntegrityError:
+        return False
+
+
+def _in_progress() -> HttpResponse:
+    response = JsonResponse({"detail": "A request with this Idempotency-Key is still in progress"}, status=409)
+    response['Retry-After'] = str(_setting('IDEMPOTENCY_RETRY_AFTER', 1))
+    return response
+
+
+def idempotent(endpoint: str):
+    """Honour an ``Idempotency-Key`` request header on a POST view.
+
+    Keys are scoped to the authenticated user and ``endpoint``. Reusing a key
+    with a different payload is answered with 422. Goes outside
+    ``@api_view`` so DRF responses are stored after rendering.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(request, *args, **kwargs):
+            client_key = request.headers.get('Idempotency-Key')
+            if not client_key or not request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            if len(client_key) > 255:
+                return JsonResponse({"detail": "Idempotency-Key must be at most 255 characters"}, status=400)
+
+            key = hashlib.sha256(f'{request.user.pk}|{endpoint}|{client_key}'.encode()).hexdigest()
+            request_hash = _request_hash(request)
+
+            if not _claim(key, request_hash):
+                row = IdempotencyKey.objects.filter(key=key).first()
+                if row is not None and row.request_hash != request_hash:
+                    return JsonResponse(
+                        {"detail": "Idempotency-Key was already used for a different request"}, status=422
+                    )
+                if row is not None and row.status_code is not None:
+                    return _replay(row)
+                # Still running, or released for a retry since the claim failed
+                return _in_progress()
+
+            try:
+                response = view(request, *args, **kwargs)
+                if callable(getattr(response, 'render', None)):
+                    response = response.render()
+            except Exception:
+                IdempotencyKey.objects.filter(key=key).delete()
+                raise
+
+            # Server errors and rate limit refusals stay retryable
+            if response.status_code >= 500 or response.status_code == 429 or response.streaming:
+                IdempotencyKey.objects.filter(key=key).delete()
+            else:
+                IdempotencyKey.objects.filter(key=key).update(
+                    status_code=response.status_code,
+                    content_type=response.get('Content-Type', ''),
+                    body=zlib.compress(response.content),
+                    locked_until=None,
+                )
+            return response
+        return wrapped
+    return decorator
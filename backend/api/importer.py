@@ -0,0 +1,150 @@
+"""
+Bulk evidence import from a ZIP of screenshots.
+
+Entries are streamed one at a time from the archive into storage, controls
+are resolved with a single query up front, and Evidence plus pending
+ComplianceCheck rows are written with ``bulk_create`` in batches. The
+pending checks are the analysis queue: ``run_compliance_worker`` picks them
+up, so nothing waits on the AI service during the import.
+
+The mapping assigns archive paths to controls (by id or name). Keys are
+either full paths or directory prefixes ending in ``/``; the longest match
+wins. Entries without a match fall back to their top-level directory name
+used as a control name.
+"""
+import os
+import zipfile
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Control, Evidence, next_change_seq
+
+
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp', '.bmp'}
+DEFAULT_BATCH_SIZE = 200
+
+ControlRef = Union[int, str]
+ProgressCallback = Callable[[int, int, int], None]
+
+
+class ImportSummary:
+    def __init__(self):
+        self.created_ids: List[int] = []
+        self.skipped: List[Dict[str, str]] = []
+
+    def skip(self, path: str, reason: str) -> None:
+        self.skipped.append({'path': path, 'reason': reason})
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'created': len(self.created_ids),
+            'evidence_ids': self.created_ids,
+            'skipped': self.skipped,
+        }
+
+
+def _control_ref(path: str, mapping: Dict[str, ControlRef]) -> Optional[ControlRef]:
+    if path in mapping:
+        return mapping[path]
+    prefixes = [key for key in mapping if key.endswith('/') and path.startswith(key)]
+    if prefixes:
+        return mapping[max(prefixes, key=len)]
+    if '/' in path:
+        return path.split('/', 1)[0]
+    return mapping.get('*')
+
+
+def _resolve_controls(company, refs) -> Dict[ControlRef, Control]:
+    """Look up every referenced control, by id or name, in one query"""
+    ids = {int(ref) for ref in refs if isinstance(ref, int) or str(ref).isdigit()}
+    names = {ref for ref in refs if isinstance(ref, str)}
+    controls = Control.objects.alive().filter(company=company).filter(Q(id__in=ids) | Q(name__in=names))
+    resolved = {}
+    for control in controls:
+        resolved[control.id] = resolved[str(control.id)] = control
+        resolved.setdefault(control.name, control)
+    return resolved
+
+
+def import_evidence_archive(archive_file, company, user, mapping: Optional[Dict[str, ControlRef]] = None,
+                            batch_size: int = DEFAULT_BATCH_SIZE,
+                            progress: Optional[ProgressCallback] = None) -> Dict[str, Any]:
+    """Import every image in the ZIP as evidence with a pending compliance check.
+
+    ``progress(done, total, created)`` is called after each batch.
+    """
+    from compliance.models import ComplianceCheck
+    from compliance.phash import compute_dhash
+
+    mapping = mapping or {}
+    max_size = getattr(settings, 'EVIDENCE_IMPORT_MAX_FILE_SIZE', 20 * 1024 * 1024)
+    file_field = Evidence._meta.get_field('file')
+    summary = ImportSummary()
+
+    with zipfile.ZipFile(archive_file) as archive:
+        entries = [info for info in archive.infolist() if not info.is_dir()]
+        refs = {path: _control_ref(path, mapping) for path in (info.filename for info in entries)}
+        controls = _resolve_controls(company, {ref for ref in refs.values() if ref is not None})
+
+        def flush(batch):
+            try:
+                with transaction.atomic():
+                    change_seq = next_change_seq(company.id)
+                    for evidence in batch:
+                        evidence.change_seq = change_seq
+                    created = Evidence.objects.bulk_create(batch)
+                    ComplianceCheck.objects.bulk_create([
+                        ComplianceCheck(
+                            evidence=evidence,
+                            status=ComplianceCheck.STATUS_PENDING,
+                            priority=ComplianceCheck.PRIORITY_BACKGROUND,
+                            queued_at=evidence.created_at,
+                            change_seq=change_seq,
+                        )
+                        for evidence in created
+                    ])
+            except Exception:
+                # The rows were rolled back, so nothing references the stored files
+                for evidence in batch:
+                    file_field.storage.delete(evidence.file.name)
+                raise
+            summary.created_ids.extend(evidence.id for evidence in created)
+
+        batch: List[Evidence] = []
+        for done, info in enumerate(entries, start=1):
+            path = info.filename
+            name = os.path.basename(path)
+            control = controls.get(refs[path])
+            if os.path.splitext(name)[1].lower() not in IMAGE_EXTENSIONS:
+                summary.skip(path, 'not an image')
+            elif control is None:
+                summary.skip(path, f'no control for {refs[path]!r}' if refs[path] is not None else 'no control mapping')
+            elif info.file_size > max_size:
+                summary.skip(path, 'file too large')
+            else:
+                with archive.open(info) as source:
+                    perceptual_hash = compute_dhash(source)
+                    stored_name = file_field.storage.save(
+                        file_field.generate_filename(None, name), File(source, name=name)
+                    )
+                batch.append(Evidence(
+                    name=name,
+                    file=stored_name,
+                    perceptual_hash=perceptual_hash,
+                    control=control,
+                    company=company,
+                    created_by=user,
+                    status=Evidence.STATUS_REJECTED,  # Until the queued analysis approves it
+                ))
+
+            if len(batch) >= batch_size or (done == len(entries) and batch):
+                flush(batch)
+                batch = []
+                if progress:
+                    progress(done, len(entries), len(summary.created_ids))
+
+    return summary.as_dict()
@@ -0,0 +1,79 @@
+import gc
+import json
+import time
+import tracemalloc
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.fastjson import StreamingJsonResponse
+from api.renderers import ORJSONRenderer
+
+
+class Command(BaseCommand):
+    help = "Compare JSON encoders on a synthetic evidence listing (time and peak allocations)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        rows = self._rows(options["rows"])
+        payload = {"evidence": rows}
+        drf = JSONRenderer()
+        fast = ORJSONRenderer()
+
+        encoders = [
+            ("json + DjangoJSONEncoder", lambda: json.dumps(payload, cls=DjangoJSONEncoder).encode()),
+            ("DRF JSONRenderer", lambda: drf.render(payload)),
+            ("ORJSONRenderer", lambda: fast.render(payload)),
+            ("StreamingJsonResponse", lambda: b"".join(StreamingJsonResponse(iter(rows), key="evidence").streaming_content)),
+        ]
+
+        baseline = None
+        self.stdout.write(f"{options['rows']} rows, best of {options['repeat']}")
+        for label, encode in encoders:
+            seconds, peak, size = self._measure(encode, options["repeat"])
+            baseline = baseline or seconds
+            self.stdout.write(
+                f"{label:<28} {seconds * 1000:8.1f} ms  x{baseline / seconds:5.1f}  "
+                f"peak {peak / 1024:8.0f} KiB  {size / 1024:8.0f} KiB out"
+            )
+
+    def _rows(self, count):
+        now = timezone.now()
+        return [
+            {
+                "id": index,
+                "name": f"Screenshot {index}.png",
+                "status": "approved" if index % 3 else "rejected",
+                "control": index % 40,
+                "control_name": "MFA Control",
+                "file_size": Decimal("1048.5"),
+                "created_at": now - timedelta(minutes=index),
+                "updated_at": now,
+                "detected_elements": ["OTP input field", "6-digit code format"],
+                "is_deleted": False,
+            }
+            for index in range(count)
+        ]
+
+    def _measure(self, encode, repeat):
+        best = None
+        for _ in range(repeat):
+            gc.collect()
+            start = time.perf_counter()
+            output = encode()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+
+        gc.collect()
+        tracemalloc.start()
+        encode()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return best, peak, len(output)
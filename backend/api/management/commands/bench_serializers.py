@@ -0,0 +1,76 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from accounts.models import Company, User
+from api.compiled import compile_serializer
+from api.models import Control, Evidence
+from api.renderers import ORJSONRenderer
+from api.serializers import ControlSerializer, EvidenceSerializer
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Compare DRF list serialization with the compiled read path (rows are rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options["rows"], options["repeat"])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _run(self, count, repeat):
+        company = Company.objects.create(name="Benchmark Corp")
+        user = User.objects.create(username="benchmark-user", company=company)
+        controls = Control.objects.bulk_create(
+            Control(name=f"Control {index}", company=company, created_by=user) for index in range(count // 10 or 1)
+        )
+        Evidence.objects.bulk_create(
+            (
+                Evidence(
+                    name=f"Screenshot {index}",
+                    file=f"evidence/screenshot_{index}.png",
+                    control=controls[index % len(controls)],
+                    company=company,
+                    created_by=user,
+                    status=Evidence.STATUS_APPROVED if index % 3 else Evidence.STATUS_REJECTED,
+                )
+                for index in range(count)
+            ),
+            batch_size=1000,
+        )
+
+        renderer = ORJSONRenderer()
+        for serializer_class, queryset in (
+            (ControlSerializer, Control.objects.alive().filter(company=company)),
+            (EvidenceSerializer, Evidence.objects.alive().filter(company=company)),
+        ):
+            compiled = compile_serializer(serializer_class)
+            drf_seconds, drf_output = self._measure(lambda: serializer_class(queryset, many=True).data, repeat)
+            fast_seconds, fast_output = self._measure(lambda: compiled.data(queryset), repeat)
+            if renderer.render(drf_output) != renderer.render(fast_output):
+                raise CommandError(f"{serializer_class.__name__}: compiled output differs from DRF")
+            self.stdout.write(
+                f"{serializer_class.__name__:<20} {len(fast_output):6} rows  "
+                f"DRF {drf_seconds * 1000:8.1f} ms  compiled {fast_seconds * 1000:8.1f} ms  "
+                f"x{drf_seconds / fast_seconds:5.1f}  output identical"
+            )
+
+    def _measure(self, fn, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            output = fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
@@ -0,0 +1,48 @@
+import json
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import Company
+from api.importer import DEFAULT_BATCH_SIZE, import_evidence_archive
+
+
+class Command(BaseCommand):
+    help = "Import a ZIP of evidence screenshots for a company and queue their compliance checks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("archive", help="Path to the ZIP file")
+        parser.add_argument("--company", required=True, help="Company id or name")
+        parser.add_argument("--user", required=True, help="Username recorded as the uploader")
+        parser.add_argument("--mapping", help="JSON file mapping archive paths or directory/ prefixes to control ids or names")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        company_ref = options["company"]
+        try:
+            if company_ref.isdigit():
+                company = Company.objects.get(id=int(company_ref))
+            else:
+                company = Company.objects.get(name=company_ref)
+            user = get_user_model().objects.get(username=options["user"], company=company)
+        except (Company.DoesNotExist, get_user_model().DoesNotExist) as e:
+            raise CommandError(str(e))
+
+        mapping = {}
+        if options["mapping"]:
+            with open(options["mapping"]) as f:
+                mapping = json.load(f)
+
+        def progress(done, total, created):
+            self.stdout.write(f"{done}/{total} entries read, {created} evidence created")
+
+        with open(options["archive"], "rb") as archive:
+            summary = import_evidence_archive(
+                archive, company, user, mapping, batch_size=options["batch_size"], progress=progress
+            )
+
+        for skipped in summary["skipped"]:
+            self.stdout.write(self.style.WARNING(f"Skipped {skipped['path']}: {skipped['reason']}"))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {summary['created']} evidence; compliance checks queued for run_compliance_worker"
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = "Delete stored Idempotency-Key responses past their TTL"
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.expired().delete()
+        self.stdout.write(f"Deleted {deleted} expired idempotency keys")
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_alter_evidence_control'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='evidence',
+            name='perceptual_hash',
+            field=models.CharField(blank=True, default='', help_text='dHash of the image, hex encoded', max_length=16),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:43
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def start_existing_rows_at_one(apps, schema_editor):
+    # So a first sync from cursor 0 returns rows that predate the sequence
+    apps.get_model('api', 'Control').objects.update(change_seq=1)
+    apps.get_model('api', 'Evidence').objects.update(change_seq=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_company_change_seq'),
+        ('api', '0003_evidence_perceptual_hash'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='control',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, help_text='Company change sequence of the last write'),
+        ),
+        migrations.AddField(
+            model_name='control',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='evidence',
+            name='change_seq',
+            field=models.BigIntegerField(default=0, help_text='Company change sequence of the last write'),
+        ),
+        migrations.AddField(
+            model_name='evidence',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='control',
+            index=models.Index(fields=['company', 'change_seq'], name='control_company_change_seq'),
+        ),
+        migrations.AddIndex(
+            model_name='evidence',
+            index=models.Index(fields=['company', 'change_seq'], name='evidence_company_change_seq'),
+        ),
+        migrations.RunPython(start_existing_rows_at_one, migrations.RunPython.noop),
+    ]
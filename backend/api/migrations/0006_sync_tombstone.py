@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_company_plan'),
+        ('api', '0005_idempotency_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('control', 'Control'), ('evidence', 'Evidence'), ('compliance_check', 'Compliance check')], max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('change_seq', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_tombstones', to='accounts.company')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['company', 'change_seq'], name='sync_tombstone_company_seq')],
+            },
+        ),
+    ]
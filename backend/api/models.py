@@ -1,12 +1,80 @@
-from django.db import models
+from django.db import connections, models, router, transaction
+from django.db.models import F, OuterRef, Subquery
 from django.conf import settings
+from django.utils import timezone
+
+from .response_cache import bump_data_version, bump_data_versions
+
+
+def next_change_seq(company_id) -> int:
+	"""Allocate the company's next change sequence number for /api/sync/.
+
+	Call it inside the transaction that writes the changed rows: the
+	``UPDATE ... RETURNING`` holds the company row lock until commit, so
+	numbers become visible in order and a sync cursor never skips a change.
+	Also invalidates the company's cached responses.
+
+	The lock is also the cost: every write to one company queues on that row
+	until the holder commits, so concurrent writers of a busy tenant are
+	serialised here (other companies are unaffected). Take the number as late
+	as possible in the transaction and never hold it across slow work such as
+	an AI call or a file upload.
+	"""
+	from accounts.models import Company
+
+	bump_data_version(company_id)
+	if company_id is None:
+		return 0
+	connection = connections[router.db_for_write(Company)]
+	table = connection.ops.quote_name(Company._meta.db_table)
+	with connection.cursor() as cursor:
+		cursor.execute(
+			f'UPDATE {table} SET change_seq = change_seq + 1 WHERE id = %s RETURNING change_seq', [company_id]
+		)
+		row = cursor.fetchone()
+	if row is None:
+		raise Company.DoesNotExist(f"Company {company_id} does not exist")
+	return row[0]
+
+
+def record_tombstone(kind: str, company_id, object_id: int) -> None:
+	"""Leave a SyncTombstone for a row deleted outright, inside the deleting transaction"""
+	if company_id is None:
+		return
+	SyncTombstone.objects.create(
+		company_id=company_id, kind=kind, object_id=object_id, change_seq=next_change_seq(company_id)
+	)
 
 
 class SoftDeleteQuerySet(models.QuerySet):
+	def update_tracked(self, **kwargs):
+		"""update() that stamps updated_at and a change sequence per company.
+
+		Three statements however many rows and companies are touched: the
+		companies are locked in id order, their sequences bumped in one UPDATE
+		and the rows take their own company's new number from a subquery.
+		Returns the number of rows updated.
+		"""
+		from accounts.models import Company
+
+		with transaction.atomic():
+			company_ids = list(
+				Company.objects.select_for_update().filter(id__in=self.values('company_id'))
+				.order_by('id').values_list('id', flat=True)
+			)
+			if not company_ids:
+				return 0
+			bump_data_versions(company_ids)
+			Company.objects.filter(id__in=company_ids).update(change_seq=F('change_seq') + 1)
+			company_seq = Company.objects.filter(id=OuterRef('company_id')).values('change_seq')[:1]
+			return self.update(change_seq=Subquery(company_seq), updated_at=timezone.now(), **kwargs)
+
 	def delete(self):
-		return super().update(is_deleted=True)
+		# Soft deleted rows stay behind as tombstones for /api/sync/
+		return self.update_tracked(is_deleted=True)
 
 	def hard_delete(self):
+		# post_delete leaves a SyncTombstone per row
 		return super().delete()
 
 	def alive(self):
@@ -15,12 +83,22 @@ class SoftDeleteQuerySet(models.QuerySet):
 
 class SoftDeleteModel(models.Model):
 	is_deleted = models.BooleanField(default=False)
+	updated_at = models.DateTimeField(auto_now=True)
+	change_seq = models.BigIntegerField(default=0, help_text="Company change sequence of the last write")
 
 	objects = SoftDeleteQuerySet.as_manager()
 
 	class Meta:
 		abstract = True
 
+	def save(self, *args, **kwargs):
+		update_fields = kwargs.get('update_fields')
+		if update_fields is not None:
+			kwargs['update_fields'] = {*update_fields, 'updated_at', 'change_seq'}
+		with transaction.atomic():
+			self.change_seq = next_change_seq(self.company_id)
+			super().save(*args, **kwargs)
+
 
 class Control(SoftDeleteModel):
 	STATUS_IMPLEMENTED = 'implemented'
@@ -36,6 +114,9 @@ class Control(SoftDeleteModel):
 	created_at = models.DateTimeField(auto_now_add=True)
 	status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_NOT_IMPLEMENTED)
 
+	class Meta:
+		indexes = [models.Index(fields=['company', 'change_seq'], name='control_company_change_seq')]
+
 	def __str__(self) -> str:
 		return f"{self.name} ({self.company})"
 
@@ -51,10 +132,67 @@ class Evidence(SoftDeleteModel):
 	control = models.ForeignKey(Control, on_delete=models.CASCADE, related_name='evidence')
 	name = models.CharField(max_length=255)
 	file = models.FileField(upload_to='evidence/')
+	perceptual_hash = models.CharField(max_length=16, blank=True, default='', help_text="dHash of the image, hex encoded")
 	company = models.ForeignKey('accounts.Company', on_delete=models.CASCADE, related_name='evidence')
 	created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.PROTECT, related_name='evidence_created')
 	created_at = models.DateTimeField(auto_now_add=True)
 	status = models.CharField(max_length=20, choices=STATUS_CHOICES)
 
+	class Meta:
+		indexes = [models.Index(fields=['company', 'change_seq'], name='evidence_company_change_seq')]
+
 	def __str__(self) -> str:
 		return f"{self.name} -> {self.control.name}"
+
+
+class SyncTombstone(models.Model):
+	"""A row deleted outright, reported by /api/sync/ like a soft delete.
+
+	Soft deletes leave the row itself behind as the tombstone; admin deletes,
+	cascades and ``hard_delete()`` leave one of these instead.
+	"""
+	KIND_CONTROL = 'control'
+	KIND_EVIDENCE = 'evidence'
+	KIND_COMPLIANCE_CHECK = 'compliance_check'
+	KIND_CHOICES = [
+		(KIND_CONTROL, 'Control'),
+		(KIND_EVIDENCE, 'Evidence'),
+		(KIND_COMPLIANCE_CHECK, 'Compliance check'),
+	]
+
+	company = models.ForeignKey('accounts.Company', on_delete=models.CASCADE, related_name='sync_tombstones')
+	kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+	object_id = models.BigIntegerField()
+	change_seq = models.BigIntegerField()
+	deleted_at = models.DateTimeField(auto_now_add=True)
+
+	class Meta:
+		indexes = [models.Index(fields=['company', 'change_seq'], name='sync_tombstone_company_seq')]
+
+	def __str__(self) -> str:
+		return f"{self.kind} {self.object_id} deleted"
+
+
+class IdempotencyKeyQuerySet(models.QuerySet):
+	def expired(self):
+		return self.filter(expires_at__lt=timezone.now())
+
+
+class IdempotencyKey(models.Model):
+	"""Stored response for a client Idempotency-Key, replayed to retries.
+
+	``key`` is a SHA-256 of (user, endpoint, client key); ``status_code`` is
+	NULL while the first request is still running.
+	"""
+	key = models.CharField(max_length=64, primary_key=True)
+	request_hash = models.CharField(max_length=64)
+	status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+	content_type = models.CharField(max_length=100, blank=True, default='')
+	body = models.BinaryField(default=b'', help_text="zlib-compressed response body")
+	locked_until = models.DateTimeField(null=True, blank=True)
+	expires_at = models.DateTimeField(db_index=True)
+
+	objects = IdempotencyKeyQuerySet.as_manager()
+
+	def __str__(self) -> str:
+		return f"{self.key[:12]} ({self.status_code or 'in progress'})"
@@ -0,0 +1,136 @@
+"""
+Per-company and per-user rate limits for endpoints that call the AI service.
+
+Limits come from ``RATE_LIMIT_PLANS`` by the company's plan, as
+``(requests, window seconds)`` for the company as a whole and for each of
+its users. Counting uses a sliding window estimated from two fixed-window
+counters in the Django cache: the current window's count plus the previous
+window's count weighted by how much of it still overlaps the sliding window.
+Counters are only ever incremented, which the cache does atomically, so the
+limits hold across workers and nodes sharing Redis. Concurrent requests can
+overshoot a limit by the few that pass the check before their increments
+land.
+
+An allowed request costs three cache round trips and no database query: the
+company's plan (cached for ``PLAN_CACHE_SECONDS``, so a plan change takes
+that long to apply), one ``get_many`` of the counters and an ``incr`` per
+counter.
+"""
+import functools
+import math
+import time
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .fastjson import JsonResponse
+
+PLAN_CACHE_SECONDS = 300
+
+DEFAULT_PLANS = {
+    'free': {'company': (20, 60), 'user': (10, 60)},
+    'standard': {'company': (120, 60), 'user': (30, 60)},
+    'enterprise': {'company': (600, 60), 'user': (120, 60)},
+}
+
+
+def plan_limits(plan: str) -> Dict[str, Tuple[int, int]]:
+    plans = getattr(settings, 'RATE_LIMIT_PLANS', DEFAULT_PLANS)
+    return plans.get(plan) or plans.get('standard') or DEFAULT_PLANS['standard']
+
+
+def _plan_key(company_id: Optional[int]) -> str:
+    return f'company-plan:{company_id}'
+
+
+def _counter_key(scope: str, kind: str, ident, window: int, index: int) -> str:
+    return f'ratelimit:{scope}:{kind}:{ident}:{window}:{index}'
+
+
+def _retry_after(limit: int, window: int, elapsed: float, previous: int, current: int) -> int:
+    """Seconds until the sliding-window estimate drops below the limit"""
+    if current >= limit:
+        # Wait for the next window, then for this window's count to decay
+        wait = (window - elapsed) + window * (1 - limit / current)
+    else:
+        wait = window * (1 - (limit - current) / previous) - elapsed
+    return max(1, math.ceil(wait))
+
+
+def _incr(key: str, timeout: int) -> None:
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout):
+            cache.incr(key)
+
+
+def _company_plan(company_id: Optional[int]) -> str:
+    plan = cache.get(_plan_key(company_id))
+    if plan is not None:
+        return plan
+    from accounts.models import Company
+
+    plan = Company.objects.filter(id=company_id).values_list('plan', flat=True).first() or Company.PLAN_STANDARD
+    cache.set(_plan_key(company_id), plan, PLAN_CACHE_SECONDS)
+    return plan
+
+
+def check_rate_limit(scope: str, user) -> Optional[int]:
+    """Count a request by ``user`` against ``scope``.
+
+    Returns None if it is allowed, otherwise the Retry-After seconds; refused
+    requests are not counted.
+    """
+    now = time.time()
+    limits = plan_limits(_company_plan(user.company_id))
+
+    counters = []
+    for kind, ident in (('company', user.company_id), ('user', user.pk)):
+        limit, window = limits[kind]
+        index, elapsed = divmod(now, window)
+        counters.append((kind, ident, limit, int(window), int(index), elapsed))
+
+    keys = []
+    for kind, ident, limit, window, index, _ in counters:
+        keys.append(_counter_key(scope, kind, ident, window, index - 1))
+        keys.append(_counter_key(scope, kind, ident, window, index))
+    counts = cache.get_many(keys)
+
+    retry_after = None
+    for kind, ident, limit, window, index, elapsed in counters:
+        previous = counts.get(_counter_key(scope, kind, ident, window, index - 1), 0)
+        current = counts.get(_counter_key(scope, kind, ident, window, index), 0)
+        if previous * (1 - elapsed / window) + current >= limit:
+            wait = _retry_after(limit, window, elapsed, previous, current)
+            retry_after = max(retry_after or 0, wait)
+    if retry_after is not None:
+        return retry_after
+
+    for kind, ident, limit, window, index, _ in counters:
+        _incr(_counter_key(scope, kind, ident, window, index), 2 * window)
+    return None
+
+
+def rate_limit(scope: str):
+    """Answer 429 with Retry-After once the company or user exceeds its limit.
+
+    Anonymous requests pass through for the view to reject. Goes below
+    ``@idempotent`` so replayed responses are not counted.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if not request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+            retry_after = check_rate_limit(scope, request.user)
+            if retry_after is None:
+                return view(request, *args, **kwargs)
+            response = JsonResponse(
+                {"detail": f"Rate limit exceeded, retry in {retry_after} seconds"}, status=429
+            )
+            response['Retry-After'] = str(retry_after)
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,13 @@
+from rest_framework.renderers import JSONRenderer
+
+from .fastjson import dumps
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSONRenderer producing the same compact UTF-8 output via orjson"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        return dumps(data, indent=bool(indent))
@@ -0,0 +1,121 @@
+"""
+Per-company response cache for read-heavy list endpoints.
+
+Every company has a data version in the Django cache that is bumped after
+any committed write to its controls, evidence or compliance checks. Cached
+responses are keyed by (endpoint, company, query params, Accept, version),
+so a bump makes all of the company's entries unreachable at once and nothing
+has to be deleted. The same key is used as a strong ETag, which lets
+``If-None-Match`` be answered with 304 without reading the cache entry or
+running the view.
+"""
+import functools
+import hashlib
+import time
+from typing import Iterable, Optional
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags
+
+from config.db_router import pinned_to_primary, read_your_writes_seconds, replicas
+
+
+def _version_key(company_id: Optional[int]) -> str:
+    return f'company-data-version:{company_id}'
+
+
+def data_version(company_id: Optional[int]) -> int:
+    """Current data version of a company"""
+    key = _version_key(company_id)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a version lost to eviction never reappears
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def _bump(company_id: Optional[int]) -> None:
+    key = _version_key(company_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def bump_data_version(company_id: Optional[int]) -> None:
+    """Invalidate a company's cached responses once the current transaction commits"""
+    transaction.on_commit(lambda: _bump(company_id))
+
+
+def bump_data_versions(company_ids: Iterable[Optional[int]]) -> None:
+    for company_id in set(company_ids):
+        bump_data_version(company_id)
+
+
+def _not_modified(request, etag: str) -> bool:
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    # If-None-Match uses the weak comparison
+    tags = [tag[2:] if tag.startswith('W/') else tag for tag in parse_etags(header)]
+    return etag in tags or '*' in tags
+
+
+def cache_company_response(endpoint: str, per_user: bool = False):
+    """Cache successful GET responses of a view per company and data version.
+
+    Goes outside ``@api_view`` so DRF responses are cached after rendering.
+    Anonymous requests and non-200 responses pass straight through. Set
+    ``per_user`` when the response includes the requesting user.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or not request.user.is_authenticated:
+                return view(request, *args, **kwargs)
+
+            company_id = request.user.company_id
+            scope = f'{company_id}:{request.user.pk}' if per_user else company_id
+            version = data_version(company_id)
+            params = urlencode(sorted(request.GET.lists()), doseq=True)
+            accept = request.META.get('HTTP_ACCEPT', '')
+            digest = hashlib.sha256(
+                f'{endpoint}|{scope}|{args}|{kwargs}|{params}|{accept}|{version}'.encode()
+            ).hexdigest()[:32]
+            etag = f'"{digest}"'
+
+            if _not_modified(request, etag):
+                response = HttpResponseNotModified()
+            else:
+                key = f'response-cache:{digest}'
+                # With replicas, a client that just wrote reads the primary and
+                # must not get an entry another client built from a lagging one
+                replicated = bool(replicas())
+                pinned = replicated and pinned_to_primary()
+                cached = None if pinned else cache.get(key)
+                if cached is not None:
+                    content_type, content = cached
+                    response = HttpResponse(content, content_type=content_type)
+                else:
+                    response = view(request, *args, **kwargs)
+                    if callable(getattr(response, 'render', None)):
+                        response = response.render()
+                    if response.status_code != 200 or response.streaming:
+                        return response
+                    timeout = getattr(settings, 'RESPONSE_CACHE_TTL', 300)
+                    if replicated and not pinned:
+                        # Built from a replica that may trail the version bump
+                        timeout = min(timeout, read_your_writes_seconds())
+                    cache.set(key, (response['Content-Type'], response.content), timeout)
+
+            response['ETag'] = etag
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapped
+    return decorator
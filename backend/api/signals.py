@@ -0,0 +1,28 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from accounts.models import Company
+from .models import Control, Evidence, SyncTombstone, record_tombstone
+
+
+def deleted_with(origin, *models) -> bool:
+    """Whether a delete started from an instance or queryset of one of ``models``"""
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return origin_model in models
+
+
+# Saves and soft deletes go through next_change_seq(); hard deletes (admin,
+# cascades, hard_delete()) leave a tombstone for /api/sync/, which also takes
+# a sequence number and so invalidates cached responses. Nothing is recorded
+# when the whole company is being deleted.
+@receiver(post_delete, sender=Control)
+def control_deleted(sender, instance, origin=None, **kwargs):
+    if not deleted_with(origin, Company):
+        record_tombstone(SyncTombstone.KIND_CONTROL, instance.company_id, instance.id)
+
+
+@receiver(post_delete, sender=Evidence)
+def evidence_deleted(sender, instance, origin=None, **kwargs):
+    if not deleted_with(origin, Company):
+        record_tombstone(SyncTombstone.KIND_EVIDENCE, instance.company_id, instance.id)
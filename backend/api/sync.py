@@ -0,0 +1,66 @@
+"""
+Change feed behind /api/sync/.
+
+Every write to a company's controls, evidence and compliance checks stamps
+the rows with the next value of ``Company.change_seq`` (see
+``next_change_seq``). A client keeps the last cursor it saw and asks for
+everything in ``(since, since + window]``. Deletions come back as ids under
+``deleted`` so it can drop them from its local copy: soft-deleted rows are
+their own tombstones, rows deleted outright leave a ``SyncTombstone``.
+Compliance checks deleted together with their evidence are not listed.
+"""
+from typing import Any, Dict
+
+from accounts.models import Company
+from .compiled import compile_serializer
+from .models import Control, Evidence, SyncTombstone
+from .serializers import ControlSerializer, EvidenceSerializer
+
+
+SYNC_WINDOW = 500
+SYNC_MAX_WINDOW = 5000
+
+
+def changes_since(company: Company, since: int, window: int = SYNC_WINDOW) -> Dict[str, Any]:
+    """Rows changed after ``since``, at most ``window`` sequence numbers at a time"""
+    from compliance.models import ComplianceCheck
+    from compliance.views import CHECK_SUMMARY_FIELDS, check_summary
+
+    latest = Company.objects.filter(id=company.id).values_list('change_seq', flat=True).get()
+    upper = min(since + window, latest)
+    if upper <= since:
+        return {
+            'cursor': str(max(since, latest)),
+            'has_more': False,
+            'controls': [],
+            'evidence': [],
+            'compliance_checks': [],
+            'deleted': {'controls': [], 'evidence': [], 'compliance_checks': []},
+        }
+
+    changed = {'change_seq__gt': since, 'change_seq__lte': upper}
+    controls = Control.objects.filter(company=company, **changed)
+    evidence = Evidence.objects.filter(company=company, **changed)
+    checks = ComplianceCheck.objects.filter(evidence__company=company, **changed)
+    tombstones = {kind: [] for kind, _ in SyncTombstone.KIND_CHOICES}
+    for kind, object_id in SyncTombstone.objects.filter(company=company, **changed).values_list('kind', 'object_id'):
+        tombstones[kind].append(object_id)
+
+    return {
+        'cursor': str(upper),
+        'has_more': upper < latest,
+        'controls': compile_serializer(ControlSerializer).data(controls.filter(is_deleted=False).order_by('id')),
+        'evidence': compile_serializer(EvidenceSerializer).data(evidence.filter(is_deleted=False).order_by('id')),
+        'compliance_checks': [check_summary(row) for row in checks.order_by('id').values(*CHECK_SUMMARY_FIELDS)],
+        'deleted': {
+            'controls': sorted([
+                *controls.filter(is_deleted=True).values_list('id', flat=True),
+                *tombstones[SyncTombstone.KIND_CONTROL],
+            ]),
+            'evidence': sorted([
+                *evidence.filter(is_deleted=True).values_list('id', flat=True),
+                *tombstones[SyncTombstone.KIND_EVIDENCE],
+            ]),
+            'compliance_checks': sorted(tombstones[SyncTombstone.KIND_COMPLIANCE_CHECK]),
+        },
+    }
@@ -0,0 +1,976 @@
+import contextvars
+import csv
+import json
+import os
+import re
+import tempfile
+import time
+import zipfile
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.contrib import admin
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+
+from accounts.models import Company, User
+from compliance import urls as compliance_urls
+from compliance.models import ComplianceCheck
+from compliance.services import MockAIService
+from config.db_router import PRIMARY_COOKIE, PrimaryReplicaRouter, ReadYourWritesMiddleware, use_primary
+from . import urls as api_urls
+from .compiled import compile_serializer
+from .fastjson import StreamingJsonResponse
+from .importer import import_evidence_archive
+from .models import Control, Evidence, IdempotencyKey, SyncTombstone, next_change_seq
+from .parsers import ORJSONParser
+from .renderers import ORJSONRenderer
+from .serializers import ControlSerializer, EvidenceSerializer
+
+
+def write_queries(captured):
+    """SQL statements that modify rows, ignoring savepoints and reads"""
+    return [
+        query['sql'] for query in captured.captured_queries
+        if query['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))
+    ]
+
+
+class APIFixtureMixin:
+    """A company with one control and one rejected evidence; the client is logged in as its employee"""
+
+    def setUp(self):
+        cache.clear()
+        self.company = Company.objects.create(name="Acme Corp")
+        self.user = User.objects.create(username="employee", company=self.company)
+        self.control = Control.objects.create(name="MFA Control", company=self.company, created_by=self.user)
+        self.evidence = Evidence.objects.create(
+            name="OTP screenshot",
+            control=self.control,
+            company=self.company,
+            created_by=self.user,
+            status=Evidence.STATUS_REJECTED,
+        )
+        self.client.force_login(self.user)
+
+
+class ResponseCacheTests(APIFixtureMixin, TestCase):
+    url = "/api/compliance/checks/"
+
+    def setUp(self):
+        super().setUp()
+        with self.captureOnCommitCallbacks(execute=True):
+            MockAIService().check_compliance(self.evidence.id)
+
+    def test_etag_answers_304_without_queries(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with self.assertNumQueries(2):  # session and user
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+    def test_repeat_is_served_from_cache(self):
+        first = self.client.get(self.url)
+
+        with self.assertNumQueries(2):
+            second = self.client.get(self.url)
+
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first["ETag"], second["ETag"])
+
+    def test_write_invalidates(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            evidence = Evidence.objects.create(
+                name="Second screenshot", control=self.control, company=self.company,
+                created_by=self.user, status=Evidence.STATUS_REJECTED,
+            )
+            MockAIService().check_compliance(evidence.id)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.json()["compliance_checks"]), 2)
+
+    def test_cache_is_company_scoped(self):
+        self.client.get(self.url)
+        other = Company.objects.create(name="Other Corp")
+        self.client.force_login(User.objects.create(username="outsider", company=other))
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.json()["compliance_checks"], [])
+
+
+class SyncFeedTests(APIFixtureMixin, TestCase):
+    url = "/api/sync/"
+
+    def sync(self, since):
+        return self.client.get(self.url, {"since": since}).json()
+
+    def test_full_sync_then_deltas(self):
+        first = self.sync(0)
+        self.assertEqual([row["id"] for row in first["controls"]], [self.control.id])
+        self.assertEqual([row["id"] for row in first["evidence"]], [self.evidence.id])
+        self.assertFalse(first["has_more"])
+
+        check = MockAIService().check_compliance(self.evidence.id)
+        delta = self.sync(first["cursor"])
+
+        self.assertEqual([row["id"] for row in delta["compliance_checks"]], [check.id])
+        self.assertEqual(delta["evidence"][0]["status"], Evidence.STATUS_APPROVED)
+        self.assertEqual(delta["controls"][0]["status"], Control.STATUS_IMPLEMENTED)
+        self.assertEqual(self.sync(delta["cursor"])["evidence"], [])
+
+    def test_soft_delete_is_a_tombstone(self):
+        cursor = self.sync(0)["cursor"]
+
+        Evidence.objects.filter(id=self.evidence.id).delete()
+        delta = self.sync(cursor)
+
+        self.assertEqual(delta["evidence"], [])
+        self.assertEqual(delta["deleted"]["evidence"], [self.evidence.id])
+
+    def test_hard_deletes_leave_tombstones(self):
+        check = MockAIService().check_compliance(self.evidence.id)
+        other = Evidence.objects.create(
+            name="Second", control=self.control, company=self.company, created_by=self.user,
+            status=Evidence.STATUS_REJECTED,
+        )
+        other_check = MockAIService().check_compliance(other.id)
+        cursor = self.sync(0)["cursor"]
+
+        ComplianceCheck.objects.get(id=other_check.id).delete()
+        after_check = self.sync(cursor)
+        # Deleting the control cascades to its evidence and their checks
+        Control.objects.get(id=self.control.id).delete()
+        after_control = self.sync(after_check["cursor"])
+
+        self.assertEqual(after_check["deleted"]["compliance_checks"], [other_check.id])
+        self.assertEqual(after_control["deleted"]["controls"], [self.control.id])
+        self.assertEqual(after_control["deleted"]["evidence"], sorted([self.evidence.id, other.id]))
+        self.assertEqual(after_control["deleted"]["compliance_checks"], [])
+        self.assertFalse(ComplianceCheck.objects.filter(id=check.id).exists())
+
+    def test_deleting_company_leaves_no_tombstones(self):
+        # Users protect their company, so this one only has rows made by a support user
+        doomed = Company.objects.create(name="Doomed Corp")
+        control = Control.objects.create(name="MFA Control", company=doomed, created_by=self.user)
+        evidence = Evidence.objects.create(
+            name="Screenshot", control=control, company=doomed, created_by=self.user,
+            status=Evidence.STATUS_REJECTED,
+        )
+        MockAIService().check_compliance(evidence.id)
+
+        doomed.delete()
+
+        self.assertFalse(SyncTombstone.objects.exists())
+
+    def test_change_seq_is_one_statement(self):
+        with CaptureQueriesContext(connection) as captured, transaction.atomic():
+            first = next_change_seq(self.company.id)
+            second = next_change_seq(self.company.id)
+
+        self.assertEqual(second, first + 1)
+        self.assertEqual([q["sql"].split()[0] for q in captured.captured_queries if "change_seq" in q["sql"]],
+                         ["UPDATE", "UPDATE"])
+
+    def test_window_pages_through_sequence(self):
+        for index in range(3):
+            Control.objects.create(name=f"Control {index}", company=self.company, created_by=self.user)
+
+        seen, cursor, has_more = [], 0, True
+        while has_more:
+            data = self.client.get(self.url, {"since": cursor, "window": 1}).json()
+            seen += [row["id"] for row in data["controls"]]
+            cursor, has_more = data["cursor"], data["has_more"]
+
+        self.assertEqual(len(seen), 4)
+        self.assertEqual(len(set(seen)), 4)
+
+
+class DashboardTests(APIFixtureMixin, TestCase):
+    url = "/api/dashboard/"
+
+    def setUp(self):
+        super().setUp()
+        MockAIService().check_compliance(self.evidence.id)
+
+    def add_control_with_evidence(self, index):
+        control = Control.objects.create(name=f"SSO Control {index}", company=self.company, created_by=self.user)
+        evidence = Evidence.objects.create(
+            name=f"SSO screenshot {index}", control=control, company=self.company,
+            created_by=self.user, status=Evidence.STATUS_REJECTED,
+        )
+        MockAIService().check_compliance(evidence.id)
+
+    def test_payload(self):
+        data = self.client.get(self.url).json()
+
+        self.assertEqual(data["user"]["id"], self.user.id)
+        self.assertEqual(data["company"]["name"], "Acme Corp")
+        control = data["controls"][0]
+        self.assertEqual(control["latest_evidence"]["id"], self.evidence.id)
+        self.assertEqual(control["latest_check_status"], "approved")
+        self.assertEqual(data["summary"]["checks"], {"approved": 1})
+        listed = self.client.get("/api/evidence/").json()
+        self.assertEqual([{**row, "compliance_check_status": "approved"} for row in listed], data["evidence"])
+
+    def test_evidence_rows_carry_their_check_status_beyond_the_first_page(self):
+        for index in range(2):
+            self.add_control_with_evidence(index)
+        Evidence.objects.create(
+            name="Unchecked", control=self.control, company=self.company,
+            created_by=self.user, status=Evidence.STATUS_REJECTED,
+        )
+
+        with mock.patch("api.dashboard.CHECKS_PAGE_SIZE", 1):
+            data = self.client.get(self.url).json()
+
+        statuses = {row["name"]: row["compliance_check_status"] for row in data["evidence"]}
+        self.assertEqual(len(data["compliance_checks"]), 1)
+        self.assertEqual(statuses, {
+            "OTP screenshot": "approved", "SSO screenshot 0": "approved", "SSO screenshot 1": "approved",
+            "Unchecked": None,
+        })
+
+    def test_query_count_does_not_grow_with_rows(self):
+        self.client.get(self.url)
+        cache.clear()
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+
+        for index in range(5):
+            self.add_control_with_evidence(index)
+        cache.clear()
+        with CaptureQueriesContext(connection) as many:
+            self.client.get(self.url)
+
+        # session, user, company, controls with counts, prefetched evidence with checks
+        self.assertEqual(len(many), 5)
+        self.assertEqual(len(few), len(many))
+
+    def test_conditional_get(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_checks_are_capped_to_first_page(self):
+        for index in range(2):
+            self.add_control_with_evidence(index)
+
+        with mock.patch("api.dashboard.CHECKS_PAGE_SIZE", 2):
+            data = self.client.get(self.url).json()
+
+        listed = self.client.get("/api/compliance/checks/").json()["compliance_checks"]
+        self.assertEqual(data["compliance_checks"], listed[:2])
+        self.assertEqual(data["summary"]["checks"], {"approved": 3})
+        rest = self.client.get("/api/compliance/checks/", {"cursor": data["next_cursor"]}).json()
+        self.assertEqual(rest["compliance_checks"], listed[2:])
+        self.assertIsNone(rest["next_cursor"])
+        cache.clear()
+        self.assertIsNone(self.client.get(self.url).json()["next_cursor"])
+
+
+    def test_cursor_continues_with_alive_checks_only(self):
+        for index in range(4):
+            self.add_control_with_evidence(index)
+        deleted_evidence, deleted_control = Evidence.objects.filter(name__in=["SSO screenshot 0", "SSO screenshot 1"])
+        deleted_evidence.delete()
+        Control.objects.filter(id=deleted_control.control_id).delete()
+
+        with mock.patch("api.dashboard.CHECKS_PAGE_SIZE", 2):
+            data = self.client.get(self.url).json()
+        rest = self.client.get("/api/compliance/checks/", {"cursor": data["next_cursor"]}).json()
+
+        names = [check["evidence_name"] for check in data["compliance_checks"] + rest["compliance_checks"]]
+        self.assertEqual(names, ["SSO screenshot 3", "SSO screenshot 2", "OTP screenshot"])
+        self.assertIsNone(rest["next_cursor"])
+
+
+class AuditExportTests(APIFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.filter(id=self.user.id).update(role="admin")
+
+    def test_employees_cannot_export(self):
+        User.objects.filter(id=self.user.id).update(role="employee")
+
+        response = self.client.get("/api/export/")
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_zip_contains_manifests_and_files(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            self.evidence.file.save("otp.png", ContentFile(b"\x89PNG fake image bytes"))
+            MockAIService().check_compliance(self.evidence.id)
+
+            response = self.client.get("/api/export/")
+            archive = zipfile.ZipFile(BytesIO(b"".join(response.streaming_content)))
+
+        self.assertEqual(response["Content-Type"], "application/zip")
+        evidence = [json.loads(line) for line in archive.read("evidence.ndjson").splitlines()]
+        self.assertEqual(evidence[0]["compliance_check"]["status"], "approved")
+        self.assertEqual(archive.read(evidence[0]["archive_path"]), b"\x89PNG fake image bytes")
+        self.assertEqual(len(archive.read("controls.ndjson").splitlines()), 1)
+        rows = list(csv.DictReader(StringIO(archive.read("manifest.csv").decode())))
+        self.assertEqual(rows[0]["archive_path"], evidence[0]["archive_path"])
+        self.assertNotIn("missing.ndjson", archive.namelist())
+
+    def test_manifest_quotes_formula_cells(self):
+        Control.objects.filter(id=self.control.id).update(name="=HYPERLINK(\"http://evil\")")
+        Evidence.objects.filter(id=self.evidence.id).update(name="@SUM(A1)")
+
+        response = self.client.get("/api/export/")
+        archive = zipfile.ZipFile(BytesIO(b"".join(response.streaming_content)))
+
+        row = next(csv.DictReader(StringIO(archive.read("manifest.csv").decode())))
+        self.assertEqual(row["evidence_name"], "'@SUM(A1)")
+        self.assertEqual(row["control_name"], "'=HYPERLINK(\"http://evil\")")
+        self.assertTrue(row["created_at"][0].isdigit())
+
+
+class EvidenceImportTests(APIFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        User.objects.filter(id=self.user.id).update(role="admin")
+
+    def archive(self, entries):
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, "w") as archive:
+            for name, data in entries.items():
+                archive.writestr(name, data)
+        buffer.seek(0)
+        buffer.name = "evidence.zip"
+        return buffer
+
+    def test_import_creates_evidence_and_pending_checks(self):
+        sso = Control.objects.create(name="SSO Control", company=self.company, created_by=self.user)
+        archive = self.archive({
+            "mfa/one.png": b"png-1",
+            "mfa/two.png": b"png-2",
+            "login.jpg": b"jpg-1",
+            "notes.txt": b"text",
+            "unknown/three.png": b"png-3",
+        })
+
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.post("/api/evidence/import/", {
+                    "archive": archive,
+                    "mapping": json.dumps({"mfa/": "MFA Control", "login.jpg": sso.id}),
+                })
+
+        summary = response.json()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(summary["created"], 3)
+        self.assertEqual({item["path"] for item in summary["skipped"]}, {"notes.txt", "unknown/three.png"})
+        checks = ComplianceCheck.objects.filter(evidence_id__in=summary["evidence_ids"])
+        self.assertEqual(set(checks.values_list("status", flat=True)), {ComplianceCheck.STATUS_PENDING})
+        self.assertEqual(Evidence.objects.get(name="login.jpg").control_id, sso.id)
+        # Controls resolved once, evidence and checks inserted in one statement each
+        sql = [query["sql"] for query in captured.captured_queries]
+        self.assertEqual(len([q for q in sql if 'FROM "api_control"' in q]), 1)
+        self.assertEqual(len([q for q in sql if q.startswith('INSERT INTO "api_evidence"')]), 1)
+        self.assertEqual(len([q for q in sql if q.startswith('INSERT INTO "compliance_compliancecheck"')]), 1)
+
+    def test_command_reports_progress(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            path = f"{media_root}/import.zip"
+            with open(path, "wb") as f:
+                f.write(self.archive({f"MFA Control/{index}.png": b"png" for index in range(3)}).getvalue())
+            out = StringIO()
+            call_command("import_evidence", path, company="Acme Corp", user="employee", batch_size=2, stdout=out)
+
+        self.assertIn("2/3 entries read, 2 evidence created", out.getvalue())
+        self.assertIn("Imported 3 evidence", out.getvalue())
+
+    def test_employees_cannot_import(self):
+        User.objects.filter(id=self.user.id).update(role="employee")
+
+        response = self.client.post("/api/evidence/import/", {"archive": self.archive({"MFA Control/a.png": b"png"})})
+
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(Evidence.objects.count(), 1)
+
+    def test_failed_batch_removes_stored_files(self):
+        archive = self.archive({f"MFA Control/{index}.png": b"png" for index in range(2)})
+
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            with mock.patch("compliance.models.ComplianceCheck.objects.bulk_create", side_effect=IntegrityError):
+                with self.assertRaises(IntegrityError):
+                    import_evidence_archive(archive, self.company, self.user)
+            stored = [name for _, _, files in os.walk(media_root) for name in files]
+
+        self.assertEqual(stored, [])
+        self.assertEqual(Evidence.objects.count(), 1)
+
+
+class IdempotencyKeyTests(APIFixtureMixin, TestCase):
+    def upload(self, key, name="otp.png", content=b"not really a png"):
+        return self.client.post(
+            "/api/evidence/upload/",
+            {"file": ContentFile(content, name=name), "control": self.control.id, "name": name},
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_retry_replays_first_response(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            first = self.upload("upload-1")
+            retry = self.upload("upload-1")
+
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.content, first.content)
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(Evidence.objects.filter(name="otp.png").count(), 1)
+
+    def test_key_reused_for_other_payload(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            self.upload("upload-2")
+            response = self.upload("upload-2", name="other.png")
+
+        self.assertEqual(response.status_code, 422)
+
+    def test_key_reused_for_other_file_of_same_name_and_size(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            self.upload("upload-3", content=b"first screenshot")
+            response = self.upload("upload-3", content=b"other screenshot")
+
+        self.assertEqual(response.status_code, 422)
+
+    def test_duplicate_of_in_progress_request_gets_409(self):
+        body = json.dumps({"evidence_id": self.evidence.id})
+
+        def post():
+            return self.client.post(
+                "/api/compliance/check/", body, content_type="application/json", HTTP_IDEMPOTENCY_KEY="check-1"
+            )
+
+        first = post()
+        IdempotencyKey.objects.update(status_code=None, locked_until=timezone.now() + timedelta(minutes=1))
+
+        with CaptureQueriesContext(connection) as captured:
+            duplicate = post()
+
+        # Answered at once: one read of the key, no polling
+        reads = [q for q in captured.captured_queries if q["sql"].startswith('SELECT "api_idempotencykey"')]
+        self.assertEqual(len(reads), 1)
+        self.assertEqual(duplicate.status_code, 409)
+        self.assertEqual(duplicate["Retry-After"], "1")
+
+        IdempotencyKey.objects.update(status_code=200)
+        replay = post()
+        self.assertEqual(replay.content, first.content)
+        self.assertEqual(ComplianceCheck.objects.filter(evidence=self.evidence).count(), 1)
+
+    def test_key_released_after_failed_claim_gets_409(self):
+        # The first request failed and deleted its row between our claim and read
+        with mock.patch("api.idempotency._claim", return_value=False):
+            response = self.client.post(
+                "/api/compliance/check/", json.dumps({"evidence_id": self.evidence.id}),
+                content_type="application/json", HTTP_IDEMPOTENCY_KEY="check-2",
+            )
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(ComplianceCheck.objects.exists())
+
+
+class RateLimitTests(APIFixtureMixin, TestCase):
+    PLANS = {
+        'free': {'company': (3, 60), 'user': (2, 60)},
+        'standard': {'company': (100, 60), 'user': (100, 60)},
+    }
+
+    def check(self, user):
+        self.client.force_login(user)
+        return self.client.post(
+            "/api/compliance/check/", json.dumps({"evidence_id": self.evidence.id}), content_type="application/json"
+        )
+
+    def test_user_and_company_limits_by_plan(self):
+        Company.objects.filter(id=self.company.id).update(plan=Company.PLAN_FREE)
+        colleague = User.objects.create(username="colleague", company=self.company)
+
+        with self.settings(RATE_LIMIT_PLANS=self.PLANS):
+            self.assertEqual([self.check(self.user).status_code for _ in range(3)], [200, 200, 429])
+            refused = self.check(self.user)
+            # The company allows one more, from another user
+            self.assertEqual(self.check(colleague).status_code, 200)
+            self.assertEqual(self.check(colleague).status_code, 429)
+
+        self.assertEqual(refused.status_code, 429)
+        self.assertTrue(1 <= int(refused["Retry-After"]) <= 120)
+
+    def test_refusal_is_not_stored_as_idempotent_response(self):
+        with self.settings(RATE_LIMIT_PLANS={'standard': {'company': (1, 60), 'user': (1, 60)}}):
+            self.check(self.user)
+            self.client.force_login(self.user)
+            response = self.client.post(
+                "/api/compliance/check/", json.dumps({"evidence_id": self.evidence.id}),
+                content_type="application/json", HTTP_IDEMPOTENCY_KEY="limited",
+            )
+
+        self.assertEqual(response.status_code, 429)
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+
+class JSONEncodingTests(APIFixtureMixin, TestCase):
+    def test_renderer_matches_drf(self):
+        data = {
+            "text": "line\u2028para\u2029end é",
+            "amount": Decimal("12.50"),
+            "at": datetime(2024, 5, 1, 12, 30, tzinfo=dt_timezone.utc),
+            "day": date(2024, 5, 1),
+            "nested": [None, True, 1.5],
+        }
+
+        content = ORJSONRenderer().render(data)
+
+        self.assertEqual(content, JSONRenderer().render(data))
+        self.assertIn(b"\\u2028", content)
+        self.assertIn(b"\\u2029", content)
+        self.assertEqual(
+            json.loads(content),
+            {"text": data["text"], "amount": 12.5, "at": "2024-05-01T12:30:00Z", "day": "2024-05-01",
+             "nested": [None, True, 1.5]},
+        )
+
+    def test_parser_round_trip_and_malformed_body(self):
+        parser = ORJSONParser()
+
+        self.assertEqual(parser.parse(BytesIO('{"text": "a\u2028b"}'.encode())), {"text": "a\u2028b"})
+        with self.assertRaisesMessage(ParseError, "JSON parse error"):
+            parser.parse(BytesIO(b'{"evidence_id":'))
+
+        response = self.client.post("/api/rag/webhook/", data=b'{"evidence_id":', content_type="application/json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("JSON parse error", response.json()["detail"])
+
+    def test_streaming_response_shape(self):
+        items = ({"id": i, "name": f"row {i}"} for i in range(50))
+
+        response = StreamingJsonResponse(items, key="rows", extra={"next_cursor": None}, chunk_size=256)
+        chunks = list(response.streaming_content)
+
+        self.assertGreater(len(chunks), 1)
+        payload = json.loads(b"".join(chunks))
+        self.assertEqual(len(payload["rows"]), 50)
+        self.assertIsNone(payload["next_cursor"])
+        self.assertEqual(json.loads(b"".join(StreamingJsonResponse(iter([])).streaming_content)), [])
+
+    def test_long_lists_are_streamed(self):
+        for index in range(3):
+            Evidence.objects.create(
+                name=f"Extra {index}", control=self.control, company=self.company, created_by=self.user,
+                status=Evidence.STATUS_REJECTED,
+            )
+        rendered = self.client.get("/api/evidence/")
+
+        with self.settings(STREAM_LIST_ABOVE=2):
+            cache.clear()
+            streamed = self.client.get("/api/evidence/")
+            browsable = self.client.get("/api/evidence/", HTTP_ACCEPT="text/html")
+
+        self.assertFalse(rendered.streaming)
+        self.assertTrue(streamed.streaming)
+        self.assertEqual(json.loads(b"".join(streamed.streaming_content)), rendered.json())
+        self.assertFalse(browsable.streaming)
+
+
+class CompiledSerializerTests(APIFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        Control.objects.create(name="SSO Control", company=self.company, created_by=self.user,
+                               status=Control.STATUS_IMPLEMENTED)
+        # No file, a plain path, and one that needs quoting in the URL
+        for name, file in (("Upload", "evidence/otp.png"), ("Quoted", "evidence/sign in (1).png")):
+            Evidence.objects.create(
+                name=name, control=self.control, company=self.company, created_by=self.user,
+                status=Evidence.STATUS_APPROVED, file=file,
+            )
+        # Microseconds and a non-UTC offset both reach the datetime converter
+        Evidence.objects.filter(name="Upload").update(
+            created_at=datetime(2024, 2, 29, 23, 59, 59, 123456, tzinfo=dt_timezone.utc)
+        )
+
+    def assertCompiledMatches(self, serializer_class, qs):
+        expected = json.loads(JSONRenderer().render(serializer_class(qs, many=True).data))
+        compiled = compile_serializer(serializer_class)
+
+        self.assertEqual(json.loads(ORJSONRenderer().render(compiled.data(qs))), expected)
+        self.assertEqual(json.loads(ORJSONRenderer().render(list(compiled.iterate(qs)))), expected)
+        self.assertEqual(json.loads(ORJSONRenderer().render(compiled.represent(qs))), expected)
+
+    def test_matches_model_serializers(self):
+        for tz in ("UTC", "Asia/Kolkata"):
+            with self.subTest(tz=tz), timezone.override(tz):
+                self.assertCompiledMatches(ControlSerializer, Control.objects.order_by("id"))
+                self.assertCompiledMatches(EvidenceSerializer, Evidence.objects.order_by("id"))
+
+    def test_null_file_is_none(self):
+        rows = compile_serializer(EvidenceSerializer).data(Evidence.objects.order_by("id"))
+
+        self.assertIsNone(rows[0]["file"])
+        self.assertEqual(rows[2]["file"], "/media/evidence/sign%20in%20(1).png")
+
+
+class AdminBulkActionTests(APIFixtureMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.other = Company.objects.create(name="Globex")
+        self.other_control = Control.objects.create(name="SSO Control", company=self.other, created_by=self.user)
+        self.admin = User.objects.create(
+            username="admin", company=self.company, role="admin", is_staff=True, is_superuser=True
+        )
+        self.client.force_login(self.admin)
+
+    def action(self, url, action, ids):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(url, {"action": action, "_selected_action": ids}, follow=True)
+        return [str(message) for message in response.context["messages"]], write_queries(captured)
+
+    def test_mark_implemented_is_set_based_across_companies(self):
+        done = Control.objects.create(
+            name="Done", company=self.company, created_by=self.user, status=Control.STATUS_IMPLEMENTED
+        )
+        ids = [self.control.id, self.other_control.id, done.id]
+
+        messages, writes = self.action("/admin/api/control/", "mark_implemented", ids)
+
+        self.assertEqual(messages, ["Marked 2 controls as implemented."])
+        # One UPDATE of both company sequences, one of the controls
+        self.assertEqual(len([sql for sql in writes if 'UPDATE "api_control"' in sql]), 1)
+        self.assertEqual(len(writes), 2)
+        for control in (self.control, self.other_control):
+            control.refresh_from_db()
+            self.assertEqual(control.status, Control.STATUS_IMPLEMENTED)
+            self.assertEqual(control.change_seq, Company.objects.get(id=control.company_id).change_seq)
+
+    def test_soft_delete_counts_only_live_rows(self):
+        gone = Evidence.objects.create(
+            name="Old", control=self.control, company=self.company, created_by=self.user, is_deleted=True
+        )
+
+        messages, writes = self.action("/admin/api/evidence/", "soft_delete", [self.evidence.id, gone.id])
+
+        self.assertEqual(messages, ["Soft deleted 1 evidence records."])
+        self.assertEqual(len(writes), 2)
+        self.assertTrue(Evidence.objects.get(id=self.evidence.id).is_deleted)
+
+    def test_company_filter_takes_id_or_name_prefix(self):
+        for value in (self.other.id, "glob"):
+            response = self.client.get("/admin/api/control/", {"company": value})
+
+            self.assertEqual([control.id for control in response.context["cl"].result_list], [self.other_control.id])
+            self.assertContains(response, f'name="company" value="{value}"')
+
+
+def query_shape(sql):
+    """SQL with literals and IN lists collapsed, so the same statement groups together"""
+    shape = re.sub(r"'(?:[^']|'')*'", "?", sql)
+    shape = re.sub(r"\b\d+(?:\.\d+)?\b", "?", shape)
+    return re.sub(r"\(\s*\?(?:\s*,\s*\?)*\s*\)", "(?...)", shape)
+
+
+def query_report(queries):
+    """Distinct query shapes with how often each ran, most repeated first"""
+    shapes = Counter(query_shape(query["sql"]) for query in queries)
+    return "\n".join(f"{count:>4} x {shape}" for shape, count in shapes.most_common())
+
+
+class QueryBudgetTests(APIFixtureMixin, TestCase):
+    """Pinned query counts and response size ceilings for every endpoint.
+
+    Each endpoint is requested by a user of a small tenant and of a large
+    one next to it; both must run exactly the budgeted number of queries, so
+    a count that grows with the data fails here. Writes are
+    rolled back after each request so every endpoint sees the same rows.
+    When a budget breaks, the message lists the query shapes that ran with
+    how often each did, which points straight at an N+1.
+    """
+    CONTROLS = 12
+    EVIDENCE_PER_CONTROL = 4
+
+    # url name: (queries, max bytes of the large tenant's response)
+    BUDGETS = {
+        "ping": (2, 64),
+        "user": (3, 128),
+        "logout": (4, 256),
+        "microsoft-login": (2, 0),
+        "microsoft-callback": (2, 0),
+        "social-success": (3, 256),
+        "social-error": (2, 64),
+        "control-list": (4, 2048),
+        "control-status": (8, 256),
+        "evidence-list": (4, 8192),
+        "evidence-delete": (8, 64),
+        "evidence-upload": (22, 256),
+        "evidence-import": (10, 128),
+        "rag-webhook": (12, 128),
+        "sync": (10, 28000),
+        "dashboard": (5, 32000),
+        "export": (8, 5000),
+        "compliance:check_compliance": (15, 512),
+        "compliance:compliance_status": (4, 640),
+        "compliance:list_checks": (4, 16384),
+        "compliance:check_detail": (4, 768),
+        "compliance:retry_check": (17, 512),
+        "compliance:queue_stats": (5, 768),
+        "compliance:ai_status": (2, 256),
+        "compliance:ai_stats": (6, 640),
+    }
+
+    # app_label.model: queries for the changelist as a superuser
+    ADMIN_BUDGETS = {
+        "accounts.company": 5,
+        "accounts.user": 11,
+        "api.control": 4,
+        "api.evidence": 4,
+        "compliance.compliancecheck": 4,
+        "compliance.requestprofile": 7,
+        "social_django.association": 6,
+        "social_django.nonce": 5,
+        "social_django.usersocialauth": 6,
+    }
+
+    # Endpoints only company admins may call
+    ADMIN_ONLY = {"export", "evidence-import"}
+
+    STATUS_CODES = {
+        "microsoft-login": 302,
+        "microsoft-callback": 302,
+        "social-error": 401,
+        "evidence-upload": 201,
+        "evidence-import": 201,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        # Neighbours whose rows must never leak into the counts
+        for name in ("Globex", "Initech"):
+            company = Company.objects.create(name=name)
+            user = User.objects.create(username=f"{name.lower()}-employee", company=company)
+            cls.populate(company, user, controls=3, evidence_per_control=2)
+
+        cls.large = Company.objects.create(name="Umbrella")
+        cls.large_user = User.objects.create(username="umbrella-employee", company=cls.large)
+        cls.populate(cls.large, cls.large_user, cls.CONTROLS, cls.EVIDENCE_PER_CONTROL)
+        cls.superuser = User.objects.create(
+            username="root", company=cls.large, role="admin", is_staff=True, is_superuser=True
+        )
+
+    @classmethod
+    def populate(cls, company, user, controls, evidence_per_control):
+        statuses = [ComplianceCheck.STATUS_APPROVED, ComplianceCheck.STATUS_REJECTED, ComplianceCheck.STATUS_ERROR]
+        for control_index in range(controls):
+            control = Control.objects.create(name=f"MFA Control {control_index}", company=company, created_by=user)
+            for index in range(evidence_per_control):
+                evidence = Evidence.objects.create(
+                    name=f"Screenshot {control_index}-{index}", control=control, company=company,
+                    created_by=user, status=Evidence.STATUS_REJECTED,
+                )
+                if index == evidence_per_control - 1:
+                    ComplianceCheck.objects.enqueue(evidence, ComplianceCheck.PRIORITY_BACKGROUND)
+                    continue
+                check = MockAIService().check_compliance(evidence.id)
+                status = statuses[(control_index + index) % len(statuses)]
+                if status != check.status:
+                    ComplianceCheck.objects.filter(id=check.id).update(status=status)
+
+    def setUp(self):
+        super().setUp()
+        self.small_user = self.user
+        check = MockAIService().check_compliance(self.evidence.id)
+        ComplianceCheck.objects.filter(id=check.id).update(status=ComplianceCheck.STATUS_REJECTED)
+        self.populate(self.company, self.user, controls=1, evidence_per_control=2)
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        media_settings = self.settings(MEDIA_ROOT=media_root.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+
+    def request(self, name, evidence, check):
+        """Issue the request for url ``name`` against the given rows of the logged in tenant"""
+        client = self.client
+        kwargs = {}
+        if name == "compliance:compliance_status":
+            kwargs = {"evidence_id": evidence.id}
+        elif name in ("compliance:check_detail", "compliance:retry_check"):
+            kwargs = {"compliance_check_id": check.id}
+        url = reverse(name, kwargs=kwargs)
+
+        if name in ("logout", "compliance:retry_check"):
+            return client.post(url)
+        if name == "control-status":
+            body = {"id": evidence.control_id, "status": Control.STATUS_IMPLEMENTED}
+            return client.post(url, json.dumps(body), content_type="application/json")
+        if name == "evidence-delete":
+            return client.delete(url, json.dumps({"ids": [evidence.id]}), content_type="application/json")
+        if name == "evidence-upload":
+            upload = ContentFile(b"not really a png", name="otp.png")
+            return client.post(url, {"file": upload, "control": evidence.control_id, "name": "otp.png"})
+        if name == "evidence-import":
+            buffer = BytesIO()
+            with zipfile.ZipFile(buffer, "w") as archive:
+                for index in range(3):
+                    archive.writestr(f"{evidence.control.name}/{index}.png", b"png")
+            buffer.seek(0)
+            buffer.name = "evidence.zip"
+            return client.post(url, {"archive": buffer})
+        if name == "rag-webhook":
+            body = {"evidence_id": evidence.id, "status": Evidence.STATUS_APPROVED}
+            return client.post(url, json.dumps(body), content_type="application/json")
+        if name == "compliance:check_compliance":
+            return client.post(url, json.dumps({"evidence_id": evidence.id}), content_type="application/json")
+        return client.get(url)
+
+    def measure(self, name, user):
+        """Queries and response bytes of one request, with its writes rolled back"""
+        evidence = Evidence.objects.select_related("control").filter(company=user.company).order_by("id").first()
+        check = ComplianceCheck.objects.filter(
+            evidence__company=user.company, status=ComplianceCheck.STATUS_REJECTED
+        ).order_by("id").first()
+        self.client.force_login(user)
+        cache.clear()
+        with transaction.atomic():
+            if name in self.ADMIN_ONLY:
+                User.objects.filter(id=user.id).update(role="admin")
+            with CaptureQueriesContext(connection) as captured:
+                response = self.request(name, evidence, check)
+                body = b"".join(response.streaming_content) if response.streaming else response.content
+            transaction.set_rollback(True)
+        self.assertEqual(response.status_code, self.STATUS_CODES.get(name, 200), f"{name}: {body[:200]}")
+        return captured.captured_queries, len(body)
+
+    def assertWithinBudget(self, label, queries, budget):
+        self.assertEqual(
+            len(queries), budget,
+            f"{label} ran {len(queries)} queries, budget is {budget}:\n{query_report(queries)}",
+        )
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in api_urls.urlpatterns}
+        names |= {f"{compliance_urls.app_name}:{pattern.name}" for pattern in compliance_urls.urlpatterns}
+
+        self.assertEqual(names, set(self.BUDGETS))
+        self.assertEqual(
+            {f"{model._meta.app_label}.{model._meta.model_name}" for model in admin.site._registry},
+            set(self.ADMIN_BUDGETS),
+        )
+
+    def test_endpoint_budgets(self):
+        for name, (budget, max_bytes) in self.BUDGETS.items():
+            with self.subTest(name):
+                user = self.superuser if name == "compliance:ai_stats" else self.large_user
+                queries, size = self.measure(name, user)
+                self.assertWithinBudget(f"{name} (large tenant)", queries, budget)
+                self.assertLessEqual(size, max_bytes, f"{name} response is {size} bytes")
+                if name != "compliance:ai_stats":
+                    small_queries, _ = self.measure(name, self.small_user)
+                    self.assertWithinBudget(f"{name} (small tenant)", small_queries, budget)
+
+    def test_admin_changelist_budgets(self):
+        self.client.force_login(self.superuser)
+        for label, budget in self.ADMIN_BUDGETS.items():
+            with self.subTest(label):
+                url = reverse(f"admin:{label.replace('.', '_')}_changelist")
+                cache.clear()
+                with CaptureQueriesContext(connection) as captured:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertWithinBudget(label, captured.captured_queries, budget)
+
+
+class ReadReplicaRoutingTests(APIFixtureMixin, TestCase):
+    # Router decisions are checked against an alias that is never queried;
+    # requests that do query use "default" as their stand-in replica
+
+    def setUp(self):
+        super().setUp()
+        self.router = PrimaryReplicaRouter()
+
+    def test_reads_go_to_replicas_until_the_context_writes(self):
+        def route():
+            before = self.router.db_for_read(Control)
+            write = self.router.db_for_write(Control)
+            return before, write, self.router.db_for_read(Control)
+
+        def pinned_block():
+            with use_primary():
+                inside = self.router.db_for_read(Control)
+            return inside, self.router.db_for_read(Control)
+
+        def write_in_pinned_block():
+            with use_primary():
+                self.router.db_for_write(Control)
+            return self.router.db_for_read(Control)
+
+        with self.settings(DATABASE_REPLICAS=["replica1"]):
+            self.assertEqual(contextvars.Context().run(route), ("replica1", "default", "default"))
+            self.assertEqual(contextvars.Context().run(pinned_block), ("default", "replica1"))
+            self.assertEqual(contextvars.Context().run(write_in_pinned_block), "default")
+        self.assertEqual(contextvars.Context().run(route), ("default", "default", "default"))
+
+    def test_cookie_pins_reads_after_a_write(self):
+        seen = []
+
+        def view(request):
+            seen.append(self.router.db_for_read(Control))
+            if request.method == "POST":
+                self.router.db_for_write(Control)
+            return HttpResponse()
+
+        middleware = ReadYourWritesMiddleware(view)
+        factory = RequestFactory()
+        with self.settings(DATABASE_REPLICAS=["replica1"], READ_YOUR_WRITES_SECONDS=15):
+            cookie = middleware(factory.post("/api/control/status/")).cookies[PRIMARY_COOKIE]
+            requests = [factory.get("/api/evidence/") for _ in range(3)]
+            requests[0].COOKIES[PRIMARY_COOKIE] = cookie.value
+            # Pins beyond the TTL can only come from a forged cookie
+            requests[2].COOKIES[PRIMARY_COOKIE] = str(time.time() + 3600)
+            responses = [middleware(request) for request in requests]
+
+        self.assertEqual(seen, ["default", "default", "replica1", "replica1"])
+        self.assertEqual(cookie["max-age"], 15)
+        self.assertFalse(any(PRIMARY_COOKIE in response.cookies for response in responses))
+
+    def test_write_response_sets_cookie_only_with_replicas(self):
+        body = json.dumps({"id": self.control.id, "status": Control.STATUS_IMPLEMENTED})
+
+        plain = self.client.post("/api/control/status/", body, content_type="application/json")
+        with self.settings(DATABASE_REPLICAS=["default"]):
+            write = self.client.post("/api/control/status/", body, content_type="application/json")
+            read = self.client.get("/api/control/")
+
+        self.assertNotIn(PRIMARY_COOKIE, plain.cookies)
+        self.assertIn(PRIMARY_COOKIE, write.cookies)
+        self.assertNotIn(PRIMARY_COOKIE, read.cookies)
+
+    def test_pinned_client_skips_cached_responses(self):
+        with self.settings(DATABASE_REPLICAS=["default"]):
+            self.client.get("/api/evidence/")
+            # A change the cached entry does not show, as if built from a lagging replica
+            Evidence.objects.filter(id=self.evidence.id).update(name="Renamed")
+            other = self.client.get("/api/evidence/").json()
+            self.client.cookies[PRIMARY_COOKIE] = str(int(time.time()) + 10)
+            writer = self.client.get("/api/evidence/").json()
+
+        self.assertEqual(other[0]["name"], "OTP screenshot")
+        self.assertEqual(writer[0]["name"], "Renamed")
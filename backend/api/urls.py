@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import ping, get_user, logout_view, list_controls, list_evidence, delete_evidence, upload_evidence, update_control_status, rag_webhook
+from .views import ping, get_user, logout_view, list_controls, list_evidence, delete_evidence, upload_evidence, update_control_status, rag_webhook, sync_changes, dashboard, export_audit_package, import_evidence
 from .social_views import microsoft_login, microsoft_callback, social_auth_success, social_auth_error
 
 
@@ -16,7 +16,11 @@ urlpatterns = [
     path('evidence/', list_evidence, name='evidence-list'),
     path('evidence/delete/', delete_evidence, name='evidence-delete'),
     path('evidence/upload/', upload_evidence, name='evidence-upload'),
+    path('evidence/import/', import_evidence, name='evidence-import'),
     path('rag/webhook/', rag_webhook, name='rag-webhook'),
+    path('sync/', sync_changes, name='sync'),
+    path('dashboard/', dashboard, name='dashboard'),
+    path('export/', export_audit_package, name='export'),
 ]
 
 
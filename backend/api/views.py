@@ -2,12 +2,22 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
+from django.conf import settings
 from django.db.models import Q
 from django.contrib.auth import logout
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from .models import Control, Evidence
 from .serializers import ControlSerializer, EvidenceSerializer
+from .compiled import compile_serializer
+from .response_cache import cache_company_response
+from .sync import SYNC_MAX_WINDOW, SYNC_WINDOW, changes_since
+from .dashboard import dashboard_payload
+from .export import stream_audit_package
+from .importer import import_evidence_archive
+from .idempotency import idempotent
+from .ratelimit import rate_limit
+from compliance.tracing import parse_multipart, span
 
 
 @api_view(["GET"])
@@ -26,9 +36,14 @@ def get_user(request):
     })
 
 
-from django.http import JsonResponse
+from .fastjson import JsonResponse
+from . import fastjson
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.text import slugify
 from django.views.decorators.http import require_http_methods
-import json
+import itertools
+import zipfile
 
 @require_http_methods(["POST"])
 @csrf_exempt
@@ -51,20 +66,86 @@ def logout_view(request):
     })
 
 
+def _list_response(request, serializer_class, qs):
+    """
+    Render a list through DRF (and the response cache) while it is short,
+    and stream it row by row once it exceeds ``STREAM_LIST_ABOVE``. The
+    browsable API always gets the rendered list.
+    """
+    rows = compile_serializer(serializer_class).iterate(qs)
+    limit = getattr(settings, "STREAM_LIST_ABOVE", 1000)
+    head = list(itertools.islice(rows, limit + 1))
+    if len(head) <= limit or request.accepted_renderer.format != "json":
+        return Response(head + list(rows))
+    return fastjson.StreamingJsonResponse(itertools.chain(head, rows))
+
+
+@cache_company_response("control-list")
 @api_view(["GET"])
 @permission_classes([IsAuthenticated])
 def list_controls(request):
     qs = Control.objects.alive().filter(company=request.user.company)
-    serializer = ControlSerializer(qs, many=True)
-    return Response(serializer.data)
+    return _list_response(request, ControlSerializer, qs)
 
 
+@cache_company_response("evidence-list")
 @api_view(["GET"]) 
 @permission_classes([IsAuthenticated])
 def list_evidence(request):
     qs = Evidence.objects.alive().filter(company=request.user.company)
-    serializer = EvidenceSerializer(qs, many=True)
-    return Response(serializer.data)
+    return _list_response(request, EvidenceSerializer, qs)
+
+
+@cache_company_response("dashboard", per_user=True)
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def dashboard(request):
+    """
+    User, company, controls with their latest evidence and check status,
+    evidence, compliance check summaries and counts in one response.
+    """
+    if not request.user.company:
+        return Response({"detail": "User not assigned to a company"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(dashboard_payload(request.user))
+
+
+@api_view(["GET"])
+@permission_classes([IsAuthenticated])
+def sync_changes(request):
+    """
+    Delta feed: controls, evidence and compliance checks changed after
+    ``since`` (the ``cursor`` of the previous call, 0 for everything).
+    Call again with the new cursor while ``has_more`` is true.
+    """
+    if not request.user.company:
+        return Response({"detail": "User not assigned to a company"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        since = max(int(request.GET.get("since", 0)), 0)
+        window = min(max(int(request.GET.get("window", SYNC_WINDOW)), 1), SYNC_MAX_WINDOW)
+    except ValueError:
+        return Response({"detail": "Invalid since or window"}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(changes_since(request.user.company, since, window))
+
+
+@require_http_methods(["GET"])
+@rate_limit("audit-export")
+def export_audit_package(request):
+    """
+    Stream a ZIP with every control, evidence file and AI verdict of the
+    user's company (NDJSON and CSV manifests plus the files). Admins only.
+    """
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
+    if request.user.role != "admin":
+        return JsonResponse({"detail": "Only company admins can export the audit package"}, status=403)
+    company = request.user.company
+    if not company:
+        return JsonResponse({"detail": "User not assigned to a company"}, status=400)
+    
+    filename = f"audit-{slugify(company.name)}-{timezone.now():%Y%m%d}.zip"
+    response = StreamingHttpResponse(stream_audit_package(company), content_type="application/zip")
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
 
 
 @require_http_methods(["DELETE"])
@@ -75,9 +156,9 @@ def delete_evidence(request):
         return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
     
     try:
-        data = json.loads(request.body)
+        data = fastjson.loads(request.body)
         ids = data if isinstance(data, list) else data.get("ids", [])
-    except json.JSONDecodeError:
+    except fastjson.JSONDecodeError:
         return JsonResponse({"detail": "Invalid JSON"}, status=400)
     
     if not ids:
@@ -97,13 +178,17 @@ def delete_evidence(request):
 
 @require_http_methods(["POST"])
 @csrf_exempt
+@idempotent("evidence-upload")
+@rate_limit("ai-analysis")
 def upload_evidence(request):
     # Check if user is authenticated
     if not request.user.is_authenticated:
         return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
     
     try:
-        # Get file and form data
+        # Get file and form data; @idempotent has already parsed the body
+        # when the request carries an Idempotency-Key
+        parse_multipart(request)
         file = request.FILES.get('file')
         control_id = request.POST.get('control')
         name = request.POST.get('name')
@@ -117,68 +202,45 @@ def upload_evidence(request):
         except Control.DoesNotExist:
             return JsonResponse({"detail": "Control not found"}, status=404)
         
-        # Create evidence
-        evidence = Evidence.objects.create(
-            name=name,
-            file=file,
-            control=control,
-            company=request.user.company,
-            created_by=request.user,
-            status=Evidence.STATUS_REJECTED  # Default status, will be updated by AI analysis
-        )
+        # Perceptual hash lets near-identical screenshots reuse verdicts
+        from compliance.phash import compute_dhash
+        
+        with span('upload.hash'):
+            perceptual_hash = compute_dhash(file)
         
-        # Perform AI-based compliance validation
+        # Create evidence; saving writes the file to storage
+        with span('upload.save_evidence', **{'file.bytes': file.size}):
+            evidence = Evidence.objects.create(
+                name=name,
+                file=file,
+                perceptual_hash=perceptual_hash,
+                control=control,
+                company=request.user.company,
+                created_by=request.user,
+                status=Evidence.STATUS_REJECTED  # Default status, will be updated by AI analysis
+            )
+        
+        compliance_check = None
+        
+        # Perform AI-based compliance validation, or queue it on the
+        # interactive lane when the company already has its share in flight
         try:
-            from compliance.services import analyze_evidence_compliance
+            from compliance.services import ComplianceAIService
             from compliance.models import ComplianceCheck
+            from compliance.scheduler import fair_scheduler
             
-            # Create a compliance check record first
-            compliance_check, created = ComplianceCheck.objects.get_or_create(
-                evidence=evidence,
-                defaults={'status': ComplianceCheck.STATUS_PROCESSING}
-            )
-            
-            # Analyze the evidence for compliance
-            analysis_result = analyze_evidence_compliance(
-                evidence_file=evidence.file,
-                control_name=control.name,
-                company_name=request.user.company.name
-            )
-            
-            # Update compliance check with results
-            if analysis_result.get('is_compliant', False):
-                evidence.status = Evidence.STATUS_APPROVED
-                evidence.rejection_reason = None
-                compliance_check.status = ComplianceCheck.STATUS_APPROVED
-                compliance_check.ai_analysis = analysis_result.get('analysis', {})
+            if fair_scheduler.has_capacity(evidence.company_id):
+                compliance_check = ComplianceAIService().check_compliance(evidence.id, evidence=evidence)
             else:
-                evidence.status = Evidence.STATUS_REJECTED
-                evidence.rejection_reason = analysis_result.get('reason', 'Compliance check failed')
-                compliance_check.status = ComplianceCheck.STATUS_REJECTED
-                compliance_check.rejection_reason = analysis_result.get('reason', 'Compliance check failed')
-                compliance_check.ai_analysis = analysis_result.get('analysis', {})
-            
-            evidence.save()
-            compliance_check.save()
+                compliance_check = ComplianceCheck.objects.enqueue(evidence, ComplianceCheck.PRIORITY_INTERACTIVE)
+            if compliance_check.status == ComplianceCheck.STATUS_APPROVED:
+                evidence.status = Evidence.STATUS_APPROVED
             
         except Exception as e:
             # Log AI analysis error but don't fail the upload
             import logging
             logger = logging.getLogger(__name__)
             logger.warning(f"Failed to analyze evidence {evidence.id} with AI: {str(e)}")
-            
-            # Create a compliance check with error status
-            try:
-                from compliance.models import ComplianceCheck
-                compliance_check, created = ComplianceCheck.objects.get_or_create(
-                    evidence=evidence,
-                    defaults={'status': ComplianceCheck.STATUS_ERROR}
-                )
-                compliance_check.status = ComplianceCheck.STATUS_ERROR
-                compliance_check.rejection_reason = f"AI analysis failed: {str(e)}"
-                compliance_check.save()
-            except:
-                pass  # Don't fail the upload if compliance check creation fails
         
         return JsonResponse({
             "id": evidence.id,
@@ -186,6 +248,7 @@ def upload_evidence(request):
             "file": evidence.file.url if evidence.file else None,
             "control": evidence.control.id,
             "status": evidence.status,
+            "compliance_check_status": compliance_check.status if compliance_check else None,
             "created_at": evidence.created_at.isoformat()
         }, status=201)
         
@@ -198,6 +261,41 @@ def upload_evidence(request):
         return JsonResponse({"detail": f"Upload failed: {str(e)}"}, status=500)
 
 
+@require_http_methods(["POST"])
+@csrf_exempt
+@rate_limit("evidence-import")
+def import_evidence(request):
+    """
+    Bulk import: multipart ``archive`` (ZIP of screenshots) and optional
+    ``mapping`` (JSON object of archive path or ``dir/`` prefix to control id
+    or name). Compliance checks are queued for the worker. Admins only.
+    """
+    # Check if user is authenticated
+    if not request.user.is_authenticated:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
+    if request.user.role != "admin":
+        return JsonResponse({"detail": "Only company admins can import evidence"}, status=403)
+    if not request.user.company:
+        return JsonResponse({"detail": "User not assigned to a company"}, status=400)
+    
+    archive = request.FILES.get('archive')
+    if not archive:
+        return JsonResponse({"detail": "Missing required field: archive"}, status=400)
+    try:
+        mapping = fastjson.loads(request.POST.get('mapping') or '{}')
+    except fastjson.JSONDecodeError:
+        return JsonResponse({"detail": "Invalid mapping JSON"}, status=400)
+    if not isinstance(mapping, dict):
+        return JsonResponse({"detail": "mapping must be a JSON object"}, status=400)
+    
+    try:
+        summary = import_evidence_archive(archive, request.user.company, request.user, mapping)
+    except zipfile.BadZipFile:
+        return JsonResponse({"detail": "archive is not a valid ZIP file"}, status=400)
+    
+    return JsonResponse(summary, status=201)
+
+
 @require_http_methods(["POST"])
 @csrf_exempt
 def update_control_status(request):
@@ -206,10 +304,10 @@ def update_control_status(request):
         return JsonResponse({"detail": "Authentication credentials were not provided."}, status=403)
     
     try:
-        data = json.loads(request.body)
+        data = fastjson.loads(request.body)
         control_id = data.get("id")
         new_status = data.get("status")
-    except json.JSONDecodeError:
+    except fastjson.JSONDecodeError:
         return JsonResponse({"detail": "Invalid JSON"}, status=400)
     
     if new_status not in dict(Control.STATUS_CHOICES):
@@ -226,6 +324,7 @@ def update_control_status(request):
     return JsonResponse(ControlSerializer(control).data)
 
 
+@idempotent("rag-webhook")
 @api_view(["POST"])
 @permission_classes([IsAuthenticated])
 def rag_webhook(request):
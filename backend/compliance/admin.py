@@ -1,20 +1,41 @@
+import os
+
 from django.contrib import admin
-from .models import ComplianceCheck
+from django.http import FileResponse, Http404
+from django.urls import path, reverse
+from django.utils.html import format_html
+from api.admin import CompanyInputFilter, LargeTableAdminMixin
+from .models import ComplianceCheck, RequestProfile
+from .profiling import profile_path
+
+
+class EvidenceCompanyFilter(CompanyInputFilter):
+    company_field = "evidence__company"
 
 
 @admin.register(ComplianceCheck)
-class ComplianceCheckAdmin(admin.ModelAdmin):
+class ComplianceCheckAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     list_display = ("id", "evidence", "status", "created_at", "updated_at")
-    list_filter = ("status", "created_at", "evidence__company")
+    # Evidence.__str__ shows the control name
+    list_select_related = ("evidence__control",)
+    list_filter = ("status", "created_at", EvidenceCompanyFilter)
     search_fields = ("evidence__name", "evidence__control__name")
-    readonly_fields = ("created_at", "updated_at", "ai_analysis")
+    autocomplete_fields = ("evidence",)
+    readonly_fields = (
+        "created_at", "updated_at", "ai_analysis", "is_compliant", "confidence", "control_type",
+        "model", "prompt_version", "latency_ms", "detected_elements",
+    )
     
     fieldsets = (
         ("Basic Information", {
             "fields": ("evidence", "status", "created_at", "updated_at")
         }),
         ("AI Analysis", {
-            "fields": ("ai_analysis", "rejection_reason", "recommendations"),
+            "fields": (
+                "is_compliant", "confidence", "control_type", "detected_elements",
+                "model", "prompt_version", "latency_ms",
+                "ai_analysis", "rejection_reason", "recommendations",
+            ),
             "classes": ("collapse",)
         }),
     )
@@ -37,4 +58,65 @@ class ComplianceCheckAdmin(admin.ModelAdmin):
         return False
     
     def has_delete_permission(self, request, obj=None):
-        return request.user.role == "admin"
\ No newline at end of file
+        return request.user.role == "admin"
+
+
+@admin.register(RequestProfile)
+class RequestProfileAdmin(admin.ModelAdmin):
+    list_display = ("id", "created_at", "method", "path", "status_code", "duration_ms", "user", "size_bytes", "download")
+    list_filter = ("method", "status_code")
+    search_fields = ("path",)
+    readonly_fields = (
+        "created_at", "user", "method", "path", "query_string", "status_code", "duration_ms",
+        "file_name", "size_bytes", "download", "summary",
+    )
+    
+    def get_urls(self):
+        return [
+            path("<int:profile_id>/download/", self.admin_site.admin_view(self.download_view),
+                 name="compliance_requestprofile_download"),
+        ] + super().get_urls()
+    
+    def download(self, obj):
+        url = reverse("admin:compliance_requestprofile_download", args=[obj.id])
+        return format_html('<a href="{}">{}</a>', url, obj.file_name)
+    download.short_description = "pstats file"
+    
+    def download_view(self, request, profile_id):
+        if not self.has_view_permission(request):
+            raise Http404
+        profile = RequestProfile.objects.filter(id=profile_id).first()
+        if profile is None:
+            raise Http404
+        try:
+            return FileResponse(open(profile_path(profile.file_name), "rb"), as_attachment=True,
+                                filename=profile.file_name)
+        except FileNotFoundError:
+            raise Http404
+    
+    def has_view_permission(self, request, obj=None):
+        return request.user.role == "admin"
+    
+    def has_add_permission(self, request, obj=None):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return request.user.role == "admin"
+    
+    def delete_model(self, request, obj):
+        self._remove_files([obj])
+        super().delete_model(request, obj)
+    
+    def delete_queryset(self, request, queryset):
+        self._remove_files(queryset)
+        super().delete_queryset(request, queryset)
+    
+    def _remove_files(self, profiles):
+        for profile in profiles:
+            try:
+                os.remove(profile_path(profile.file_name))
+            except FileNotFoundError:
+                pass
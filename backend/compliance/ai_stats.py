@@ -0,0 +1,107 @@
+"""
+Latency, error and cost rollups over ``AICallTelemetry`` for /api/compliance/ai-stats/.
+
+Percentiles are computed by PostgreSQL's ``percentile_cont``. Other
+databases have no ordered-set aggregates, so there the timings of each
+group are fetched and the percentiles computed in Python, which is only
+meant for development-sized tables.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Aggregate, Count, FloatField, Q, Sum
+
+from .models import AICallTelemetry
+
+PERCENTILES = (0.5, 0.9, 0.99)
+TIMINGS = ('encode_ms', 'network_ms', 'parse_ms')
+
+
+class PercentileCont(Aggregate):
+    function = 'percentile_cont'
+    template = '%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+    def __init__(self, expression, percentile: float, **extra):
+        super().__init__(expression, percentile=percentile, **extra)
+
+
+def _percentile(values: Sequence[int], fraction: float) -> Optional[float]:
+    """Linear interpolation between closest ranks, as percentile_cont does"""
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def _label(fraction: float) -> str:
+    return f'p{fraction * 100:g}'
+
+
+def call_cost(model: str, input_tokens: Optional[int], output_tokens: Optional[int]) -> Optional[float]:
+    """USD cost of the tokens at ``AI_TOKEN_PRICES``, None for unpriced models"""
+    price = getattr(settings, 'AI_TOKEN_PRICES', {}).get(model)
+    if price is None:
+        return None
+    input_price, output_price = price
+    return ((input_tokens or 0) * input_price + (output_tokens or 0) * output_price) / 1_000_000
+
+
+def ai_call_stats(since: datetime) -> Dict[str, Any]:
+    calls = AICallTelemetry.objects.filter(created_at__gte=since)
+    use_sql_percentiles = connection.vendor == 'postgresql'
+    aggregates = {
+        'calls': Count('id'),
+        'errors': Count('id', filter=Q(status=AICallTelemetry.STATUS_ERROR)),
+        'text_fallbacks': Count('id', filter=Q(status=AICallTelemetry.STATUS_TEXT_FALLBACK)),
+        'input_tokens': Sum('input_tokens'),
+        'output_tokens': Sum('output_tokens'),
+        'request_bytes': Sum('request_bytes'),
+        'response_bytes': Sum('response_bytes'),
+    }
+    if use_sql_percentiles:
+        for timing in TIMINGS:
+            for fraction in PERCENTILES:
+                aggregates[f'{timing}_{_label(fraction)}'] = PercentileCont(timing, fraction)
+
+    groups: List[Dict[str, Any]] = []
+    for row in calls.values('provider', 'model').annotate(**aggregates).order_by('provider', 'model'):
+        if not use_sql_percentiles:
+            group = calls.filter(provider=row['provider'], model=row['model'])
+            for timing in TIMINGS:
+                values = sorted(group.filter(**{f'{timing}__isnull': False}).values_list(timing, flat=True))
+                for fraction in PERCENTILES:
+                    row[f'{timing}_{_label(fraction)}'] = _percentile(values, fraction)
+        groups.append({
+            'provider': row['provider'],
+            'model': row['model'],
+            'calls': row['calls'],
+            'errors': row['errors'],
+            'error_rate': round(row['errors'] / row['calls'], 4),
+            'text_fallbacks': row['text_fallbacks'],
+            'tokens': {'input': row['input_tokens'] or 0, 'output': row['output_tokens'] or 0},
+            'bytes': {'request': row['request_bytes'] or 0, 'response': row['response_bytes'] or 0},
+            'latency_ms': {
+                timing: {_label(fraction): row[f'{timing}_{_label(fraction)}'] for fraction in PERCENTILES}
+                for timing in TIMINGS
+            },
+            'cost_usd': call_cost(row['model'], row['input_tokens'], row['output_tokens']),
+        })
+
+    total_calls = sum(group['calls'] for group in groups)
+    total_errors = sum(group['errors'] for group in groups)
+    costs = [group['cost_usd'] for group in groups if group['cost_usd'] is not None]
+    return {
+        'since': since,
+        'totals': {
+            'calls': total_calls,
+            'errors': total_errors,
+            'error_rate': round(total_errors / total_calls, 4) if total_calls else 0,
+            'cost_usd': round(sum(costs), 6),
+        },
+        'models': groups,
+    }
@@ -0,0 +1,43 @@
+import hashlib
+
+from django.db import connection
+
+
+class AdvisoryLockLeader:
+    """Leader election through a Postgres session-level advisory lock.
+
+    Whoever holds the lock is leader until its database session ends, so a
+    crashed leader is replaced on the next ``acquire`` by a standby. Other
+    databases have nothing to coordinate through and every process leads.
+    """
+    
+    def __init__(self, name: str):
+        digest = hashlib.sha256(name.encode()).digest()
+        # Two positive 32-bit keys, so pg_locks shows them as-is
+        self.keys = [int.from_bytes(digest[:4], 'big') >> 1, int.from_bytes(digest[4:8], 'big') >> 1]
+    
+    def _holding(self, cursor) -> bool:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_locks WHERE locktype = 'advisory' AND pid = pg_backend_pid()"
+            " AND granted AND classid = %s AND objid = %s AND objsubid = 2)",
+            self.keys,
+        )
+        return cursor.fetchone()[0]
+    
+    def acquire(self) -> bool:
+        """Take or confirm leadership; False while another process leads"""
+        if connection.vendor != 'postgresql':
+            return True
+        with connection.cursor() as cursor:
+            # Session locks stack, so only ask for it when not already held
+            if self._holding(cursor):
+                return True
+            cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", self.keys)
+            return cursor.fetchone()[0]
+    
+    def release(self) -> None:
+        if connection.vendor != 'postgresql' or connection.connection is None:
+            return
+        with connection.cursor() as cursor:
+            if self._holding(cursor):
+                cursor.execute("SELECT pg_advisory_unlock(%s, %s)", self.keys)
@@ -0,0 +1,64 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from api.models import next_change_seq
+from compliance.models import ComplianceAnalysisRaw, ComplianceCheck
+from compliance.services import control_type_from_name
+
+
+class Command(BaseCommand):
+    help = "Move legacy ai_analysis blobs into the typed verdict columns and the raw analysis table"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500, help="Checks migrated per transaction")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        last_id = 0
+        migrated = 0
+        # change_seq and updated_at so /api/sync/ and cached responses pick the new columns up
+        fields = list(ComplianceCheck.verdict_columns({}, "").keys()) + ["ai_analysis", "change_seq", "updated_at"]
+
+        while True:
+            batch = list(
+                ComplianceCheck.objects.filter(id__gt=last_id, ai_analysis__isnull=False)
+                .order_by("id")
+                .only("id", "ai_analysis", "evidence__company_id", "evidence__control__name")
+                .select_related("evidence__control")[:batch_size]
+            )
+            if not batch:
+                break
+
+            raws = []
+            for check in batch:
+                analysis = check.ai_analysis if isinstance(check.ai_analysis, dict) else {}
+                control_type = control_type_from_name(check.evidence.control.name)
+                for field, value in ComplianceCheck.verdict_columns(analysis, control_type).items():
+                    setattr(check, field, value)
+                check.ai_analysis = None
+                raws.append(ComplianceAnalysisRaw.build(check.id, analysis))
+
+            with transaction.atomic():
+                # One sequence number per company in the batch; each also
+                # bumps that company's cached data version on commit
+                change_seqs = {
+                    company_id: next_change_seq(company_id)
+                    for company_id in sorted({check.evidence.company_id for check in batch})
+                }
+                now = timezone.now()
+                for check in batch:
+                    check.change_seq = change_seqs[check.evidence.company_id]
+                    check.updated_at = now
+                ComplianceCheck.objects.bulk_update(batch, fields)
+                ComplianceAnalysisRaw.objects.bulk_create(
+                    raws,
+                    update_conflicts=True,
+                    unique_fields=["compliance_check"],
+                    update_fields=["encoding", "payload", "updated_at"],
+                )
+
+            last_id = batch[-1].id
+            migrated += len(batch)
+            self.stdout.write(f"Migrated {migrated} compliance checks (last id {last_id})")
+
+        self.stdout.write(self.style.SUCCESS(f"Backfill complete: {migrated} compliance checks migrated."))
@@ -0,0 +1,163 @@
+import json
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from api.models import Evidence
+from compliance.models import ComplianceCheck
+from compliance.services import ComplianceAIService, MockAIService, control_type_filter, control_type_from_name
+
+
+class Command(BaseCommand):
+    help = (
+        "Re-run AI analysis over existing evidence after a prompt or model change, in parallel, "
+        "with checkpoint/resume and a dry-run that only reports changed verdicts"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4, help="Analyses running at once")
+        parser.add_argument("--batch-size", type=int, default=200, help="Evidence rows read per query")
+        parser.add_argument("--company", type=int, help="Only this company id")
+        parser.add_argument("--control-type", choices=["MFA", "SSO"], help="Only evidence of this control type")
+        parser.add_argument("--status", help="Only evidence whose compliance check has this status")
+        parser.add_argument("--created-after", help="Only evidence created on or after this ISO date/time")
+        parser.add_argument("--created-before", help="Only evidence created before this ISO date/time")
+        parser.add_argument("--checkpoint", help="JSON file recording progress, written as work completes")
+        parser.add_argument("--resume", action="store_true", help="Continue after the id stored in --checkpoint")
+        parser.add_argument("--dry-run", action="store_true", help="Call the AI but only print verdicts that would change")
+        parser.add_argument("--reuse-near-duplicates", action="store_true",
+                            help="Allow verdicts copied from near-identical images instead of a fresh call")
+        parser.add_argument("--mock", action="store_true", help="Use the local stub provider")
+
+    def handle(self, *args, **options):
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
+        if options["resume"] and not options["checkpoint"]:
+            raise CommandError("--resume needs --checkpoint")
+
+        self.options = options
+        self.filters = {
+            key: options[key]
+            for key in ("company", "control_type", "status", "created_after", "created_before")
+            if options[key] is not None
+        }
+        self.progress = {"last_id": 0, "processed": 0, "changed": 0, "failed": 0, "filters": self.filters}
+        if options["resume"] and os.path.exists(options["checkpoint"]):
+            with open(options["checkpoint"]) as f:
+                saved = json.load(f)
+            if saved.get("filters") != self.filters:
+                raise CommandError(f"Checkpoint was written with different filters: {saved.get('filters')}")
+            self.progress.update(saved)
+            self.stdout.write(f"Resuming after evidence {self.progress['last_id']}")
+
+        self.service = MockAIService() if options["mock"] else ComplianceAIService()
+        self.service.reuse_verdicts = options["reuse_near_duplicates"]
+        self.lock = threading.Lock()
+        self.run()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{'Would change' if options['dry_run'] else 'Changed'} {self.progress['changed']} of "
+            f"{self.progress['processed']} verdicts, {self.progress['failed']} failed"
+        ))
+
+    def queryset(self):
+        queryset = Evidence.objects.alive().select_related("control", "compliance_check")
+        if "company" in self.filters:
+            queryset = queryset.filter(company_id=self.filters["company"])
+        if "control_type" in self.filters:
+            # By control name, as analysis picks the type: evidence never analysed
+            # or with a legacy check has no control_type on its check
+            queryset = queryset.filter(control_type_filter(self.filters["control_type"], "control__name"))
+        if "status" in self.filters:
+            queryset = queryset.filter(compliance_check__status=self.filters["status"])
+        if "created_after" in self.filters:
+            queryset = queryset.filter(created_at__gte=self.parse_date(self.filters["created_after"]))
+        if "created_before" in self.filters:
+            queryset = queryset.filter(created_at__lt=self.parse_date(self.filters["created_before"]))
+        return queryset.order_by("id")
+
+    @staticmethod
+    def parse_date(value):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            raise CommandError(f"Not an ISO date: {value}")
+        return timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+
+    def pages(self):
+        """Keyset pages of evidence after the checkpoint"""
+        last_id = self.progress["last_id"]
+        queryset = self.queryset()
+        while True:
+            page = list(queryset.filter(id__gt=last_id)[:self.options["batch_size"]])
+            if not page:
+                return
+            yield page
+            last_id = page[-1].id
+
+    def run(self):
+        # Bounded so only a couple of pages of evidence are ever held in memory
+        max_pending = self.options["workers"] * 2
+        pending = {}
+        self.submitted_id = self.progress["last_id"]
+        with ThreadPoolExecutor(max_workers=self.options["workers"]) as pool:
+            for page in self.pages():
+                for evidence in page:
+                    while len(pending) >= max_pending:
+                        self.collect(pending, wait(pending, return_when=FIRST_COMPLETED).done)
+                    pending[pool.submit(self.reanalyze, evidence)] = evidence.id
+                    self.submitted_id = evidence.id
+            while pending:
+                self.collect(pending, wait(pending, return_when=FIRST_COMPLETED).done)
+
+    def collect(self, pending, done):
+        for future in done:
+            evidence_id = pending.pop(future)
+            try:
+                changed = future.result()
+                self.progress["changed"] += changed
+            except Exception as e:
+                self.progress["failed"] += 1
+                self.stderr.write(f"Evidence {evidence_id}: {str(e)}")
+            self.progress["processed"] += 1
+        # Ids are submitted in order, so everything below the oldest one still
+        # running is finished and a resume can start there
+        low_water = min(pending.values()) - 1 if pending else self.submitted_id
+        self.progress["last_id"] = max(self.progress["last_id"], low_water)
+        self.save_checkpoint()
+
+    def save_checkpoint(self):
+        path = self.options["checkpoint"]
+        if not path:
+            return
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(self.progress, f)
+        os.replace(f"{path}.tmp", path)
+
+    def reanalyze(self, evidence) -> bool:
+        """Analyze one evidence item; True if its verdict changed"""
+        try:
+            before = getattr(evidence, "compliance_check", None)
+            was_compliant = before.is_compliant if before else None
+            if self.options["dry_run"]:
+                control_type = control_type_from_name(evidence.control.name)
+                ai_response = self.service._analyze_evidence(evidence, control_type)
+                is_compliant = bool(ai_response.get("is_compliant"))
+            else:
+                check = self.service.check_compliance(evidence.id, evidence=evidence)
+                if check.status == ComplianceCheck.STATUS_ERROR:
+                    raise Exception(check.rejection_reason)
+                is_compliant = check.is_compliant
+            # A legacy check without a verdict is unknown, not a flip
+            changed = was_compliant is not None and is_compliant != was_compliant
+            if changed:
+                with self.lock:
+                    self.stdout.write(f"Evidence {evidence.id}: is_compliant {was_compliant} -> {is_compliant}")
+            return changed
+        finally:
+            connection.close()
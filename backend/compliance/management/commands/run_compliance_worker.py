@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from compliance.models import ComplianceCheck
+from compliance.services import ComplianceAIService, process_pending_checks
+
+
+class Command(BaseCommand):
+    help = "Requeue compliance checks with expired leases and process pending checks"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run a single reap/process pass and exit")
+        parser.add_argument("--batch-size", type=int, default=10, help="Pending checks to process per pass")
+        parser.add_argument("--interval", type=float, default=5.0, help="Seconds to sleep when idle")
+
+    def handle(self, *args, **options):
+        service = ComplianceAIService()
+
+        while True:
+            requeued = ComplianceCheck.objects.requeue_expired()
+            if requeued:
+                self.stdout.write(f"Requeued {requeued} compliance checks with expired leases")
+
+            processed = process_pending_checks(service, limit=options["batch_size"])
+            if processed:
+                self.stdout.write(f"Processed {processed} pending compliance checks")
+
+            if options["once"]:
+                break
+            if not processed:
+                time.sleep(options["interval"])
@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from compliance.leader import AdvisoryLockLeader
+from compliance.reverify import schedule_reverification
+
+
+class Command(BaseCommand):
+    help = "Queue aging approved evidence for background re-verification; one leader node at a time"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run a single pass and exit")
+        parser.add_argument("--interval", type=float, default=300.0, help="Seconds between passes")
+        parser.add_argument("--max-age-days", type=float, default=None,
+                            help="Re-verify approvals older than this (default COMPLIANCE_REVERIFY_AFTER_DAYS)")
+        parser.add_argument("--jitter", type=float, default=None,
+                            help="Spread each pass over this many seconds (default COMPLIANCE_REVERIFY_JITTER_SECONDS)")
+        parser.add_argument("--limit", type=int, default=1000, help="Checks queued per pass at most")
+        parser.add_argument("--batch-size", type=int, default=500, help="Checks queued per transaction")
+
+    def handle(self, *args, **options):
+        max_age_days = options["max_age_days"]
+        if max_age_days is None:
+            max_age_days = getattr(settings, "COMPLIANCE_REVERIFY_AFTER_DAYS", 90)
+        jitter = options["jitter"]
+        if jitter is None:
+            jitter = getattr(settings, "COMPLIANCE_REVERIFY_JITTER_SECONDS", 3600)
+        leader = AdvisoryLockLeader("compliance-run-scheduler")
+        leading = None
+
+        try:
+            while True:
+                is_leader = leader.acquire()
+                if is_leader != leading:
+                    self.stdout.write("Acting as scheduler leader" if is_leader else "Another node leads, standing by")
+                    leading = is_leader
+
+                if is_leader:
+                    scheduled = schedule_reverification(
+                        timedelta(days=max_age_days), options["limit"], options["batch_size"], jitter
+                    )
+                    if scheduled:
+                        self.stdout.write(f"Queued {scheduled} approved checks for re-verification")
+
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+        finally:
+            leader.release()
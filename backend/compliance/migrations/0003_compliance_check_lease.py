@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compliance', '0002_remove_ai_configuration'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='lease_owner',
+            field=models.CharField(blank=True, default='', help_text='Worker currently processing this check', max_length=64),
+        ),
+    ]
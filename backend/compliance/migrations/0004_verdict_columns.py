@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def create_detected_elements_index(apps, schema_editor):
+    # GIN on jsonb only exists on PostgreSQL; other backends skip it
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS compliance_check_detected_elements_gin '
+            'ON compliance_compliancecheck USING gin (detected_elements jsonb_path_ops)'
+        )
+
+
+def drop_detected_elements_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS compliance_check_detected_elements_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compliance', '0003_compliance_check_lease'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ComplianceAnalysisRaw',
+            fields=[
+                ('compliance_check', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='raw_analysis', serialize=False, to='compliance.compliancecheck')),
+                ('encoding', models.CharField(default='zlib', max_length=10)),
+                ('payload', models.BinaryField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='confidence',
+            field=models.FloatField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='control_type',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=10),
+        ),
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='detected_elements',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='is_compliant',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='latency_ms',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='model',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='prompt_version',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='compliancecheck',
+            name='ai_analysis',
+            field=models.JSONField(blank=True, help_text='Legacy AI analysis blob, moved to the verdict columns by backfill_verdict_columns', null=True),
+        ),
+        migrations.RunPython(create_detected_elements_index, drop_detected_elements_index),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:43
+
+from django.db import migrations, models
+
+
+def start_existing_rows_at_one(apps, schema_editor):
+    # So a first sync from cursor 0 returns rows that predate the sequence
+    apps.get_model('compliance', 'ComplianceCheck').objects.update(change_seq=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compliance', '0004_verdict_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='change_seq',
+            field=models.BigIntegerField(db_index=True, default=0, help_text='Company change sequence of the last write'),
+        ),
+        migrations.RunPython(start_existing_rows_at_one, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_idempotency_key'),
+        ('compliance', '0005_compliancecheck_change_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='priority',
+            field=models.PositiveSmallIntegerField(choices=[(0, 'Interactive'), (1, 'Background')], default=0),
+        ),
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='queued_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='compliancecheck',
+            index=models.Index(fields=['status', 'priority', 'queued_at'], name='compliance_check_queue'),
+        ),
+    ]
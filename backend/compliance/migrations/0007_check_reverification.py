@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:53
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_verified_at(apps, schema_editor):
+    # Existing verdicts count as verified when the check was last written
+    apps.get_model('compliance', 'ComplianceCheck').objects.filter(
+        status__in=['approved', 'rejected']
+    ).update(verified_at=F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_idempotency_key'),
+        ('compliance', '0006_check_queue_lane'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='not_before',
+            field=models.DateTimeField(blank=True, help_text='Pending check is not picked up before this time', null=True),
+        ),
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='verified_at',
+            field=models.DateTimeField(blank=True, help_text='When the AI last returned a verdict', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='compliancecheck',
+            index=models.Index(fields=['status', 'verified_at', 'id'], name='compliance_check_verified'),
+        ),
+        migrations.RunPython(backfill_verified_at, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:56
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def create_created_at_brin_index(apps, schema_editor):
+    # BRIN only exists on PostgreSQL; other backends scan the small table
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS compliance_ai_call_created_brin '
+            'ON compliance_aicalltelemetry USING brin (created_at)'
+        )
+
+
+def drop_created_at_brin_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('DROP INDEX IF EXISTS compliance_ai_call_created_brin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compliance', '0007_check_reverification'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AICallTelemetry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('provider', models.CharField(blank=True, default='', max_length=20)),
+                ('model', models.CharField(blank=True, default='', max_length=100)),
+                ('control_type', models.CharField(blank=True, default='', max_length=10)),
+                ('status', models.CharField(choices=[('ok', 'OK'), ('text_fallback', 'Parsed from text'), ('error', 'Error')], max_length=20)),
+                ('encode_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('network_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('parse_ms', models.PositiveIntegerField(blank=True, null=True)),
+                ('image_bytes', models.PositiveIntegerField(blank=True, null=True)),
+                ('request_bytes', models.PositiveIntegerField(blank=True, null=True)),
+                ('response_bytes', models.PositiveIntegerField(blank=True, null=True)),
+                ('input_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('output_tokens', models.PositiveIntegerField(blank=True, null=True)),
+                ('error', models.CharField(blank=True, default='', max_length=200)),
+            ],
+        ),
+        migrations.RunPython(create_created_at_brin_index, drop_created_at_brin_index),
+    ]
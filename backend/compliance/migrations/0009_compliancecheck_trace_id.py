@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 22:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('compliance', '0008_ai_call_telemetry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='compliancecheck',
+            name='trace_id',
+            field=models.CharField(blank=True, default='', help_text='Trace of the last analysis', max_length=32),
+        ),
+    ]
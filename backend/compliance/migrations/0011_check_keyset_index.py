@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 23:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_idempotency_key'),
+        ('compliance', '0010_request_profile'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='compliancecheck',
+            index=models.Index(fields=['created_at', 'id'], name='compliance_check_keyset'),
+        ),
+    ]
@@ -1,10 +1,101 @@
-from django.db import models
+import json
+import zlib
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Q
 from django.contrib.auth import get_user_model
-from api.models import Control, Evidence
+from django.utils import timezone
+from api.models import Control, Evidence, next_change_seq
 
 User = get_user_model()
 
 
+def lease_duration() -> timedelta:
+    return timedelta(seconds=getattr(settings, 'COMPLIANCE_LEASE_SECONDS', 120))
+
+
+class ComplianceCheckQuerySet(models.QuerySet):
+    def alive(self):
+        """Checks of evidence that is not deleted, under a control that is not either"""
+        return self.filter(evidence__is_deleted=False, evidence__control__is_deleted=False)
+
+    def claimable(self):
+        """Checks nobody holds a live lease on"""
+        return self.filter(
+            ~Q(status=ComplianceCheck.STATUS_PROCESSING)
+            | Q(lease_expires_at__isnull=True)
+            | Q(lease_expires_at__lt=timezone.now())
+        )
+
+    def expired(self):
+        """Processing checks whose worker stopped renewing the lease"""
+        return self.filter(status=ComplianceCheck.STATUS_PROCESSING).filter(
+            Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lt=timezone.now())
+        )
+
+    def claim(self, check_id: int, owner: str, company_id: Optional[int] = None) -> bool:
+        """Atomically take the lease on a check; False if someone else holds it"""
+        now = timezone.now()
+        with transaction.atomic():
+            return bool(self.filter(id=check_id).claimable().update(
+                status=ComplianceCheck.STATUS_PROCESSING,
+                lease_owner=owner,
+                lease_expires_at=now + lease_duration(),
+                updated_at=now,
+                change_seq=next_change_seq(company_id),
+            ))
+
+    def renew(self, check_id: int, owner: str) -> bool:
+        """Extend a lease we still hold"""
+        return bool(self.filter(
+            id=check_id, lease_owner=owner, status=ComplianceCheck.STATUS_PROCESSING
+        ).update(lease_expires_at=timezone.now() + lease_duration()))
+
+    def enqueue(self, evidence, priority: int) -> 'ComplianceCheck':
+        """Create or reset the evidence's check as pending in the given lane"""
+        now = timezone.now()
+        check, created = self.get_or_create(
+            evidence=evidence,
+            defaults={'status': ComplianceCheck.STATUS_PENDING, 'priority': priority, 'queued_at': now},
+        )
+        if not created:
+            # Conditional UPDATE, so a worker claiming the check in between keeps it
+            with transaction.atomic():
+                requeued = self.filter(evidence=evidence).exclude(status=ComplianceCheck.STATUS_PROCESSING).update(
+                    status=ComplianceCheck.STATUS_PENDING,
+                    priority=priority,
+                    queued_at=now,
+                    not_before=None,
+                    updated_at=now,
+                    change_seq=next_change_seq(evidence.company_id),
+                )
+            if requeued:
+                check.status, check.priority, check.queued_at, check.not_before = (
+                    ComplianceCheck.STATUS_PENDING, priority, now, None
+                )
+            else:
+                check.refresh_from_db()
+        return check
+    
+    def requeue_expired(self) -> int:
+        """Put checks with expired leases back to pending"""
+        requeued = 0
+        with transaction.atomic():
+            for company_id in set(self.expired().values_list('evidence__company_id', flat=True)):
+                requeued += self.expired().filter(evidence__company_id=company_id).update(
+                    status=ComplianceCheck.STATUS_PENDING,
+                    lease_owner='',
+                    lease_expires_at=None,
+                    queued_at=timezone.now(),
+                    updated_at=timezone.now(),
+                    change_seq=next_change_seq(company_id),
+                )
+        return requeued
+
+
 class ComplianceCheck(models.Model):
     """Model to track compliance checks performed on evidence"""
     
@@ -14,6 +105,13 @@ class ComplianceCheck(models.Model):
     STATUS_REJECTED = "rejected"
     STATUS_ERROR = "error"
     
+    PRIORITY_INTERACTIVE = 0
+    PRIORITY_BACKGROUND = 1
+    PRIORITY_CHOICES = [
+        (PRIORITY_INTERACTIVE, "Interactive"),
+        (PRIORITY_BACKGROUND, "Background"),
+    ]
+    
     STATUS_CHOICES = [
         (STATUS_PENDING, "Pending"),
         (STATUS_PROCESSING, "Processing"),
@@ -24,15 +122,190 @@ class ComplianceCheck(models.Model):
     
     evidence = models.OneToOneField(Evidence, on_delete=models.CASCADE, related_name='compliance_check')
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
-    ai_analysis = models.JSONField(null=True, blank=True, help_text="AI analysis results")
+    ai_analysis = models.JSONField(null=True, blank=True, help_text="Legacy AI analysis blob, moved to the verdict columns by backfill_verdict_columns")
     rejection_reason = models.TextField(blank=True, help_text="Reason for rejection if applicable")
     recommendations = models.TextField(blank=True, help_text="AI recommendations for improvement")
+    lease_owner = models.CharField(max_length=64, blank=True, default='', help_text="Worker currently processing this check")
+    lease_expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    
+    # Queue lane and time of entering the pending state, for the fair scheduler
+    priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=PRIORITY_INTERACTIVE)
+    queued_at = models.DateTimeField(null=True, blank=True)
+    not_before = models.DateTimeField(null=True, blank=True, help_text="Pending check is not picked up before this time")
+    trace_id = models.CharField(max_length=32, blank=True, default='', help_text="Trace of the last analysis")
+    verified_at = models.DateTimeField(null=True, blank=True, help_text="When the AI last returned a verdict")
+    
+    # Verdict columns; the full model answer lives in ComplianceAnalysisRaw
+    is_compliant = models.BooleanField(null=True, blank=True)
+    confidence = models.FloatField(null=True, blank=True, db_index=True)
+    control_type = models.CharField(max_length=10, blank=True, default='', db_index=True)
+    model = models.CharField(max_length=100, blank=True, default='')
+    prompt_version = models.CharField(max_length=20, blank=True, default='')
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)
+    detected_elements = models.JSONField(default=list, blank=True)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    change_seq = models.BigIntegerField(default=0, db_index=True, help_text="Company change sequence of the last write")
+    
+    objects = ComplianceCheckQuerySet.as_manager()
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'priority', 'queued_at'], name='compliance_check_queue'),
+            models.Index(fields=['status', 'verified_at', 'id'], name='compliance_check_verified'),
+            # Keyset pages of the check list, newest first; each row reaches
+            # the company through the evidence primary key
+            models.Index(fields=['created_at', 'id'], name='compliance_check_keyset'),
+        ]
     
     def __str__(self):
         return f"Compliance Check for {self.evidence.name} - {self.status}"
+    
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'updated_at', 'change_seq'}
+        if ComplianceCheck.evidence.is_cached(self):
+            company_id = self.evidence.company_id
+        else:
+            company_id = Evidence.objects.filter(id=self.evidence_id).values_list('company_id', flat=True).first()
+        with transaction.atomic():
+            self.change_seq = next_change_seq(company_id)
+            super().save(*args, **kwargs)
+    
+    @staticmethod
+    def verdict_columns(ai_response: Dict[str, Any], control_type: str) -> Dict[str, Any]:
+        """Typed column values for an AI response dict"""
+        confidence = ai_response.get('confidence')
+        return {
+            'is_compliant': bool(ai_response.get('is_compliant')),
+            'confidence': float(confidence) if confidence is not None else None,
+            'control_type': control_type,
+            'model': (ai_response.get('model') or '')[:100],
+            'prompt_version': ai_response.get('prompt_version') or '',
+            'latency_ms': ai_response.get('latency_ms'),
+            'detected_elements': list(ai_response.get('detected_elements') or []),
+        }
+    
+    @property
+    def analysis(self) -> Optional[Dict[str, Any]]:
+        """Verdict in the shape the API has always returned as ai_analysis.
 
+        Reads ``raw_analysis`` for the reasoning, so select_related it when
+        rendering many checks.
+        """
+        if self.is_compliant is None:
+            return self.ai_analysis
+        analysis = {
+            'is_compliant': self.is_compliant,
+            'confidence': self.confidence,
+            'detected_elements': self.detected_elements,
+        }
+        raw = getattr(self, 'raw_analysis', None)
+        if raw is not None:
+            analysis['reasoning'] = raw.decode().get('reasoning', '')
+        return analysis
+
+
+class ComplianceAnalysisRaw(models.Model):
+    """Full AI response for a compliance check, stored apart from the hot row"""
+    
+    ENCODING_ZLIB = "zlib"
+    ENCODING_IDENTITY = "identity"
+    
+    compliance_check = models.OneToOneField(
+        ComplianceCheck, on_delete=models.CASCADE, primary_key=True, related_name='raw_analysis'
+    )
+    encoding = models.CharField(max_length=10, default=ENCODING_ZLIB)
+    payload = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Raw analysis for check {self.compliance_check_id}"
+    
+    @classmethod
+    def build(cls, compliance_check_id: int, ai_response: Dict[str, Any]) -> 'ComplianceAnalysisRaw':
+        data = json.dumps(ai_response, separators=(',', ':')).encode('utf-8')
+        if getattr(settings, 'COMPLIANCE_RAW_COMPRESS', True):
+            return cls(compliance_check_id=compliance_check_id, encoding=cls.ENCODING_ZLIB, payload=zlib.compress(data))
+        return cls(compliance_check_id=compliance_check_id, encoding=cls.ENCODING_IDENTITY, payload=data)
+    
+    @classmethod
+    def store(cls, compliance_check_id: int, ai_response: Dict[str, Any]) -> None:
+        """Insert or replace the raw analysis with a single statement"""
+        cls.objects.bulk_create(
+            [cls.build(compliance_check_id, ai_response)],
+            update_conflicts=True,
+            unique_fields=['compliance_check'],
+            update_fields=['encoding', 'payload', 'updated_at'],
+        )
+    
+    def decode(self) -> Dict[str, Any]:
+        data = bytes(self.payload)
+        if self.encoding == self.ENCODING_ZLIB:
+            data = zlib.decompress(data)
+        return json.loads(data)
+
+
+
+class AICallTelemetry(models.Model):
+    """One row per AI API call; append-only, read by /api/compliance/ai-stats/.
+
+    Queries filter on ``created_at``, which follows insertion order, so it
+    carries a BRIN index on PostgreSQL instead of a B-tree.
+    """
+    
+    STATUS_OK = "ok"
+    STATUS_TEXT_FALLBACK = "text_fallback"
+    STATUS_ERROR = "error"
+    STATUS_CHOICES = [
+        (STATUS_OK, "OK"),
+        (STATUS_TEXT_FALLBACK, "Parsed from text"),
+        (STATUS_ERROR, "Error"),
+    ]
+    
+    id = models.BigAutoField(primary_key=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    provider = models.CharField(max_length=20, blank=True, default='')
+    model = models.CharField(max_length=100, blank=True, default='')
+    control_type = models.CharField(max_length=10, blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    encode_ms = models.PositiveIntegerField(null=True, blank=True)
+    network_ms = models.PositiveIntegerField(null=True, blank=True)
+    parse_ms = models.PositiveIntegerField(null=True, blank=True)
+    image_bytes = models.PositiveIntegerField(null=True, blank=True)
+    request_bytes = models.PositiveIntegerField(null=True, blank=True)
+    response_bytes = models.PositiveIntegerField(null=True, blank=True)
+    input_tokens = models.PositiveIntegerField(null=True, blank=True)
+    output_tokens = models.PositiveIntegerField(null=True, blank=True)
+    error = models.CharField(max_length=200, blank=True, default='')
+    
+    def __str__(self):
+        return f"{self.model or self.provider} call at {self.created_at} - {self.status}"
+
+
+class RequestProfile(models.Model):
+    """cProfile capture of one request an admin asked to profile.
+
+    The pstats file lives in ``REQUEST_PROFILE_DIR``; only the newest
+    ``REQUEST_PROFILE_MAX`` profiles are kept.
+    """
+    
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    method = models.CharField(max_length=10)
+    path = models.CharField(max_length=500)
+    query_string = models.TextField(blank=True, default='')
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    duration_ms = models.PositiveIntegerField()
+    file_name = models.CharField(max_length=100)
+    size_bytes = models.PositiveIntegerField(default=0)
+    summary = models.TextField(blank=True, default='', help_text="Top functions by cumulative time")
+    
+    class Meta:
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"{self.method} {self.path} ({self.duration_ms} ms)"
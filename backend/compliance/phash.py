@@ -0,0 +1,185 @@
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+
+
+HASH_SIZE = 8
+
+
+def compute_dhash(file_obj) -> str:
+    """Return the 64-bit difference hash of an image as 16 hex chars.
+
+    The image is shrunk to 9x8 grayscale and each bit records whether a pixel
+    is brighter than its right neighbour, which survives re-compression,
+    resizing and small edits such as a changed clock. Returns an empty string
+    for files Pillow cannot read.
+    """
+    position = file_obj.tell() if hasattr(file_obj, 'tell') else None
+    try:
+        with Image.open(file_obj) as image:
+            image = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+            pixels = list(image.getdata())
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError):
+        return ''
+    finally:
+        if position is not None:
+            file_obj.seek(position)
+
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f'{value:016x}'
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class BKTree:
+    """Burkhard-Keller tree over 64-bit hashes with Hamming distance.
+
+    Each node keeps its children keyed by their distance to the node, so a
+    radius query only descends into children whose key lies within
+    ``distance - radius .. distance + radius`` (triangle inequality).
+    """
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, value: int, item) -> None:
+        node = [value, item, {}]
+        self.size += 1
+        if self.root is None:
+            self.root = node
+            return
+        current = self.root
+        while True:
+            distance = hamming_distance(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, object]]:
+        """Return ``(distance, item)`` pairs within ``radius``, closest first"""
+        if self.root is None:
+            return []
+        matches = []
+        stack = [self.root]
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = hamming_distance(value, node_value)
+            if distance <= radius:
+                matches.append((distance, item))
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+
+class NearDuplicateIndex:
+    """Per company and control type BK-trees of confident verdicts.
+
+    Trees are keyed by ``(company_id, control_type)`` so a verdict is only ever
+    reused within the tenant that paid for it. They are built lazily from the
+    database and rebuilt after ``PHASH_INDEX_TTL`` seconds so verdicts from
+    other workers show up; verdicts produced in this process are added
+    straight away. A rebuild runs outside the lock: one caller scans the
+    table while the others keep searching the previous trees, and the result
+    is swapped in with whatever was added meanwhile.
+    """
+
+    def __init__(self):
+        self._trees: Dict[Tuple[int, str], BKTree] = {}
+        self._built_at: Optional[float] = None
+        self._building = False
+        self._added_while_building: List[Tuple[Tuple[int, str], int, Tuple[int, int]]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def radius(self) -> int:
+        return getattr(settings, 'PHASH_MATCH_RADIUS', 6)
+
+    @property
+    def min_confidence(self) -> float:
+        return getattr(settings, 'PHASH_REUSE_MIN_CONFIDENCE', 0.8)
+
+    def _is_stale(self) -> bool:
+        ttl = getattr(settings, 'PHASH_INDEX_TTL', 300)
+        return self._built_at is None or time.monotonic() - self._built_at > ttl
+
+    def _build(self) -> Dict[Tuple[int, str], BKTree]:
+        from .models import ComplianceCheck
+        from .services import control_type_from_name
+
+        trees: Dict[Tuple[int, str], BKTree] = {}
+        rows = ComplianceCheck.objects.filter(
+            status__in=[ComplianceCheck.STATUS_APPROVED, ComplianceCheck.STATUS_REJECTED],
+            evidence__is_deleted=False,
+            confidence__gte=self.min_confidence,
+        ).exclude(evidence__perceptual_hash='').values_list(
+            'id', 'evidence_id', 'evidence__company_id', 'evidence__perceptual_hash', 'evidence__control__name'
+        )
+        for check_id, evidence_id, company_id, perceptual_hash, control_name in rows.iterator(chunk_size=2000):
+            key = (company_id, control_type_from_name(control_name))
+            trees.setdefault(key, BKTree()).add(int(perceptual_hash, 16), (check_id, evidence_id))
+        return trees
+
+    def _refresh(self) -> None:
+        with self._lock:
+            if self._building or not self._is_stale():
+                return
+            self._building = True
+            self._added_while_building = []
+        trees = None
+        try:
+            trees = self._build()
+        finally:
+            with self._lock:
+                if trees is not None:
+                    for key, value, item in self._added_while_building:
+                        trees.setdefault(key, BKTree()).add(value, item)
+                    self._trees = trees
+                    self._built_at = time.monotonic()
+                self._building = False
+                self._added_while_building = []
+
+    def find(self, perceptual_hash: str, control_type: str, company_id: int,
+             exclude_evidence_id: Optional[int] = None) -> List[int]:
+        """Return the company's compliance check ids of near-duplicates, closest first"""
+        if not perceptual_hash:
+            return []
+        self._refresh()
+        with self._lock:
+            tree = self._trees.get((company_id, control_type))
+            if tree is None:
+                return []
+            matches = tree.search(int(perceptual_hash, 16), self.radius)
+        return [check_id for _, (check_id, evidence_id) in matches if evidence_id != exclude_evidence_id]
+
+    def add(self, perceptual_hash: str, control_type: str, company_id: int, check_id: int,
+            evidence_id: int, confidence: float) -> None:
+        if not perceptual_hash or confidence is None or confidence < self.min_confidence:
+            return
+        key, value, item = (company_id, control_type), int(perceptual_hash, 16), (check_id, evidence_id)
+        with self._lock:
+            if self._building:
+                self._added_while_building.append((key, value, item))
+            if self._built_at is not None:
+                self._trees.setdefault(key, BKTree()).add(value, item)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._trees = {}
+            self._built_at = None
+
+
+near_duplicate_index = NearDuplicateIndex()
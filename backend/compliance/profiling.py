@@ -0,0 +1,115 @@
+"""
+On-demand profiling of single requests for admins.
+
+An admin (``User.role == "admin"``) adds ``X-Profile: 1`` or ``?_profile=1``
+to a request and it runs under cProfile. The pstats file is written to
+``REQUEST_PROFILE_DIR``, recorded as a ``RequestProfile`` and its id returned
+in ``X-Profile-Id``. Profiles are listed and downloaded from the Django
+admin, and can be opened with ``python -m pstats``, snakeviz or converted to
+a flamegraph with flameprof. The directory is a ring buffer: after each
+capture everything beyond the newest ``REQUEST_PROFILE_MAX`` is deleted.
+
+Requests without the flag only pay for a header and a query lookup.
+"""
+import cProfile
+import io
+import logging
+import os
+import pstats
+import time
+import uuid
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = '_profile'
+SUMMARY_LINES = 40
+
+
+def profile_dir() -> str:
+    return str(getattr(settings, 'REQUEST_PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def profile_path(file_name: str) -> str:
+    return os.path.join(profile_dir(), file_name)
+
+
+def _summary(profiler: cProfile.Profile) -> str:
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(SUMMARY_LINES)
+    return out.getvalue()
+
+
+def _store(request, response, profiler: cProfile.Profile, duration_ms: int):
+    from .models import RequestProfile
+
+    os.makedirs(profile_dir(), exist_ok=True)
+    file_name = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.pstats"
+    profiler.dump_stats(profile_path(file_name))
+    profile = RequestProfile.objects.create(
+        user=request.user,
+        method=request.method,
+        path=request.path[:500],
+        query_string=request.META.get('QUERY_STRING', ''),
+        status_code=response.status_code,
+        duration_ms=duration_ms,
+        file_name=file_name,
+        size_bytes=os.path.getsize(profile_path(file_name)),
+        summary=_summary(profiler),
+    )
+    prune_profiles()
+    return profile
+
+
+def prune_profiles() -> int:
+    """Delete profiles beyond the newest ``REQUEST_PROFILE_MAX``, files included"""
+    from .models import RequestProfile
+
+    keep = getattr(settings, 'REQUEST_PROFILE_MAX', 50)
+    old = list(RequestProfile.objects.order_by('-created_at', '-id').values_list('id', 'file_name')[keep:])
+    for _, file_name in old:
+        try:
+            os.remove(profile_path(file_name))
+        except FileNotFoundError:
+            pass
+    RequestProfile.objects.filter(id__in=[profile_id for profile_id, _ in old]).delete()
+    return len(old)
+
+
+class RequestProfilingMiddleware:
+    """Profile the request when an admin asks for it; place after authentication"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # The raw query string check keeps the QueryDict unparsed on normal requests
+        requested = PROFILE_HEADER in request.META or (
+            PROFILE_PARAM in request.META.get('QUERY_STRING', '') and PROFILE_PARAM in request.GET
+        )
+        if not requested:
+            return self.get_response(request)
+        user = getattr(request, 'user', None)
+        if not (user and user.is_authenticated and user.role == 'admin'):
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            response = self.get_response(request)
+            # Streaming bodies are produced after this returns and are not profiled
+            if callable(getattr(response, 'render', None)) and not response.is_rendered:
+                response.render()
+        finally:
+            profiler.disable()
+        duration_ms = int((time.perf_counter() - started) * 1000)
+
+        try:
+            profile = _store(request, response, profiler, duration_ms)
+            response['X-Profile-Id'] = str(profile.id)
+        except Exception as e:
+            logger.warning(f"Could not store request profile: {str(e)}")
+        return response
@@ -0,0 +1,350 @@
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import requests
+from django.conf import settings
+
+
+PROVIDER_REGISTRY: Dict[str, type] = {}
+
+
+class ProviderResult:
+    """Text answer of a model plus metadata about the call"""
+
+    def __init__(self, text: str, provider: Optional[str] = None, model: Optional[str] = None,
+                 input_tokens: Optional[int] = None, output_tokens: Optional[int] = None,
+                 request_bytes: Optional[int] = None, response_bytes: Optional[int] = None,
+                 latency_ms: Optional[int] = None):
+        self.text = text
+        self.provider = provider
+        self.model = model
+        self.input_tokens = input_tokens
+        self.output_tokens = output_tokens
+        self.request_bytes = request_bytes
+        self.response_bytes = response_bytes
+        # Set by ProviderRouter to the time of the attempt that answered
+        self.latency_ms = latency_ms
+
+
+def register_provider(name: str):
+    """Class decorator that makes a provider available under ``name``"""
+    def decorator(cls):
+        cls.name = name
+        PROVIDER_REGISTRY[name] = cls
+        return cls
+    return decorator
+
+
+class AIProvider:
+    """Base class for vision model backends.
+
+    A provider turns a prompt plus a base64 image into the raw text answer of
+    the model. Prompt building and answer parsing stay in ComplianceAIService.
+    """
+
+    name = None
+
+    def __init__(self, api_url: Optional[str] = None, api_key: Optional[str] = None,
+                 model: Optional[str] = None, timeout: int = 60):
+        self.api_url = api_url
+        self.api_key = api_key
+        self.model = model
+        self.timeout = timeout
+
+    def is_configured(self) -> bool:
+        """Check if the provider has everything it needs to make a call"""
+        return bool(self.api_url and self.api_key)
+
+    def generate(self, prompt: str, image_base64: str, control_type: str) -> ProviderResult:
+        """Return the model's answer for the prompt and image"""
+        raise NotImplementedError
+
+    def _result(self, text: str, response=None, input_tokens: Optional[int] = None,
+                output_tokens: Optional[int] = None) -> ProviderResult:
+        result = ProviderResult(
+            text, provider=self.name, model=self.model or self.name,
+            input_tokens=input_tokens, output_tokens=output_tokens,
+        )
+        if response is not None:
+            result.request_bytes = len(response.request.body or b'')
+            result.response_bytes = len(response.content)
+        return result
+
+    def describe(self) -> Dict[str, Any]:
+        """Public description of the provider, never includes the key"""
+        return {
+            'provider': self.name,
+            'api_url': self.api_url,
+            'model': self.model,
+            'has_api_key': bool(self.api_key),
+        }
+
+
+@register_provider('gemini')
+class GeminiProvider(AIProvider):
+    """Google Gemini generateContent API"""
+
+    def generate(self, prompt: str, image_base64: str, control_type: str) -> ProviderResult:
+        headers = {
+            'X-goog-api-key': self.api_key,
+            'Content-Type': 'application/json'
+        }
+        payload = {
+            'contents': [
+                {
+                    'parts': [
+                        {
+                            'text': prompt
+                        },
+                        {
+                            'inline_data': {
+                                'mime_type': 'image/jpeg',
+                                'data': image_base64
+                            }
+                        }
+                    ]
+                }
+            ],
+            'generationConfig': {
+                'maxOutputTokens': 500,
+                'temperature': 0.1
+            }
+        }
+
+        try:
+            response = requests.post(self.api_url, headers=headers, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Gemini API request failed: {str(e)}")
+
+        result = response.json()
+        usage = result.get('usageMetadata') or {}
+        if 'candidates' in result and len(result['candidates']) > 0:
+            candidate = result['candidates'][0]
+            if 'content' in candidate and 'parts' in candidate['content']:
+                return self._result(
+                    candidate['content']['parts'][0]['text'], response,
+                    input_tokens=usage.get('promptTokenCount'), output_tokens=usage.get('candidatesTokenCount'),
+                )
+            raise Exception("No content in Gemini response")
+        raise Exception("No response from Gemini API")
+
+
+@register_provider('openai')
+class OpenAICompatibleProvider(AIProvider):
+    """Any endpoint speaking the OpenAI chat completions format"""
+
+    def generate(self, prompt: str, image_base64: str, control_type: str) -> ProviderResult:
+        headers = {
+            'Authorization': f'Bearer {self.api_key}',
+            'Content-Type': 'application/json'
+        }
+        payload = {
+            'model': self.model,
+            'messages': [
+                {
+                    'role': 'user',
+                    'content': [
+                        {'type': 'text', 'text': prompt},
+                        {
+                            'type': 'image_url',
+                            'image_url': {'url': f'data:image/jpeg;base64,{image_base64}'}
+                        },
+                    ]
+                }
+            ],
+            'max_tokens': 500,
+            'temperature': 0.1
+        }
+
+        try:
+            response = requests.post(self.api_url, headers=headers, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"OpenAI-compatible API request failed: {str(e)}")
+
+        result = response.json()
+        choices = result.get('choices') or []
+        if not choices:
+            raise Exception("No response from OpenAI-compatible API")
+        content = choices[0].get('message', {}).get('content')
+        if not content:
+            raise Exception("No content in OpenAI-compatible response")
+        usage = result.get('usage') or {}
+        return self._result(
+            content, response,
+            input_tokens=usage.get('prompt_tokens'), output_tokens=usage.get('completion_tokens'),
+        )
+
+
+@register_provider('stub')
+class LocalStubProvider(AIProvider):
+    """Local stand-in that answers instantly without network access"""
+
+    RESPONSES = {
+        'MFA': {
+            "is_compliant": True,
+            "confidence": 0.85,
+            "detected_elements": ["OTP input field", "6-digit code format", "Authenticator app reference"],
+            "reasoning": "Screenshot shows clear OTP input field with proper labeling"
+        },
+        'SSO': {
+            "is_compliant": True,
+            "confidence": 0.90,
+            "detected_elements": ["Microsoft logo", "Sign in with Microsoft button", "Azure AD branding"],
+            "reasoning": "Screenshot shows Microsoft SSO integration with proper branding"
+        },
+    }
+
+    def is_configured(self) -> bool:
+        return True
+
+    def generate(self, prompt: str, image_base64: str, control_type: str) -> ProviderResult:
+        return self._result(json.dumps(self.RESPONSES.get(control_type, self.RESPONSES['MFA'])))
+
+
+class ProviderEndpoint:
+    """One provider instance (URL + key) with its routing weight and load"""
+
+    def __init__(self, provider: AIProvider, weight: int = 1):
+        self.provider = provider
+        self.weight = max(int(weight), 1)
+        self.outstanding = 0
+        self.current_weight = 0
+
+    def describe(self) -> Dict[str, Any]:
+        data = self.provider.describe()
+        data.update({'weight': self.weight, 'outstanding': self.outstanding})
+        return data
+
+
+class ProviderRouter:
+    """Spread calls across several provider endpoints.
+
+    Supported strategies are ``weighted_round_robin`` (smooth WRR, as used by
+    nginx) and ``least_outstanding`` (fewest in-flight calls per unit of
+    weight). A failing endpoint is skipped and the next one is tried.
+    """
+
+    STRATEGY_WEIGHTED_ROUND_ROBIN = 'weighted_round_robin'
+    STRATEGY_LEAST_OUTSTANDING = 'least_outstanding'
+    STRATEGIES = (STRATEGY_WEIGHTED_ROUND_ROBIN, STRATEGY_LEAST_OUTSTANDING)
+
+    def __init__(self, endpoints: List[ProviderEndpoint], strategy: str = STRATEGY_WEIGHTED_ROUND_ROBIN):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+        self.endpoints = [endpoint for endpoint in endpoints if endpoint.provider.is_configured()]
+        self.strategy = strategy
+        self._lock = threading.Lock()
+
+    def is_configured(self) -> bool:
+        return bool(self.endpoints)
+
+    def call_timeout(self) -> int:
+        """Longest ``generate`` can take: every endpoint timing out in turn"""
+        return sum(endpoint.provider.timeout for endpoint in self.endpoints)
+
+    def models(self) -> List[str]:
+        """Distinct models any call may be answered by"""
+        return sorted({endpoint.provider.model or endpoint.provider.name for endpoint in self.endpoints})
+
+    def describe(self) -> List[Dict[str, Any]]:
+        return [endpoint.describe() for endpoint in self.endpoints]
+
+    def _select(self, exclude) -> ProviderEndpoint:
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        if self.strategy == self.STRATEGY_LEAST_OUTSTANDING:
+            chosen = min(candidates, key=lambda endpoint: endpoint.outstanding / endpoint.weight)
+        else:
+            total = 0
+            chosen = None
+            for endpoint in candidates:
+                endpoint.current_weight += endpoint.weight
+                total += endpoint.weight
+                if chosen is None or endpoint.current_weight > chosen.current_weight:
+                    chosen = endpoint
+            chosen.current_weight -= total
+        chosen.outstanding += 1
+        return chosen
+
+    def generate(self, prompt: str, image_base64: str, control_type: str,
+                 on_failure: Optional[Callable[[ProviderEndpoint, int, Exception], None]] = None) -> ProviderResult:
+        """Send the request to the selected endpoint, failing over on errors.
+
+        ``on_failure(endpoint, latency_ms, error)`` is called for every
+        failed attempt, including ones a later endpoint recovers from.
+        """
+        if not self.endpoints:
+            raise Exception("AI service not configured. Please set AI_API_URL and AI_API_KEY in environment variables.")
+
+        tried = []
+        last_error = None
+        while len(tried) < len(self.endpoints):
+            with self._lock:
+                endpoint = self._select(tried)
+            tried.append(endpoint)
+            started = time.perf_counter()
+            try:
+                result = endpoint.provider.generate(prompt, image_base64, control_type)
+                result.latency_ms = int((time.perf_counter() - started) * 1000)
+                return result
+            except Exception as e:
+                last_error = e
+                if on_failure:
+                    on_failure(endpoint, int((time.perf_counter() - started) * 1000), e)
+            finally:
+                with self._lock:
+                    endpoint.outstanding -= 1
+        raise last_error
+
+
+def build_router(provider_configs: Optional[List[Dict[str, Any]]] = None, strategy: Optional[str] = None) -> ProviderRouter:
+    """Build a router from ``AI_PROVIDERS`` style dicts.
+
+    Each dict takes ``provider``, ``api_url``, ``api_key`` (or ``api_keys`` to
+    fan one endpoint out into one entry per key), ``model``, ``weight`` and
+    ``timeout``.
+    """
+    if provider_configs is None:
+        provider_configs = getattr(settings, 'AI_PROVIDERS', None) or []
+    if strategy is None:
+        strategy = getattr(settings, 'AI_ROUTING_STRATEGY', ProviderRouter.STRATEGY_WEIGHTED_ROUND_ROBIN)
+
+    endpoints = []
+    for config in provider_configs:
+        name = config.get('provider', 'gemini')
+        if name not in PROVIDER_REGISTRY:
+            raise ValueError(f"Unknown AI provider: {name}")
+        keys = config.get('api_keys') or [config.get('api_key')]
+        for key in keys:
+            provider = PROVIDER_REGISTRY[name](
+                api_url=config.get('api_url'),
+                api_key=key,
+                model=config.get('model'),
+                timeout=config.get('timeout', 60),
+            )
+            endpoints.append(ProviderEndpoint(provider, weight=config.get('weight', 1)))
+    return ProviderRouter(endpoints, strategy=strategy)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ProviderRouter:
+    """Process-wide router, so in-flight counts are shared between requests"""
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = build_router()
+    return _router
+
+
+def reset_router():
+    """Drop the cached router, e.g. after settings change in tests"""
+    global _router
+    with _router_lock:
+        _router = None
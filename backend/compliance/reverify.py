@@ -0,0 +1,69 @@
+"""
+Periodic re-verification of approved evidence.
+
+Approved checks whose last verdict is older than the configured age are put
+back in the queue on the background lane, so the fair scheduler only gives
+them capacity interactive uploads leave over. Each check gets a random
+``not_before`` within the jitter window, which spreads the AI calls out
+instead of releasing a whole batch at once. Due checks are read in keyset
+order on (verified_at, id), matching the ``compliance_check_verified`` index.
+"""
+import random
+from datetime import timedelta
+from typing import Optional
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from api.models import next_change_seq
+from .models import ComplianceCheck
+
+
+def due_for_reverification(max_age: timedelta, now=None):
+    now = now or timezone.now()
+    return ComplianceCheck.objects.filter(
+        status=ComplianceCheck.STATUS_APPROVED,
+        verified_at__lt=now - max_age,
+        evidence__is_deleted=False,
+    )
+
+
+def schedule_reverification(max_age: timedelta, limit: int, batch_size: int = 500,
+                            jitter_seconds: float = 0, now=None) -> int:
+    """Queue up to ``limit`` aging approved checks; returns how many were queued"""
+    now = now or timezone.now()
+    due = due_for_reverification(max_age, now)
+    fields = ['status', 'priority', 'queued_at', 'not_before', 'updated_at', 'change_seq']
+    scheduled = 0
+    last: Optional[tuple] = None
+    
+    while scheduled < limit:
+        page = due
+        if last is not None:
+            page = page.filter(Q(verified_at__gt=last[0]) | Q(verified_at=last[0], id__gt=last[1]))
+        with transaction.atomic():
+            rows = list(
+                page.select_for_update(skip_locked=True, of=('self',))
+                .order_by('verified_at', 'id')
+                .values_list('id', 'verified_at', 'evidence__company_id')[:min(batch_size, limit - scheduled)]
+            )
+            if not rows:
+                break
+            seqs = {company_id: next_change_seq(company_id) for company_id in sorted({row[2] for row in rows})}
+            ComplianceCheck.objects.bulk_update([
+                ComplianceCheck(
+                    id=check_id,
+                    status=ComplianceCheck.STATUS_PENDING,
+                    priority=ComplianceCheck.PRIORITY_BACKGROUND,
+                    queued_at=now,
+                    not_before=now + timedelta(seconds=random.uniform(0, jitter_seconds)),
+                    updated_at=now,
+                    change_seq=seqs[company_id],
+                )
+                for check_id, _, company_id in rows
+            ], fields)
+        scheduled += len(rows)
+        last_id, last_verified_at, _ = rows[-1]
+        last = (last_verified_at, last_id)
+    return scheduled
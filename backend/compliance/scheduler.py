@@ -0,0 +1,203 @@
+"""
+Weighted fair scheduling of pending compliance checks across companies.
+
+Pending ``ComplianceCheck`` rows are the queue. They sit in one of two lanes:
+interactive (uploads a user is waiting on) and background (imports, backfills
+and re-verification). Each call to ``FairScheduler.next_batch`` splits the
+batch between the lanes by ``COMPLIANCE_LANE_WEIGHTS``, and a slot one lane
+cannot use goes to the other. Within a lane, companies are served by
+deficit round-robin weighted by ``Company.analysis_weight``, so one tenant's
+bulk import cannot starve everyone else's checks. No company gets more than
+``COMPLIANCE_TENANT_MAX_CONCURRENCY`` checks in flight across both lanes,
+counting the live leases held by every worker.
+
+Deficits are kept in the worker process. A restart only loses the carry-over
+of a partly used quantum.
+"""
+import math
+import threading
+from collections import defaultdict, deque
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Count, F, Min, Q
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from accounts.models import Company
+from .models import ComplianceCheck
+
+LANES = {
+    ComplianceCheck.PRIORITY_INTERACTIVE: 'interactive',
+    ComplianceCheck.PRIORITY_BACKGROUND: 'background',
+}
+
+
+def tenant_max_concurrency() -> int:
+    return getattr(settings, 'COMPLIANCE_TENANT_MAX_CONCURRENCY', 2)
+
+
+def lane_weights() -> Dict[int, int]:
+    weights = getattr(settings, 'COMPLIANCE_LANE_WEIGHTS', {'interactive': 4, 'background': 1})
+    return {priority: max(1, int(weights.get(name, 1))) for priority, name in LANES.items()}
+
+
+class DeficitRoundRobin:
+    """Deficit round-robin over the companies with work in one lane"""
+
+    def __init__(self):
+        self._order: deque = deque()
+        self._deficits: Dict[int, int] = defaultdict(int)
+
+    def pick(self, backlog: Dict[int, int], weights: Dict[int, int], headroom: Dict[int, int],
+             slots: int) -> Dict[int, int]:
+        """How many checks to take from each company, at most ``slots`` in total.
+
+        ``backlog`` is the pending depth, ``headroom`` how many more checks a
+        company may have in flight. Companies whose queue has emptied are
+        dropped along with their deficit.
+        """
+        for company_id in [c for c in self._order if not backlog.get(c)]:
+            self._order.remove(company_id)
+            self._deficits.pop(company_id, None)
+        for company_id in sorted(c for c, depth in backlog.items() if depth and c not in self._deficits):
+            self._order.append(company_id)
+            self._deficits[company_id] = 0
+
+        picked: Dict[int, int] = defaultdict(int)
+        eligible = {c for c in self._order if headroom.get(c, 0) > 0}
+        while slots > 0 and eligible:
+            company_id = self._order[0]
+            self._order.rotate(-1)
+            if company_id not in eligible:
+                continue
+            self._deficits[company_id] += max(1, weights.get(company_id, 1))
+            room = min(backlog[company_id] - picked[company_id], headroom[company_id] - picked[company_id])
+            take = min(self._deficits[company_id], room, slots)
+            picked[company_id] += take
+            self._deficits[company_id] -= take
+            slots -= take
+            if take == room:
+                eligible.discard(company_id)
+                if picked[company_id] == backlog[company_id]:
+                    self._deficits[company_id] = 0
+        return {company_id: n for company_id, n in picked.items() if n}
+
+
+class FairScheduler:
+    def __init__(self):
+        self._lanes = {priority: DeficitRoundRobin() for priority in LANES}
+        self._lock = threading.Lock()
+
+    def _pending(self):
+        return ComplianceCheck.objects.filter(
+            Q(not_before__isnull=True) | Q(not_before__lte=timezone.now()),
+            status=ComplianceCheck.STATUS_PENDING,
+            evidence__is_deleted=False,
+        )
+
+    def _live_leases(self):
+        return ComplianceCheck.objects.filter(
+            status=ComplianceCheck.STATUS_PROCESSING, lease_expires_at__gt=timezone.now()
+        )
+
+    def _in_flight(self) -> Dict[int, int]:
+        rows = (
+            self._live_leases()
+            .values('evidence__company_id')
+            .annotate(n=Count('id'))
+            .order_by()
+        )
+        return {row['evidence__company_id']: row['n'] for row in rows}
+
+    def _backlog(self) -> Dict[int, Dict[int, Dict[str, Any]]]:
+        """Pending depth and oldest queue time per lane and company"""
+        rows = (
+            self._pending()
+            .values('priority', 'evidence__company_id')
+            .annotate(depth=Count('id'), oldest=Min(Coalesce('queued_at', 'created_at')))
+            .order_by()
+        )
+        backlog: Dict[int, Dict[int, Dict[str, Any]]] = {priority: {} for priority in LANES}
+        for row in rows:
+            backlog.setdefault(row['priority'], {})[row['evidence__company_id']] = row
+        return backlog
+
+    def has_capacity(self, company_id: int) -> bool:
+        """Whether the company may start another check right now"""
+        in_flight = self._live_leases().filter(evidence__company_id=company_id).count()
+        return in_flight < tenant_max_concurrency()
+
+    def next_batch(self, limit: int) -> List[int]:
+        """Evidence ids of the pending checks to run next, in dispatch order"""
+        backlog = self._backlog()
+        if not any(backlog.values()):
+            return []
+        company_ids = {c for lane in backlog.values() for c in lane}
+        weights = dict(Company.objects.filter(id__in=company_ids).values_list('id', 'analysis_weight'))
+        in_flight = self._in_flight()
+        headroom = {c: max(0, tenant_max_concurrency() - in_flight.get(c, 0)) for c in company_ids}
+        depths = {priority: {c: row['depth'] for c, row in lane.items()} for priority, lane in backlog.items()}
+
+        plan: List[Tuple[int, int, int]] = []
+        with self._lock:
+            shares = self._lane_shares(limit, depths)
+            remaining = limit
+            # Second pass hands slots one lane could not use to the other
+            for priority in [*LANES, *LANES]:
+                slots = min(shares.pop(priority, remaining), remaining)
+                if slots <= 0:
+                    continue
+                picked = self._lanes[priority].pick(depths[priority], weights, headroom, slots)
+                for company_id, n in picked.items():
+                    plan.append((priority, company_id, n))
+                    headroom[company_id] -= n
+                    depths[priority][company_id] -= n
+                    remaining -= n
+
+        evidence_ids: List[int] = []
+        for priority, company_id, n in plan:
+            evidence_ids.extend(
+                self._pending()
+                .filter(priority=priority, evidence__company_id=company_id)
+                .order_by(F('queued_at').asc(nulls_first=True), 'id')
+                .values_list('evidence_id', flat=True)[:n]
+            )
+        return evidence_ids
+
+    @staticmethod
+    def _lane_shares(limit: int, depths: Dict[int, Dict[int, int]]) -> Dict[int, int]:
+        weights = {priority: weight for priority, weight in lane_weights().items() if any(depths[priority].values())}
+        total = sum(weights.values())
+        return {priority: math.ceil(limit * weight / total) for priority, weight in weights.items()}
+
+    def queue_stats(self, company_filter: Optional[Iterable[int]] = None) -> List[Dict[str, Any]]:
+        """Queue depth, oldest wait and in-flight count per company and lane"""
+        now = timezone.now()
+        backlog = self._backlog()
+        in_flight = self._in_flight()
+        company_ids = {c for lane in backlog.values() for c in lane} | set(in_flight)
+        if company_filter is not None:
+            company_ids &= set(company_filter)
+        companies = Company.objects.filter(id__in=company_ids).values_list('id', 'name', 'analysis_weight')
+        stats = []
+        for cid, name, weight in sorted(companies):
+            lanes = {}
+            for priority, lane in LANES.items():
+                row = backlog[priority].get(cid)
+                lanes[lane] = {
+                    'depth': row['depth'] if row else 0,
+                    'oldest_wait_seconds': round((now - row['oldest']).total_seconds(), 3) if row else 0,
+                }
+            stats.append({
+                'company_id': cid,
+                'company': name,
+                'weight': weight,
+                'in_flight': in_flight.get(cid, 0),
+                'max_concurrency': tenant_max_concurrency(),
+                'lanes': lanes,
+            })
+        return stats
+
+
+fair_scheduler = FairScheduler()
@@ -0,0 +1,19 @@
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from accounts.models import Company
+from api.models import Control, Evidence, SyncTombstone, record_tombstone
+from api.signals import deleted_with
+from .models import ComplianceCheck
+
+
+@receiver(post_delete, sender=ComplianceCheck)
+def compliance_check_deleted(sender, instance, origin=None, **kwargs):
+    # A check deleted with its evidence goes away with the evidence's tombstone
+    if deleted_with(origin, Company, Control, Evidence):
+        return
+    if ComplianceCheck.evidence.is_cached(instance):
+        company_id = instance.evidence.company_id
+    else:
+        company_id = Evidence.objects.filter(id=instance.evidence_id).values_list('company_id', flat=True).first()
+    record_tombstone(SyncTombstone.KIND_COMPLIANCE_CHECK, company_id, instance.id)
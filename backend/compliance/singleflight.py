@@ -0,0 +1,104 @@
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Optional
+
+from django.core.cache import cache
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key into a single execution.
+
+    Within a process, followers wait on the leader's thread event. Across
+    workers the leader holds a lock in the shared Django cache and publishes
+    its result there for ``result_timeout`` seconds; followers in other
+    processes poll until the lock is released and then read that result. If
+    the leader failed or its result is gone, the next caller takes over.
+    Results must be picklable when the cache is shared.
+
+    The cache lock must outlive the slowest call, or a second worker starts
+    a duplicate. Callers that know their worst case, such as the provider
+    router's summed endpoint timeouts, pass it as ``lock_timeout`` to ``do``.
+    """
+
+    def __init__(self, namespace: str, lock_timeout: int = 120, result_timeout: int = 30,
+                 poll_interval: float = 0.2):
+        self.namespace = namespace
+        self.lock_timeout = lock_timeout
+        self.result_timeout = result_timeout
+        self.poll_interval = poll_interval
+        self._calls: Dict[str, _Call] = {}
+        self._lock = threading.Lock()
+
+    def _lock_key(self, key: str) -> str:
+        return f'singleflight:{self.namespace}:lock:{key}'
+
+    def _result_key(self, key: str) -> str:
+        return f'singleflight:{self.namespace}:result:{key}'
+
+    def do(self, key: str, fn: Callable[[], Any], lock_timeout: Optional[int] = None) -> Any:
+        """Run ``fn`` unless an identical call is in flight, then share its result"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._do_shared(key, fn, lock_timeout or self.lock_timeout)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def _do_shared(self, key: str, fn: Callable[[], Any], lock_timeout: int) -> Any:
+        lock_key = self._lock_key(key)
+        result_key = self._result_key(key)
+        deadline = time.monotonic() + lock_timeout
+
+        while True:
+            token = uuid.uuid4().hex
+            if cache.add(lock_key, token, lock_timeout):
+                try:
+                    result = fn()
+                    cache.set(result_key, (token, result), self.result_timeout)
+                    return result
+                finally:
+                    if cache.get(lock_key) == token:
+                        cache.delete(lock_key)
+
+            # Another worker is running it: wait for the lock to go away
+            holder = cache.get(lock_key)
+            while holder is not None and time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                if cache.get(lock_key) != holder:
+                    break
+
+            published = cache.get(result_key)
+            if published is not None and published[0] == holder:
+                return published[1]
+            if time.monotonic() >= deadline:
+                raise Exception(f"Timed out waiting for in-flight call {key}")
+
+
+# Whole check_compliance runs, keyed by evidence id
+compliance_check_flights = SingleFlight('compliance-check')
+# Model calls, keyed by control type and image content hash across evidence
+analysis_flights = SingleFlight('ai-analysis')
@@ -0,0 +1,217 @@
+"""
+Minimal OpenTelemetry-style tracing for the upload-to-verdict pipeline.
+
+Spans carry W3C trace and span ids and nest through a context variable, so
+``with span("ai.call"):`` inside a request lands in that request's trace.
+``TracingMiddleware`` opens the root span of each request and continues an
+incoming ``traceparent`` header. ``TraceContextFilter`` puts the current ids
+on log records, and the verdict writes store the trace id on the
+``ComplianceCheck`` row.
+
+Finished spans go to the exporter chosen by ``TRACING_EXPORTER``:
+
+- ``none`` drops them.
+- ``console`` logs one JSON line per span on the ``compliance.tracing``
+  logger.
+- ``file`` appends JSON lines to ``TRACING_FILE``.
+
+The span and exporter interfaces mirror OpenTelemetry's. Swapping in the
+real SDK later only needs an exporter that forwards spans.
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_current: contextvars.ContextVar = contextvars.ContextVar('compliance_tracing_span', default=None)
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+
+class SpanContext:
+    """Ids of a span, possibly one started in another process"""
+
+    __slots__ = ('trace_id', 'span_id')
+
+    def __init__(self, trace_id: str, span_id: str):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+    def traceparent(self) -> str:
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+
+class Span(SpanContext):
+    __slots__ = ('name', 'parent_id', 'attributes', 'status', 'error', 'start_ns', 'end_ns')
+
+    def __init__(self, name: str, parent: Optional[SpanContext] = None, attributes: Optional[Dict[str, Any]] = None):
+        super().__init__(parent.trace_id if parent else os.urandom(16).hex(), os.urandom(8).hex())
+        self.name = name
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.error = None
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.status = 'error'
+        self.error = f'{type(exc).__name__}: {exc}'[:500]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_ns': self.start_ns,
+            'duration_ms': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class NoopExporter:
+    def export(self, span: Span) -> None:
+        pass
+
+
+class ConsoleExporter:
+    def export(self, span: Span) -> None:
+        logger.info(json.dumps(span.to_dict(), default=str))
+
+
+class FileExporter:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        line = json.dumps(span.to_dict(), default=str) + '\n'
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line)
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                kind = getattr(settings, 'TRACING_EXPORTER', 'none')
+                if kind == 'console':
+                    _exporter = ConsoleExporter()
+                elif kind == 'file':
+                    _exporter = FileExporter(getattr(settings, 'TRACING_FILE', 'traces.jsonl'))
+                else:
+                    _exporter = NoopExporter()
+    return _exporter
+
+
+def reset_exporter():
+    """Drop the cached exporter, e.g. after settings change in tests"""
+    global _exporter
+    with _exporter_lock:
+        _exporter = None
+
+
+def current_span() -> Optional[SpanContext]:
+    return _current.get()
+
+
+def current_trace_id() -> str:
+    context = _current.get()
+    return context.trace_id if context else ''
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[SpanContext]:
+    match = TRACEPARENT_RE.match((header or '').strip().lower())
+    if not match or set(match.group(1)) == {'0'} or set(match.group(2)) == {'0'}:
+        return None
+    return SpanContext(match.group(1), match.group(2))
+
+
+@contextmanager
+def span(name: str, parent: Optional[SpanContext] = None, **attributes):
+    """Run the block in a child span of the current one, or of ``parent``"""
+    current = Span(name, parent or _current.get(), attributes)
+    token = _current.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current.reset(token)
+        try:
+            get_exporter().export(current)
+        except Exception as e:
+            logger.warning(f"Could not export span {name}: {str(e)}")
+
+
+def parse_multipart(request) -> None:
+    """Parse a multipart request body in a ``request.parse_multipart`` span.
+
+    Whatever reads ``request.POST`` or ``request.FILES`` first pays for the
+    parse: on uploads that is ``@idempotent`` hashing the payload, not the
+    view. Once the body is parsed this opens no span.
+    """
+    if request.content_type == 'multipart/form-data' and not hasattr(request, '_files'):
+        with span('request.parse_multipart', **{'http.request.bytes': int(request.META.get('CONTENT_LENGTH') or 0)}):
+            request.FILES
+
+
+def traced(name: str):
+    """Decorator form of ``span``"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapped
+    return decorator
+
+
+class TraceContextFilter(logging.Filter):
+    """Add ``trace_id`` and ``span_id`` of the current span to log records"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _current.get()
+        record.trace_id = context.trace_id if context else '-'
+        record.span_id = context.span_id if context else '-'
+        return True
+
+
+class TracingMiddleware:
+    """Root span per request; honours and returns W3C ``traceparent``"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        parent = parse_traceparent(request.META.get('HTTP_TRACEPARENT'))
+        with span(f'{request.method} {request.path}', parent=parent, **{'http.method': request.method}) as root:
+            response = self.get_response(request)
+            root.set_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                root.status = 'error'
+            response['traceparent'] = root.traceparent()
+            return response
@@ -7,6 +7,9 @@ urlpatterns = [
     path('check/', views.check_evidence_compliance, name='check_compliance'),
     path('status/<int:evidence_id>/', views.get_compliance_status, name='compliance_status'),
     path('checks/', views.list_compliance_checks, name='list_checks'),
+    path('checks/<int:compliance_check_id>/', views.compliance_check_detail, name='check_detail'),
     path('retry/<int:compliance_check_id>/', views.retry_compliance_check, name='retry_check'),
+    path('queue-stats/', views.queue_stats, name='queue_stats'),
     path('ai-status/', views.get_ai_status, name='ai_status'),
+    path('ai-stats/', views.get_ai_stats, name='ai_stats'),
 ]
@@ -1,9 +1,17 @@
-from django.http import JsonResponse
+from api import fastjson
+from api.fastjson import JsonResponse
+from api.idempotency import idempotent
+from api.ratelimit import rate_limit
+from api.response_cache import cache_company_response
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-import json
+from django.db.models import Q
+from django.utils import timezone
+import base64
+import binascii
 import logging
+from datetime import datetime, timedelta
 
 from .models import ComplianceCheck
 from .services import ComplianceAIService, MockAIService
@@ -13,6 +21,8 @@ logger = logging.getLogger(__name__)
 
 @require_http_methods(["POST"])
 @csrf_exempt
+@idempotent("compliance-check")
+@rate_limit("ai-analysis")
 def check_evidence_compliance(request):
     """Check compliance for uploaded evidence"""
     # Check if user is authenticated
@@ -20,7 +30,7 @@ def check_evidence_compliance(request):
         return JsonResponse({"error": "Authentication credentials were not provided."}, status=403)
     
     try:
-        data = json.loads(request.body)
+        data = fastjson.loads(request.body)
         evidence_id = data.get('evidence_id')
         
         if not evidence_id:
@@ -38,7 +48,7 @@ def check_evidence_compliance(request):
         return JsonResponse({
             "compliance_check_id": compliance_check.id,
             "status": compliance_check.status,
-            "ai_analysis": compliance_check.ai_analysis,
+            "ai_analysis": compliance_check.analysis,
             "rejection_reason": compliance_check.rejection_reason,
             "recommendations": compliance_check.recommendations
         })
@@ -62,7 +72,7 @@ def get_compliance_status(request, evidence_id):
         return JsonResponse({
             "compliance_check_id": compliance_check.id,
             "status": compliance_check.status,
-            "ai_analysis": compliance_check.ai_analysis,
+            "ai_analysis": compliance_check.analysis,
             "rejection_reason": compliance_check.rejection_reason,
             "recommendations": compliance_check.recommendations,
             "created_at": compliance_check.created_at.isoformat(),
@@ -76,10 +86,55 @@ def get_compliance_status(request, evidence_id):
         return JsonResponse({"error": str(e)}, status=500)
 
 
+CHECKS_PAGE_SIZE = 100
+CHECKS_MAX_PAGE_SIZE = 500
+
+# Summary columns returned by the list endpoint; heavy fields are served by
+# compliance_check_detail.
+CHECK_SUMMARY_FIELDS = (
+    "id", "evidence_id", "evidence__name", "evidence__control_id", "evidence__control__name",
+    "status", "is_compliant", "confidence", "control_type", "created_at", "updated_at",
+)
+
+
+def check_summary(row) -> dict:
+    """API shape of a ``values(*CHECK_SUMMARY_FIELDS)`` row"""
+    return {
+        "id": row["id"],
+        "evidence_id": row["evidence_id"],
+        "evidence_name": row["evidence__name"],
+        "control_id": row["evidence__control_id"],
+        "control_name": row["evidence__control__name"],
+        "status": row["status"],
+        "is_compliant": row["is_compliant"],
+        "confidence": row["confidence"],
+        "control_type": row["control_type"],
+        "created_at": row["created_at"].isoformat(),
+        "updated_at": row["updated_at"].isoformat(),
+    }
+
+
+def encode_cursor(created_at, check_id) -> str:
+    raw = f"{created_at.isoformat()}|{check_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    padded = cursor + "=" * (-len(cursor) % 4)
+    created_at, check_id = base64.urlsafe_b64decode(padded.encode()).decode().split("|")
+    return datetime.fromisoformat(created_at), int(check_id)
+
+
 @require_http_methods(["GET"])
 @csrf_exempt
+@cache_company_response("compliance-check-list")
 def list_compliance_checks(request):
-    """List all compliance checks for the user's company"""
+    """List compliance check summaries for the user's company.
+
+    Newest first, keyset paginated: pass ``next_cursor`` back as ``cursor``.
+    Optional filters: ``status`` and ``control`` (control id); ``limit``
+    defaults to 100, at most 500.
+    """
     # Check if user is authenticated
     if not request.user.is_authenticated:
         return JsonResponse({"error": "Authentication credentials were not provided."}, status=403)
@@ -90,34 +145,77 @@ def list_compliance_checks(request):
         if not company:
             return JsonResponse({"error": "User not assigned to a company"}, status=400)
         
-        checks = ComplianceCheck.objects.filter(
-            evidence__company=company
-        ).select_related('evidence', 'evidence__control')
-        
-        results = []
-        for check in checks:
-            results.append({
-                "id": check.id,
-                "evidence_id": check.evidence.id,
-                "evidence_name": check.evidence.name,
-                "control_name": check.evidence.control.name,
-                "status": check.status,
-                "ai_analysis": check.ai_analysis,
-                "rejection_reason": check.rejection_reason,
-                "recommendations": check.recommendations,
-                "created_at": check.created_at.isoformat(),
-                "updated_at": check.updated_at.isoformat()
-            })
-        
-        return JsonResponse({"compliance_checks": results})
+        try:
+            limit = min(max(int(request.GET.get("limit", CHECKS_PAGE_SIZE)), 1), CHECKS_MAX_PAGE_SIZE)
+            cursor = decode_cursor(request.GET["cursor"]) if request.GET.get("cursor") else None
+            control_id = int(request.GET["control"]) if request.GET.get("control") else None
+        except (ValueError, UnicodeDecodeError, binascii.Error):
+            return JsonResponse({"error": "Invalid limit, cursor or control"}, status=400)
+        
+        # Same rows as the dashboard's first page, which its next_cursor continues
+        checks = ComplianceCheck.objects.alive().filter(evidence__company=company)
+        if request.GET.get("status"):
+            checks = checks.filter(status=request.GET["status"])
+        if control_id is not None:
+            checks = checks.filter(evidence__control_id=control_id)
+        if cursor is not None:
+            created_at, check_id = cursor
+            checks = checks.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=check_id))
+        
+        rows = list(checks.order_by("-created_at", "-id").values(*CHECK_SUMMARY_FIELDS)[:limit + 1])
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        
+        results = [check_summary(row) for row in rows]
+        next_cursor = encode_cursor(rows[-1]["created_at"], rows[-1]["id"]) if has_more else None
+        
+        return JsonResponse({"compliance_checks": results, "next_cursor": next_cursor})
         
     except Exception as e:
         logger.error(f"Failed to list compliance checks: {str(e)}")
         return JsonResponse({"error": str(e)}, status=500)
 
 
+@require_http_methods(["GET"])
+@csrf_exempt
+def compliance_check_detail(request, compliance_check_id):
+    """Full compliance check, including the AI analysis, for the user's company"""
+    # Check if user is authenticated
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication credentials were not provided."}, status=403)
+    
+    try:
+        check = ComplianceCheck.objects.select_related(
+            'evidence', 'evidence__control', 'raw_analysis'
+        ).get(id=compliance_check_id, evidence__company=request.user.company)
+        
+        return JsonResponse({
+            "id": check.id,
+            "evidence_id": check.evidence.id,
+            "evidence_name": check.evidence.name,
+            "control_id": check.evidence.control.id,
+            "control_name": check.evidence.control.name,
+            "status": check.status,
+            "is_compliant": check.is_compliant,
+            "confidence": check.confidence,
+            "control_type": check.control_type,
+            "ai_analysis": check.analysis,
+            "rejection_reason": check.rejection_reason,
+            "recommendations": check.recommendations,
+            "created_at": check.created_at.isoformat(),
+            "updated_at": check.updated_at.isoformat()
+        })
+        
+    except ComplianceCheck.DoesNotExist:
+        return JsonResponse({"error": "Compliance check not found"}, status=404)
+    except Exception as e:
+        logger.error(f"Failed to get compliance check: {str(e)}")
+        return JsonResponse({"error": str(e)}, status=500)
+
+
 @require_http_methods(["POST"])
 @csrf_exempt
+@rate_limit("ai-analysis")
 def retry_compliance_check(request, compliance_check_id):
     """Retry a failed compliance check"""
     # Check if user is authenticated
@@ -131,11 +229,7 @@ def retry_compliance_check(request, compliance_check_id):
         if compliance_check.status not in [ComplianceCheck.STATUS_REJECTED, ComplianceCheck.STATUS_ERROR]:
             return JsonResponse({"error": "Can only retry failed checks"}, status=400)
         
-        # Reset status and retry
-        compliance_check.status = ComplianceCheck.STATUS_PENDING
-        compliance_check.rejection_reason = ""
-        compliance_check.save()
-        
+        # check_compliance claims the check itself, so no reset is needed
         # Use real AI service if configured, otherwise fall back to mock
         try:
             ai_service = ComplianceAIService()
@@ -148,7 +242,7 @@ def retry_compliance_check(request, compliance_check_id):
         return JsonResponse({
             "compliance_check_id": updated_check.id,
             "status": updated_check.status,
-            "ai_analysis": updated_check.ai_analysis,
+            "ai_analysis": updated_check.analysis,
             "rejection_reason": updated_check.rejection_reason,
             "recommendations": updated_check.recommendations
         })
@@ -170,20 +264,60 @@ def get_ai_status(request):
     
     try:
         from django.conf import settings
+        from .providers import get_router
         
         ai_url = getattr(settings, 'AI_API_URL', None)
         ai_key = getattr(settings, 'AI_API_KEY', None)
         ai_model = getattr(settings, 'AI_MODEL', 'gpt-4-vision-preview')
+        router = get_router()
         
-        is_configured = bool(ai_url and ai_key)
+        is_configured = router.is_configured()
         
         return JsonResponse({
             "is_configured": is_configured,
             "api_url": ai_url if is_configured else None,
             "model": ai_model,
-            "has_api_key": bool(ai_key)
+            "has_api_key": bool(ai_key),
+            "routing_strategy": router.strategy,
+            "providers": router.describe()
         })
         
     except Exception as e:
         logger.error(f"Failed to get AI status: {str(e)}")
-        return JsonResponse({"error": str(e)}, status=500)
\ No newline at end of file
+        return JsonResponse({"error": str(e)}, status=500)
+
+@require_http_methods(["GET"])
+@csrf_exempt
+def queue_stats(request):
+    """Pending analysis queue depth and wait per company and lane"""
+    # Check if user is authenticated
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication credentials were not provided."}, status=403)
+    
+    from .scheduler import fair_scheduler
+    
+    # Staff see every tenant, everyone else only their own company
+    company_filter = None if request.user.is_staff else [request.user.company_id]
+    return JsonResponse({"tenants": fair_scheduler.queue_stats(company_filter)})
+
+
+@require_http_methods(["GET"])
+@csrf_exempt
+def get_ai_stats(request):
+    """Latency percentiles, error rates, token usage and cost of AI calls"""
+    # Check if user is authenticated
+    if not request.user.is_authenticated:
+        return JsonResponse({"error": "Authentication credentials were not provided."}, status=403)
+    
+    # The provider pool is shared by every company
+    if not request.user.is_staff:
+        return JsonResponse({"error": "Only staff can view AI call statistics"}, status=403)
+    
+    try:
+        hours = min(max(int(request.GET.get('hours', 24)), 1), 24 * 90)
+    except ValueError:
+        return JsonResponse({"error": "hours must be an integer"}, status=400)
+    
+    from .ai_stats import ai_call_stats
+    
+    return JsonResponse(ai_call_stats(timezone.now() - timedelta(hours=hours)))
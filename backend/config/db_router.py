@@ -0,0 +1,125 @@
+"""
+Primary/replica database routing with read-your-writes stickiness.
+
+Writes always go to ``default``. Reads go to a random alias of
+``DATABASE_REPLICAS`` unless the current context is pinned to the primary,
+which it is:
+
+- for the rest of the request, command or worker thread once it has
+  written anything, so a write is never followed by a lagging read;
+- for the whole of POST, PUT, PATCH and DELETE requests, so read-modify-write
+  code sees current rows;
+- for ``READ_YOUR_WRITES_SECONDS`` after a client's last write.
+  ``ReadYourWritesMiddleware`` sets a cookie holding the time the pin ends,
+  so an upload is in the very next list the uploader fetches even while the
+  replicas trail the primary;
+- inside ``use_primary()``.
+
+With no replicas configured everything reads from ``default`` and the
+middleware never sets the cookie. Replica aliases mirror ``default`` under
+test (``TEST: {'MIRROR': 'default'}``). So the routing can be tried with an
+SQLite stand-in, or with a second local PostgreSQL set up as a streaming
+replica through ``DB_REPLICA_HOSTS``.
+"""
+import contextvars
+import random
+import time
+from contextlib import contextmanager
+from typing import List
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PRIMARY_COOKIE = 'db_primary_until'
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+# Pins set by the request or use_primary(), and writes; kept apart so leaving
+# a use_primary() block cannot drop the pin of a write made inside it
+_pinned: contextvars.ContextVar = contextvars.ContextVar('db_pinned_to_primary', default=False)
+_wrote: contextvars.ContextVar = contextvars.ContextVar('db_wrote', default=False)
+
+
+def replicas() -> List[str]:
+    return list(getattr(settings, 'DATABASE_REPLICAS', []))
+
+
+def read_your_writes_seconds() -> int:
+    return int(getattr(settings, 'READ_YOUR_WRITES_SECONDS', 15))
+
+
+def pinned_to_primary() -> bool:
+    """True while the current context reads from the primary despite replicas"""
+    return _pinned.get() or _wrote.get()
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside the block"""
+    token = _pinned.set(True)
+    try:
+        yield
+    finally:
+        _pinned.reset(token)
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        aliases = replicas()
+        if not aliases or pinned_to_primary():
+            return DEFAULT_DB_ALIAS
+        return random.choice(aliases)
+
+    def db_for_write(self, model, **hints):
+        _wrote.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Every alias holds the same data
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReadYourWritesMiddleware:
+    """Pin a client's reads to the primary for a while after it writes.
+
+    Place it before SessionMiddleware so the session and user lookups are
+    routed too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not replicas():
+            return self.get_response(request)
+
+        ttl = read_your_writes_seconds()
+        now = time.time()
+        try:
+            until = float(request.COOKIES.get(PRIMARY_COOKIE, 0))
+        except ValueError:
+            until = 0
+        # The cookie is client controlled, so it can never pin longer than the TTL
+        pinned = request.method in UNSAFE_METHODS or now < until <= now + ttl
+
+        pinned_token = _pinned.set(pinned)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            wrote = _wrote.get()
+        finally:
+            _wrote.reset(wrote_token)
+            _pinned.reset(pinned_token)
+
+        if wrote:
+            response.set_cookie(
+                PRIMARY_COOKIE,
+                str(int(now + ttl)),
+                max_age=ttl,
+                secure=settings.SESSION_COOKIE_SECURE,
+                httponly=True,
+                samesite=settings.SESSION_COOKIE_SAMESITE,
+            )
+        return response
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,11 +49,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'compliance.tracing.TracingMiddleware',
+    'config.db_router.ReadYourWritesMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'compliance.profiling.RequestProfilingMiddleware',
     'social_django.middleware.SocialAuthExceptionMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
@@ -94,6 +98,44 @@ DATABASES = {
     }
 }
 
+# Read replicas: DB_REPLICA_HOSTS lists host[:port] of streaming replicas of
+# the primary (same name and credentials). Reads go to a random replica and
+# writes to default; a client's reads stay on default for
+# DB_READ_YOUR_WRITES_SECONDS after its last write (config/db_router.py).
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+DATABASE_REPLICAS = []
+for index, replica in enumerate(DB_REPLICA_HOSTS, start=1):
+    replica_host, _, replica_port = replica.partition(':')
+    DATABASES[f'replica{index}'] = {
+        **DATABASES['default'],
+        'HOST': replica_host,
+        'PORT': replica_port or DATABASES['default']['PORT'],
+        # Tests read the primary's test database through this alias
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{index}')
+DATABASE_ROUTERS = ['config.db_router.PrimaryReplicaRouter']
+READ_YOUR_WRITES_SECONDS = int(os.getenv('DB_READ_YOUR_WRITES_SECONDS', '15'))
+
+
+# Cache
+# Shared across gunicorn workers and nodes when REDIS_URL is set; used for
+# request coalescing and other cross-worker coordination.
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -155,6 +197,16 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    # orjson-backed; same wire format as DRF's JSONRenderer/JSONParser
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
 AUTH_USER_MODEL = 'accounts.User'
@@ -218,3 +270,113 @@ SOCIAL_AUTH_LOGOUT_REDIRECT_URL = 'http://localhost:3000/login/'
 AI_API_URL = os.getenv('AI_API_URL')
 AI_API_KEY = os.getenv('AI_API_KEY')
 AI_MODEL = os.getenv('AI_MODEL', 'gpt-4o-mini')
+
+# AI providers: a JSON list of {"provider", "api_url", "api_key" | "api_keys", "model", "weight"}.
+# Defaults to a single Gemini endpoint built from AI_API_URL / AI_API_KEY.
+# AI_API_KEYS (comma separated) spreads load over several keys for that endpoint.
+AI_API_KEYS = [key.strip() for key in os.getenv('AI_API_KEYS', '').split(',') if key.strip()]
+AI_PROVIDERS = json.loads(os.getenv('AI_PROVIDERS', 'null')) or [
+    {
+        'provider': 'gemini',
+        'api_url': AI_API_URL,
+        'api_keys': AI_API_KEYS or [AI_API_KEY],
+        'model': AI_MODEL,
+    }
+]
+# weighted_round_robin or least_outstanding
+AI_ROUTING_STRATEGY = os.getenv('AI_ROUTING_STRATEGY', 'weighted_round_robin')
+
+# Near-duplicate verdict reuse: max Hamming distance between 64-bit dHashes,
+# minimum confidence of a verdict before it is reused, and index refresh period.
+PHASH_MATCH_RADIUS = int(os.getenv('PHASH_MATCH_RADIUS', '6'))
+PHASH_REUSE_MIN_CONFIDENCE = float(os.getenv('PHASH_REUSE_MIN_CONFIDENCE', '0.8'))
+PHASH_INDEX_TTL = int(os.getenv('PHASH_INDEX_TTL', '300'))
+
+# Seconds a worker may hold a compliance check before it is considered dead
+# and the check is requeued; renewed every third of that while the AI call runs.
+COMPLIANCE_LEASE_SECONDS = int(os.getenv('COMPLIANCE_LEASE_SECONDS', '120'))
+
+# Store the full AI response of each compliance check zlib-compressed
+COMPLIANCE_RAW_COMPRESS = os.getenv('COMPLIANCE_RAW_COMPRESS', 'true').lower() == 'true'
+
+# Per-company cache of list responses; entries are invalidated by a data
+# version bump on every write, the TTL only bounds memory
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', '300'))
+
+# Control and evidence lists longer than this are streamed as they are read
+# instead of being built in memory; streamed responses skip the cache
+STREAM_LIST_ABOVE = int(os.getenv('STREAM_LIST_ABOVE', '1000'))
+
+# Largest single file accepted from a bulk evidence import archive
+EVIDENCE_IMPORT_MAX_FILE_SIZE = int(os.getenv('EVIDENCE_IMPORT_MAX_FILE_SIZE', str(20 * 1024 * 1024)))
+
+# Idempotency-Key: how long responses are replayed, how long a first request
+# may run before a duplicate takes over, and the Retry-After sent with the 409
+# answering a duplicate of a request still in progress
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', str(24 * 60 * 60)))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv('IDEMPOTENCY_LOCK_SECONDS', '120'))
+IDEMPOTENCY_RETRY_AFTER = int(os.getenv('IDEMPOTENCY_RETRY_AFTER', '1'))
+
+# Fair scheduling of queued AI analyses: checks one company may have in
+# flight at once, and the share of each batch given to each lane
+COMPLIANCE_TENANT_MAX_CONCURRENCY = int(os.getenv('COMPLIANCE_TENANT_MAX_CONCURRENCY', '2'))
+COMPLIANCE_LANE_WEIGHTS = {
+    'interactive': int(os.getenv('COMPLIANCE_INTERACTIVE_WEIGHT', '4')),
+    'background': int(os.getenv('COMPLIANCE_BACKGROUND_WEIGHT', '1')),
+}
+
+# Rate limits on the endpoints that call the AI service, per company plan:
+# [requests, window seconds] for the whole company and for each user.
+# RATE_LIMIT_PLANS takes the same shape as JSON.
+RATE_LIMIT_PLANS = json.loads(os.getenv('RATE_LIMIT_PLANS', 'null')) or {
+    'free': {'company': [20, 60], 'user': [10, 60]},
+    'standard': {'company': [120, 60], 'user': [30, 60]},
+    'enterprise': {'company': [600, 60], 'user': [120, 60]},
+}
+
+# run_scheduler: approvals older than this are re-verified in the background,
+# with each pass's checks spread at random over the jitter window
+COMPLIANCE_REVERIFY_AFTER_DAYS = float(os.getenv('COMPLIANCE_REVERIFY_AFTER_DAYS', '90'))
+COMPLIANCE_REVERIFY_JITTER_SECONDS = float(os.getenv('COMPLIANCE_REVERIFY_JITTER_SECONDS', '3600'))
+
+# USD per million input and output tokens by model, for /api/compliance/ai-stats/.
+# AI_TOKEN_PRICES takes the same shape as JSON; unpriced models report no cost.
+AI_TOKEN_PRICES = json.loads(os.getenv('AI_TOKEN_PRICES', 'null')) or {
+    'gpt-4o-mini': [0.15, 0.60],
+    'gpt-4o': [2.50, 10.00],
+    'gemini-2.0-flash': [0.10, 0.40],
+    'gemini-1.5-flash': [0.075, 0.30],
+}
+
+# Tracing of the upload-to-verdict pipeline: none, console (JSON lines on the
+# compliance.tracing logger) or file (JSON lines appended to TRACING_FILE)
+TRACING_EXPORTER = os.getenv('TRACING_EXPORTER', 'none')
+TRACING_FILE = os.getenv('TRACING_FILE', str(BASE_DIR / 'traces.jsonl'))
+
+# App loggers carry the current trace and span ids
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'filters': {
+        'trace_context': {'()': 'compliance.tracing.TraceContextFilter'},
+    },
+    'formatters': {
+        'traced': {'format': '%(asctime)s %(levelname)s %(name)s [trace=%(trace_id)s span=%(span_id)s] %(message)s'},
+    },
+    'handlers': {
+        'traced_console': {
+            'class': 'logging.StreamHandler',
+            'filters': ['trace_context'],
+            'formatter': 'traced',
+        },
+    },
+    'loggers': {
+        'api': {'handlers': ['traced_console'], 'level': 'INFO', 'propagate': False},
+        'compliance': {'handlers': ['traced_console'], 'level': 'INFO', 'propagate': False},
+    },
+}
+
+# On-demand request profiles (X-Profile: 1 or ?_profile=1, admins only):
+# where the pstats files go and how many of the newest are kept
+REQUEST_PROFILE_DIR = os.getenv('REQUEST_PROFILE_DIR', str(BASE_DIR / 'profiles'))
+REQUEST_PROFILE_MAX = int(os.getenv('REQUEST_PROFILE_MAX', '50'))
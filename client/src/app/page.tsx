@@ -1,6 +1,6 @@
 "use client";
 
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import { useRouter } from "next/navigation";
 import { Control, Evidence } from "./types";
 import Snackbar from "./components/Snackbar";
@@ -8,6 +8,28 @@ import UploadProgress from "./components/UploadProgress";
 import ConfirmationDialog from "./components/ConfirmationDialog";
 
 const API_BASE = "/api";
+// Attempts per upload, the first one included
+const UPLOAD_ATTEMPTS = 3;
+
+const retryDelayMs = (res: Response | null, attempt: number) => {
+  const retryAfter = Number(res?.headers.get("Retry-After"));
+  return retryAfter > 0 ? retryAfter * 1000 : attempt * 1000;
+};
+
+// Resend on network errors, 409 (the first attempt is still running) and 5xx
+// (nothing was stored for the key); the caller keeps the Idempotency-Key
+const postWithRetries = async (url: string, init: RequestInit): Promise<Response> => {
+  for (let attempt = 1; ; attempt++) {
+    let res: Response | null = null;
+    try {
+      res = await fetch(url, init);
+      if ((res.status !== 409 && res.status < 500) || attempt === UPLOAD_ATTEMPTS) return res;
+    } catch (err) {
+      if (attempt === UPLOAD_ATTEMPTS) throw err;
+    }
+    await new Promise((resolve) => setTimeout(resolve, retryDelayMs(res, attempt)));
+  }
+};
 
 export default function Home() {
   const [controls, setControls] = useState<Control[]>([]);
@@ -20,6 +42,11 @@ export default function Home() {
   const [selectedControl, setSelectedControl] = useState<string>("");
   const [user, setUser] = useState<any>(null);
   const [complianceChecks, setComplianceChecks] = useState<any[]>([]);
+  const [checksCursor, setChecksCursor] = useState<string | null>(null);
+  const [loadingMoreChecks, setLoadingMoreChecks] = useState(false);
+  const [checkDetails, setCheckDetails] = useState<Record<number, any>>({});
+  // One key per chosen file and control, kept across retries of that upload
+  const uploadKey = useRef<string | null>(null);
 
   const [snackbar, setSnackbar] = useState({
     message: "",
@@ -41,6 +68,10 @@ export default function Home() {
     checkAuth();
   }, []);
 
+  useEffect(() => {
+    uploadKey.current = null;
+  }, [selectedFile, selectedControl]);
+
   const showSnackbar = (
     message: string,
     type: "success" | "error" | "info" | "warning" = "info"
@@ -69,19 +100,12 @@ export default function Home() {
 
   const checkAuth = async () => {
     try {
-      // First check if user is authenticated
-      const userRes = await fetch(`${API_BASE}/user/`, {
-        credentials: "include",
-      });
-      if (!userRes.ok) {
+      // One request loads the user and all dashboard data
+      const loaded = await fetchData();
+      if (!loaded) {
         // User not authenticated, redirect to login
         router.push("/login");
-        return;
       }
-
-      // User is authenticated, load user info and data
-      setUser(await userRes.json());
-      fetchData();
     } catch (error) {
       console.error("Auth check failed:", error);
       router.push("/login");
@@ -97,37 +121,35 @@ export default function Home() {
     }
   };
 
-  const fetchData = async () => {
+  const fetchData = async (): Promise<boolean> => {
     try {
       setLoading(true);
-      console.log("Fetching data...");
-
-      const [controlsRes, evidenceRes] = await Promise.all([
-        fetch(`${API_BASE}/control/`, { credentials: "include" }),
-        fetch(`${API_BASE}/evidence/`, { credentials: "include" }),
-      ]);
-
-      console.log("Controls response:", controlsRes.status, controlsRes.ok);
-      console.log("Evidence response:", evidenceRes.status, evidenceRes.ok);
+      console.log("Fetching dashboard...");
 
-      if (!controlsRes.ok || !evidenceRes.ok) {
-        const errorMsg = `Failed to fetch data - Controls: ${controlsRes.status}, Evidence: ${evidenceRes.status}`;
+      const res = await fetch(`${API_BASE}/dashboard/`, {
+        credentials: "include",
+      });
+      if (res.status === 401 || res.status === 403) return false;
+      if (!res.ok) {
+        const errorMsg = `Failed to fetch dashboard: ${res.status}`;
         console.error(errorMsg);
         throw new Error(errorMsg);
       }
 
-      const controlsData = await controlsRes.json();
-      const evidenceData = await evidenceRes.json();
-
-      console.log("Controls data:", controlsData);
-      console.log("Evidence data:", evidenceData);
-
-      setControls(controlsData);
-      setEvidence(evidenceData);
-      loadComplianceChecks();
+      const data = await res.json();
+      console.log("Dashboard data:", data);
+
+      setUser(data.user);
+      setControls(data.controls);
+      setEvidence(data.evidence);
+      setComplianceChecks(data.compliance_checks);
+      setChecksCursor(data.next_cursor ?? null);
+      setCheckDetails({});
+      return true;
     } catch (err) {
       console.error("Fetch data error:", err);
       setError(err instanceof Error ? err.message : "An error occurred");
+      return true;
     } finally {
       setLoading(false);
     }
@@ -150,10 +172,15 @@ export default function Home() {
     formData.append("control", selectedControl);
     formData.append("name", selectedFile.name);
 
+    // Lets the server replay the result if this upload is retried
+    uploadKey.current ??= crypto.randomUUID();
+    const idempotencyKey = uploadKey.current;
+
     try {
-      const res = await fetch(`${API_BASE}/evidence/upload/`, {
+      const res = await postWithRetries(`${API_BASE}/evidence/upload/`, {
         method: "POST",
         credentials: "include",
+        headers: { "Idempotency-Key": idempotencyKey },
         body: formData,
       });
       if (res.ok) {
@@ -233,26 +260,81 @@ export default function Home() {
     }
   };
 
+  // The list is a keyset-paginated summary, newest first; next_cursor
+  // fetches the following page
+  const fetchComplianceChecks = async (cursor: string | null) => {
+    const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : "";
+    const res = await fetch(`${API_BASE}/compliance/checks/${query}`, {
+      credentials: "include",
+    });
+    if (!res.ok) return null;
+    const data = await res.json();
+    return {
+      checks: (data.compliance_checks || []) as any[],
+      nextCursor: (data.next_cursor ?? null) as string | null,
+    };
+  };
+
   const loadComplianceChecks = async () => {
     try {
-      const res = await fetch(`${API_BASE}/compliance/checks/`, {
+      const page = await fetchComplianceChecks(null);
+      if (!page) return;
+      setComplianceChecks(page.checks);
+      setChecksCursor(page.nextCursor);
+      setCheckDetails({});
+    } catch {
+      console.error("Failed to load compliance checks");
+    }
+  };
+
+  const loadMoreComplianceChecks = async () => {
+    if (!checksCursor) return;
+    setLoadingMoreChecks(true);
+    try {
+      const page = await fetchComplianceChecks(checksCursor);
+      if (!page) return;
+      setComplianceChecks((prev) => [...prev, ...page.checks]);
+      setChecksCursor(page.nextCursor);
+    } catch {
+      console.error("Failed to load compliance checks");
+    } finally {
+      setLoadingMoreChecks(false);
+    }
+  };
+
+  const loadCheckDetails = async (checkId: number) => {
+    try {
+      const res = await fetch(`${API_BASE}/compliance/checks/${checkId}/`, {
         credentials: "include",
       });
       if (res.ok) {
         const data = await res.json();
-        console.log("Compliance checks loaded:", data);
-        setComplianceChecks(data.compliance_checks || []);
+        setCheckDetails((prev) => ({ ...prev, [checkId]: data }));
       }
     } catch {
-      console.error("Failed to load compliance checks");
+      console.error("Failed to load compliance check details");
     }
   };
 
-  const getComplianceStatus = (evidenceId: number) =>
-    complianceChecks.find((c) => c.evidence_id === evidenceId)?.status;
-
-  const getComplianceDetails = (evidenceId: number) =>
-    complianceChecks.find((c) => c.evidence_id === evidenceId);
+  // Carried on the evidence row itself, since the check list is paged
+  const getComplianceStatus = (item: Evidence) =>
+    item.compliance_check_status ?? undefined;
+
+  const getComplianceDetails = (evidenceId: number) => {
+    const summary = complianceChecks.find((c) => c.evidence_id === evidenceId);
+    if (!summary) return undefined;
+    if (checkDetails[summary.id]) return checkDetails[summary.id];
+    return {
+      ...summary,
+      ai_analysis:
+        summary.is_compliant === null || summary.is_compliant === undefined
+          ? null
+          : {
+              is_compliant: summary.is_compliant,
+              confidence: summary.confidence,
+            },
+    };
+  };
   const getComplianceStatusColor = (status: string) => {
     switch (status) {
       case "approved":
@@ -504,7 +586,7 @@ export default function Home() {
               </div>
             ) : (
               evidence.map((item) => {
-                const complianceStatus = getComplianceStatus(item.id);
+                const complianceStatus = getComplianceStatus(item);
                 const complianceDetails = getComplianceDetails(item.id);
                 const isRejected = complianceStatus === "rejected";
                 const isApproved = complianceStatus === "approved";
@@ -787,6 +869,21 @@ export default function Home() {
                                 </p>
                               </div>
                             )}
+
+                            {/* Full analysis is fetched on demand */}
+                            {complianceDetails &&
+                              !checkDetails[complianceDetails.id] &&
+                              complianceDetails.status !== "pending" &&
+                              complianceDetails.status !== "processing" && (
+                                <button
+                                  onClick={() =>
+                                    loadCheckDetails(complianceDetails.id)
+                                  }
+                                  className="text-xs text-blue-400 hover:text-blue-300 underline"
+                                >
+                                  Show full AI analysis
+                                </button>
+                              )}
                           </div>
                         )}
                       </div>
@@ -817,6 +914,17 @@ export default function Home() {
                 );
               })
             )}
+            {checksCursor && (
+              <div className="mt-4 text-center">
+                <button
+                  onClick={loadMoreComplianceChecks}
+                  disabled={loadingMoreChecks}
+                  className="px-4 py-2 bg-gray-700 text-white rounded-lg hover:bg-gray-600 transition-colors disabled:opacity-50"
+                >
+                  {loadingMoreChecks ? "Loading..." : "Load more AI results"}
+                </button>
+              </div>
+            )}
           </div>
         </div>
       </main>
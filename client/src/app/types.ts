@@ -14,4 +14,6 @@ export interface Evidence {
   status: "approved" | "rejected";
   created_by: number;
   created_at: string;
+  // Latest AI check status, on dashboard and upload rows
+  compliance_check_status?: string | null;
 }